@@ -2,6 +2,8 @@
 subroutine fgmax_finalize()
 
     ! Print out the maxval and aux arrays and de-allocate storage.
+    ! The arrays are written as text, or as binary files with stream access
+    ! if FG_OUTPUT_FORMAT == 3.
 
     use fgmax_module
     use amr_module, only: mxnest
@@ -17,9 +19,6 @@ subroutine fgmax_finalize()
         fg => FG_fgrids(ifg)   
 
         cfg = char(ichar('0') + ifg)
-        fname = 'fort.FG' // cfg // '.valuemax'
-        print *, 'Writing to file ', fname
-        open(unit=FG_UNIT,file=trim(fname),status='unknown',form='formatted')
 
         do k=1,fg%npts
             do mv=1,FG_NUM_VAL
@@ -27,6 +26,41 @@ subroutine fgmax_finalize()
                     fg%valuemax(mv,k) = 0.d0
                     endif
                 enddo
+            enddo
+
+        if (FG_OUTPUT_FORMAT == 3) then
+            ! Binary output with one column of the ascii file after another,
+            ! each holding npts values in double precision:
+            fname = 'fort.FG' // cfg // '.valuemax.bin'
+            print *, 'Writing to file ', fname
+            open(unit=FG_UNIT,file=trim(fname),status='replace', &
+                 form='unformatted',access='stream')
+            write(FG_UNIT) fg%x(1:fg%npts), fg%y(1:fg%npts), &
+                  dble(fg%levelmax(1:fg%npts)), &
+                  ((fg%valuemax(mv,k), k=1,fg%npts), mv=1,FG_NUM_VAL), &
+                  ((fg%tmax(mv,k), k=1,fg%npts), mv=1,FG_NUM_VAL), &
+                  fg%arrival_time(1:fg%npts)
+            close(FG_UNIT)
+
+            do ma=1,FG_NUM_AUX
+                cma = char(ichar('0') + ma)
+                fname = 'fort.FG' // cfg // '.aux' // cma // '.bin'
+                print *, 'Writing to file ', fname
+                open(unit=FG_UNIT,file=trim(fname),status='replace', &
+                     form='unformatted',access='stream')
+                write(FG_UNIT) fg%x(1:fg%npts), fg%y(1:fg%npts), &
+                      ((fg%aux(level,ma,k), k=1,fg%npts), level=1,mxnest)
+                close(FG_UNIT)
+                enddo
+
+            cycle   ! no ascii output for this fgrid
+            endif
+
+        fname = 'fort.FG' // cfg // '.valuemax'
+        print *, 'Writing to file ', fname
+        open(unit=FG_UNIT,file=trim(fname),status='unknown',form='formatted')
+
+        do k=1,fg%npts
             write(FG_UNIT,111) fg%x(k),fg%y(k), fg%levelmax(k), &
                   (fg%valuemax(mv,k), mv=1,FG_NUM_VAL), &
                   (fg%tmax(mv,k), mv=1,FG_NUM_VAL), fg%arrival_time(k)
@@ -74,6 +74,10 @@ module fgmax_module
     ! number of fixed grids in use (set by fgmax_read):
     integer :: FG_num_fgrids
 
+    ! format of fgmax output files, 1 ==> ascii, 3 ==> binary (stream access)
+    ! Set in set_fgmax
+    integer :: FG_OUTPUT_FORMAT
+
     ! turn on debugging output to fort.61:
     logical, parameter :: FG_DEBUG = .false.
 
@@ -108,6 +112,7 @@ contains
         FG_NUM_VAL = num_fgmax_val        ! module variable name
         read(unit,'(i2)') num_fgmax_grids ! name used in setrun.py
         FG_num_fgrids = num_fgmax_grids   ! module variable name
+        read(unit,'(i2)') FG_OUTPUT_FORMAT
 
         if (FG_num_fgrids > FG_MAXNUM_FGRIDS) then
            write(6,601) FG_num_fgrids
@@ -127,6 +132,7 @@ contains
 
         write(parmunit,*) 'FG_NUM_VAL = ', FG_NUM_VAL
         write(parmunit,*) 'FG_num_fgrids = ', FG_num_fgrids
+        write(parmunit,*) 'FG_OUTPUT_FORMAT = ', FG_OUTPUT_FORMAT
 
     
         end subroutine set_fgmax
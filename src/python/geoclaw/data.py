@@ -208,6 +208,8 @@ class FGmaxData(clawpack.clawutil.data.ClawData):
         # File name for fgmax points and parameters:
         self.add_attribute('fgmax_files',[])
         self.add_attribute('num_fgmax_val',1)
+        # Format of fort.FG* output files, 'ascii' or 'binary':
+        self.add_attribute('fgmax_output_format','ascii')
 
 
     def write(self,data_source='setrun.py'):
@@ -219,6 +221,16 @@ class FGmaxData(clawpack.clawutil.data.ClawData):
         self.data_write(value=num_fgmax_val,alt_name='num_fgmax_val')
         num_fgmax_grids = len(self.fgmax_files)
         self.data_write(value=num_fgmax_grids,alt_name='num_fgmax_grids')
+        if self.fgmax_output_format in [1,'ascii']:
+            fgmax_output_format = 1
+        elif self.fgmax_output_format in [3,'binary']:
+            fgmax_output_format = 3
+        else:
+            raise ValueError("*** Error in data parameter: " + \
+                  "fgmax_output_format unrecognized: %s" \
+                  % self.fgmax_output_format)
+        self.data_write(value=fgmax_output_format,
+                        alt_name='fgmax_output_format')
         self.data_write()
         for fgmax_file in self.fgmax_files:
             fname = os.path.abspath(fgmax_file)
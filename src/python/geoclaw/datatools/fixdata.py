@@ -7,7 +7,11 @@ fixdata
 
     Contains:
         findbadindices
+        findbadmask
         fillbaddata
+        fillbadmask
+        filterdata
+        filtermask
 
 
 """
@@ -25,53 +29,101 @@ def findbadindices (Z,badvalue=inf,removenans=True):
         remove nans or infs from an array
     """
 
-    badind=[]
-    for i in xrange(shape(Z)[0]) :
-        for j in xrange(shape(Z)[1]):
+    badind = findbadmask(Z,badvalue,removenans).nonzero()
 
-            if Z[i,j]==inf:
-                badind.append((i,j))
-            elif Z[i,j]==badvalue:
-                badind.append((i,j))
+    return zip(badind[0].tolist(),badind[1].tolist())
 
-            if Z[i,j]!=Z[i,j] and removenans:
-                badind.append((i,j))
+#==============================================================================
+def findbadmask (Z,badvalue=inf,removenans=True):
+    """
+        return boolean array that is True where Z is inf or badvalue,
+        or nan if removenans
+    """
 
+    Z = asarray(Z)
+    badmask = (Z==inf) | (Z==badvalue)
+    if removenans:
+        badmask |= (Z!=Z)
 
-    return badind
+    return badmask
 
 #===============================================================================
-def fillbaddata (Z,badinds):
+def fillbaddata (Z,badinds,method='fill'):
 
     """
     fill data in array Z, at indice tuples in list badinds
     by averaging surrounding good data.
     return new array.
+
+    see fillbadmask for the methods.
+    """
+
+    badmask = zeros(shape(Z),dtype=bool)
+    if len(badinds) > 0:
+        badinds = array(badinds,dtype=int).reshape(-1,2)
+        badmask[badinds[:,0],badinds[:,1]] = True
+
+    return fillbadmask(Z,badmask,method)
+
+#===============================================================================
+def fillbadmask (Z,badmask,method='fill'):
+
+    """
+    fill data in array Z where the boolean array badmask is True.
+    return Z, which is modified in place.
+
+    method='fill' replaces each bad value by the average of the good data
+    in the smallest square (ball in inf-norm) around it containing good
+    data, method='nearest' by the nearest good value.
+
+    The whole array is processed at once: the radius of the square is the
+    chessboard distance transform of badmask and the averages come from
+    summed-area tables of the good data (non-finite good values are left
+    out of the averages).  Requires scipy.ndimage.
     """
-    
-    m=shape(Z)[0]
-    n=shape(Z)[1]
 
-    for ind in badinds :
-        i=ind[0]
-        j=ind[1]
-        r=0
-        indbad=True
-        while indbad and r < max(m,n):
-            r=r+1 #radius of ball around badinds in inf-norm (square)
-            irange=range(max(0,i-r),min(i+r+1,m))
-            jrange=range(max(0,j-r),min(j+r+1,n))
-            summands=0
-            sum=0.
-            for ii in irange:
-                for jj in jrange:
-                    ballind=(ii,jj)
-                    if not ballind in badinds:
-                        sum = sum + Z[ballind[0],ballind[1]]
-                        summands=summands+1
-            if summands >0 : 
-                Z[ind[0],ind[1]] = sum/summands
-                indbad=False
+    import scipy.ndimage
+
+    badmask = asarray(badmask,dtype=bool)
+    good = ~badmask
+    if not badmask.any() or not good.any():
+        return Z
+
+    if method == 'nearest':
+        ind = scipy.ndimage.distance_transform_edt(badmask,
+                  return_distances=False,return_indices=True)
+        Z[badmask] = Z[ind[0][badmask],ind[1][badmask]]
+
+    elif method == 'fill':
+        m=shape(Z)[0]
+        n=shape(Z)[1]
+
+        # radius of ball around bad points containing good data
+        radius = scipy.ndimage.distance_transform_cdt(badmask,
+                     metric='chessboard')
+
+        # summed-area tables of good data, offset by its mean for accuracy
+        valid = good & isfinite(Z)
+        offset = Z[valid].mean() if valid.any() else 0.
+        sums = zeros((m+1,n+1))
+        sums[1:,1:] = where(valid,Z - offset,0.).cumsum(0).cumsum(1)
+        counts = zeros((m+1,n+1),dtype=int)
+        counts[1:,1:] = valid.cumsum(0).cumsum(1)
+
+        i,j = badmask.nonzero()
+        r = radius[i,j]
+        i0 = maximum(i-r,0)
+        i1 = minimum(i+r+1,m)
+        j0 = maximum(j-r,0)
+        j1 = minimum(j+r+1,n)
+        summation = sums[i1,j1] - sums[i0,j1] - sums[i1,j0] + sums[i0,j0]
+        summands = counts[i1,j1] - counts[i0,j1] - counts[i1,j0] \
+                   + counts[i0,j0]
+        with errstate(divide='ignore',invalid='ignore'):
+            Z[i,j] = summation/summands + offset
+
+    else:
+        raise ValueError("Unknown method %s" % method)
 
     return Z
 
@@ -82,33 +134,58 @@ def filterdata (Z,filterinds,radius=1):
     filter data in array z, at indice tuples in list filterinds
     by averaging surrounding data, ball with radius=radius in inf-norm
     acts as a low-band pass filter and removes oscillatory data
-    """
 
-    m=shape(Z)[0]
-    n=shape(Z)[1]
-
-    for ind in filterinds :
-        i=ind[0]
-        j=ind[1]
-        r=radius
-
-        irange=range(max(0,i-r),min(i+r+1,m))
-        jrange=range(max(0,j-r),min(j+r+1,n))
-        summands=0
-        sum=0.
-        for ii in irange:
-            for jj in jrange:
-                ballind=(ii,jj)
-                sum = sum + Z[ballind[0],ballind[1]]
-                summands=summands+1
-        if summands >0 : 
-            Z[ind[0],ind[1]] = sum/summands
+    see filtermask.
+    """
 
-    return Z
+    mask = zeros(shape(Z),dtype=bool)
+    if len(filterinds) > 0:
+        filterinds = array(filterinds,dtype=int).reshape(-1,2)
+        mask[filterinds[:,0],filterinds[:,1]] = True
 
+    return filtermask(Z,mask,radius)
 
+#=====================================================================================
+def filtermask (Z,mask,radius=1):
+    """
+    filter data in array Z where the boolean array mask is True
+    by averaging surrounding data, ball with radius=radius in inf-norm
+    truncated at the edges of the array.
+    return Z, which is modified in place.
 
+    All points are filtered at once from a summed-area table of Z, so the
+    cost does not depend on radius.  Each average is of the unfiltered data,
+    also where neighbouring points are filtered.  Averages over balls 
+    containing nan or inf values are nan.
+    """
 
+    mask = asarray(mask,dtype=bool)
+    if not mask.any():
+        return Z
 
+    m=shape(Z)[0]
+    n=shape(Z)[1]
+    r=radius
+
+    # summed-area tables, offset by the mean for accuracy
+    finite = isfinite(Z)
+    offset = Z[finite].mean() if finite.any() else 0.
+    sums = zeros((m+1,n+1))
+    sums[1:,1:] = where(finite,Z - offset,0.).cumsum(0).cumsum(1)
+    nonfinite = zeros((m+1,n+1),dtype=int)
+    nonfinite[1:,1:] = (~finite).cumsum(0).cumsum(1)
+
+    i,j = mask.nonzero()
+    i0 = maximum(i-r,0)
+    i1 = minimum(i+r+1,m)
+    j0 = maximum(j-r,0)
+    j1 = minimum(j+r+1,n)
+    summation = sums[i1,j1] - sums[i0,j1] - sums[i1,j0] + sums[i0,j0]
+    summands = (i1 - i0) * (j1 - j0)
+    average = summation/summands + offset
+    numbad = nonfinite[i1,j1] - nonfinite[i0,j1] - nonfinite[i1,j0] \
+             + nonfinite[i0,j0]
+    Z[i,j] = where(numbad > 0,nan,average)
 
+    return Z
 
@@ -11,12 +11,14 @@ dtopo files, and calculating Okada based deformations.
 :Classes:
 
   - DTopography
+  - SubFaultTable
   - SubFault
   - Fault
   - UCSBFault
   - CSVFault
   - SiftFault
   - SegmentedPlaneFault
+  - SlipEnsemble
     
 :Functions:
   - convert_units
@@ -25,12 +27,17 @@ dtopo files, and calculating Okada based deformations.
   - Mw
   - strike_direction
   - rise_fraction
+  - okada_deformation
+  - okada_deformation_adaptive
 
 """
 
 import os
 import sys
 import re
+import copy
+import hashlib
+import multiprocessing
 
 import numpy
 
@@ -45,6 +52,31 @@ from clawpack.geoclaw.data import DEG2RAD, LAT2METER
 # Poisson ratio for Okada 
 poisson = 0.25
 
+# Maximum number of values in each temporary array of okada_deformation
+okada_block_size = 2**18
+
+# Approximate number of values of the deformations computed at once by
+# SlipEnsemble.write
+ensemble_block_size = 2**22
+
+# Parameters of a subfault stored in the columns of a SubFaultTable, the 
+# optional ones of dynamic ruptures are only stored once they are set
+subfault_parameters = ['longitude', 'latitude', 'depth', 'strike', 'dip', 
+                       'rake', 'length', 'width', 'slip', 'mu', 
+                       'coordinate_specification', 'rupture_time', 
+                       'rise_time', 'rise_time_ending']
+_optional_parameters = ['rupture_time', 'rise_time', 'rise_time_ending']
+_geometry_parameters = ['longitude', 'latitude', 'depth', 'strike', 'dip', 
+                        'length', 'width', 'coordinate_specification']
+
+# Fractions of the width down dip from the top edge of the point given by 
+# the longitude and latitude and of the point at the given depth for each
+# coordinate specification
+_coordinate_positions = {'top center': (0.0, 0.0), 
+                         'centroid': (0.5, 0.5),
+                         'bottom center': (1.0, 1.0), 
+                         'noaa sift': (1.0, 0.0)}
+
 # ==============================================================================
 #  Units dictionaries
 # ==============================================================================
@@ -254,26 +286,32 @@ def rise_fraction(t, t0, t_rise, t_rise_ending=None):
 
     *t* can be a scalar or a numpy array of times and the returned result
     will have the same type.  A list or tuple of times returns a numpy array.
+
+    *t0*, *t_rise* and *t_rise_ending* can also be arrays, e.g. holding the 
+    parameters of many subfaults, in which case the result is broadcast
+    against *t*.  A zero *t_rise* or *t_rise_ending* gives a one-sided ramp.
     """
 
-    scalar = (type(t) in [float,int])
+    scalar = (type(t) in [float,int]) and numpy.isscalar(t0)
     t = numpy.array(t)
 
     if t_rise_ending is None: 
         t_rise_ending = t_rise
 
-    t1 = t0+t_rise
-    t2 = t1+t_rise_ending
+    t1 = numpy.asarray(t0 + t_rise, dtype=float)
+    t2 = numpy.asarray(t1 + t_rise_ending, dtype=float)
 
     rf = numpy.where(t<=t0, 0., 1.)
-    if t2 != t0:
+    if numpy.any(t2 != t0):
 
-        t20 = float(t2-t0)
-        t10 = float(t1-t0)
-        t21 = float(t2-t1)
+        t20 = t2 - t0
+        t10 = t1 - t0
+        t21 = t2 - t1
 
-        c1 = t21 / (t20*t10*t21) 
-        c2 = t10 / (t20*t10*t21) 
+        # Each coefficient is only used where its interval is nonempty:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            c1 = 1. / (t20*t10)
+            c2 = 1. / (t20*t21)
 
         rf = numpy.where((t>t0) & (t<=t1), c1*(t-t0)**2, rf)
         rf = numpy.where((t>t1) & (t<=t2), 1. - c2*(t-t2)**2, rf)
@@ -284,10 +322,441 @@ def rise_fraction(t, t0, t_rise, t_rise_ending=None):
     return rf
 
 
+def _nan_separated(points):
+    r"""Coordinates of lines, *points[k][n]* of point *k* of line *n*, as a
+    single array with the lines separated by nan for one call to *plot*."""
+
+    points = numpy.asarray(points, dtype=float)
+    lines = numpy.empty((points.shape[1], points.shape[0] + 1))
+    lines.fill(numpy.nan)
+    lines[:,:-1] = points.T
+    return lines.ravel()
+
+
+def okada_deformation(subfaults, x, y, stack=False, dtype='float64',
+                      block_size=None, n_workers=1):
+    r"""
+    Vertical Okada deformation of several subfaults evaluated in one pass.
+
+    Computes the same displacement as calling *SubFault.okada* for each
+    subfault, but evaluates all subfaults with array operations over chunks
+    of subfaults and tiles of grid rows, so that no temporary array holds
+    more than about *block_size* values at a time.
+
+    :Input:
+      - *subfaults* (list) List of *SubFault* objects or a *SubFaultTable*.
+      - *x*, *y* (numpy.ndarray) 1d arrays of longitudes and latitudes.
+      - *stack* (bool) If *True* return the deformation of each subfault as
+        an array of shape *(len(subfaults), len(y), len(x))*, otherwise return
+        the sum over all subfaults with shape *(len(y), len(x))*.
+      - *dtype* (str or numpy.dtype) Floating point type used for the
+        computation and the result, e.g. *'float32'* to halve the memory
+        needed for large grids (agreeing with *'float64'* to about 1e-3 of
+        the maximum displacement).  Default is *'float64'*.
+      - *block_size* (int) Maximum number of values in each temporary array,
+        default is *okada_block_size*.
+      - *n_workers* (int) Number of processes sharing the work.  The grid
+        rows are split into tiles that a *multiprocessing.Pool* evaluates
+        in parallel, writing directly into an output array in shared memory.
+        *None* uses all cores.  Default is 1, no worker processes.
+
+    :Output:
+      - numpy.ndarray of vertical displacements.
+
+    """
+
+    dtype = numpy.dtype(dtype)
+    if block_size is None:
+        block_size = okada_block_size
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+
+    x = numpy.asarray(x, dtype=dtype)
+    y = numpy.asarray(y, dtype=dtype)
+    params = _okada_parameters(subfaults, dtype)
+    num_subfaults = len(subfaults)
+    my = y.shape[0]
+
+    if stack:
+        shape = (num_subfaults, y.shape[0], x.shape[0])
+    else:
+        shape = (y.shape[0], x.shape[0])
+
+    n_workers = min(n_workers, my)
+    if n_workers <= 1:
+        dz = numpy.zeros(shape, dtype=dtype)
+        _okada_rows(params, x, y, 0, my, dz, stack, block_size)
+        return dz
+
+    # A few tiles per worker to balance the load, each worker writes to 
+    # distinct rows of the shared output array:
+    raw, dz = util.shared_array(shape, dtype)
+    num_tiles = min(my, 4*n_workers)
+    edges = numpy.linspace(0, my, num_tiles + 1).astype(int)
+    tiles = zip(edges[:-1], edges[1:])
+    pool = multiprocessing.Pool(n_workers, initializer=_okada_worker_init,
+                 initargs=(raw, shape, params, x, y, stack, block_size))
+    try:
+        pool.map(_okada_worker, tiles)
+    finally:
+        pool.close()
+        pool.join()
+
+    return dz
+
+
+def okada_deformation_adaptive(subfaults, x, y, tolerance=None, 
+                               coarsening=16, stack=False, dtype='float64',
+                               block_size=None):
+    r"""
+    Vertical Okada deformation evaluated only where it is needed to resolve
+    it to within *tolerance*, interpolated everywhere else.
+
+    The deformation is first computed on every *coarsening*-th point of the
+    grid, splitting it into cells.  Each cell is then split in two in each
+    direction and the deformation is computed at the midpoints of its edges
+    and at its center.  The largest difference between these values and the
+    bilinear interpolation from the corners of the cell estimates the
+    interpolation error in the cell.  Cells where the estimate is above
+    *tolerance* are refined further, the others are filled by bilinear
+    interpolation from the points computed so far.  Smooth far fields,
+    e.g. the buffer around a megathrust source, are then covered by few
+    evaluations while steep gradients near the rupture are computed at
+    every grid point.
+
+    :Input:
+      - *subfaults* (list) List of *SubFault* objects or a *SubFaultTable*.
+      - *x*, *y* (numpy.ndarray) 1d arrays of longitudes and latitudes.
+      - *tolerance* (float) Accepted interpolation error in meters, default
+        is 1e-3 times the largest displacement on the coarse grid.  With
+        *stack* the error is measured by the sum over the subfaults, which
+        bounds the error of any combination of them with weights between 0
+        and 1, such as the time slices of a kinematic rupture.
+      - *coarsening* (int) Spacing in grid points of the initial evaluation.
+      - *stack*, *dtype*, *block_size* As in :func:`okada_deformation`.
+
+    :Output:
+      - *dz* (numpy.ndarray) Vertical displacements as returned by
+        :func:`okada_deformation`.
+      - *error* (numpy.ndarray) Error estimate of shape *(len(y), len(x))*,
+        0 at the points where the deformation was computed.
+
+    """
+
+    dtype = numpy.dtype(dtype)
+    if block_size is None:
+        block_size = okada_block_size
+
+    x = numpy.asarray(x, dtype=dtype)
+    y = numpy.asarray(y, dtype=dtype)
+    params = _okada_parameters(subfaults, dtype)
+    num_subfaults = params['x_bottom'].shape[0]
+    mx = x.shape[0]
+    my = y.shape[0]
+
+    dz = numpy.zeros((num_subfaults if stack else 1, my, mx), dtype=dtype)
+    computed = numpy.zeros((my, mx), dtype=bool)
+    error = numpy.zeros((my, mx))
+
+    # Corners of the coarse cells:
+    i = numpy.unique(numpy.r_[0:mx:coarsening, mx-1])
+    j = numpy.unique(numpy.r_[0:my:coarsening, my-1])
+    J, I = numpy.meshgrid(j, i, indexing='ij')
+    _okada_evaluate(params, x, y, J.ravel(), I.ravel(), dz, computed, stack,
+                    block_size)
+    if tolerance is None:
+        tolerance = 1e-3 * numpy.abs(dz[:,J,I]).sum(axis=0).max()
+
+    J0, I0 = numpy.meshgrid(j[:-1], i[:-1], indexing='ij')
+    J1, I1 = numpy.meshgrid(j[1:], i[1:], indexing='ij')
+    cells = [J0.ravel(), J1.ravel(), I0.ravel(), I1.ravel()]
+    accepted = []
+    while cells[0].shape[0] > 0:
+        j0, j1, i0, i1 = cells
+        jm = (j0 + j1) // 2
+        im = (i0 + i1) // 2
+
+        # Midpoints of the edges and center, which coincide with corners
+        # in directions where the cell is only one grid interval wide:
+        points = [(j0, im), (j1, im), (jm, i0), (jm, i1), (jm, im)]
+        _okada_evaluate(params, x, y, 
+                        numpy.concatenate([p[0] for p in points]),
+                        numpy.concatenate([p[1] for p in points]),
+                        dz, computed, stack, block_size)
+
+        cell_error = numpy.zeros(j0.shape)
+        for (jp, ip) in points:
+            interpolated = _bilinear_cells(x, y, dz, j0, j1, i0, i1, jp, ip)
+            cell_error = numpy.maximum(cell_error, 
+                           numpy.abs(dz[:,jp,ip] - interpolated).sum(axis=0))
+
+        refine = (cell_error > tolerance) & ((j1 - j0 > 1) | (i1 - i0 > 1))
+        subcells = [numpy.concatenate(c) for c in zip(
+                        [j0, jm, i0, im], [j0, jm, im, i1], 
+                        [jm, j1, i0, im], [jm, j1, im, i1])]
+        keep = (subcells[1] > subcells[0]) & (subcells[3] > subcells[2])
+        accepted.append([c[keep & ~numpy.tile(refine, 4)] for c in subcells]
+                        + [numpy.tile(cell_error, 4)[keep 
+                                                & ~numpy.tile(refine, 4)]])
+        cells = [c[keep & numpy.tile(refine, 4)] for c in subcells]
+
+    # Fill the accepted cells, all of whose corners have been computed:
+    for (j0, j1, i0, i1, cell_error) in accepted:
+        _interpolate_cells(x, y, dz, computed, error, j0, j1, i0, i1, 
+                           cell_error)
+
+    if stack:
+        return dz, error
+    return dz[0], error
+
+
+def _okada_evaluate(params, x, y, j, i, dz, computed, stack, block_size):
+    r"""Compute *dz* at the grid points (*j*, *i*) not computed yet."""
+
+    flat = numpy.unique(j * x.shape[0] + i)
+    flat = flat[~computed.ravel()[flat]]
+    j, i = numpy.unravel_index(flat, computed.shape)
+    if j.shape[0] > 0:
+        dz[:,j,i] = _okada_points(params, x[i], y[j], stack, block_size)
+        computed[j,i] = True
+
+
+def _bilinear_cells(x, y, dz, j0, j1, i0, i1, j, i):
+    r"""Bilinear interpolation of *dz* at the grid points (*j*, *i*) from
+    the corners of the cells with rows *j0*, *j1* and columns *i0*, *i1*."""
+
+    s = (x[i] - x[i0]) / (x[i1] - x[i0])
+    r = (y[j] - y[j0]) / (y[j1] - y[j0])
+    return ((1 - r) * ((1 - s) * dz[:,j0,i0] + s * dz[:,j0,i1])
+            + r * ((1 - s) * dz[:,j1,i0] + s * dz[:,j1,i1]))
+
+
+def _interpolate_cells(x, y, dz, computed, error, j0, j1, i0, i1, 
+                       cell_error):
+    r"""Fill the points of the cells not computed by bilinear interpolation
+    and set their *error* to the larger of *cell_error* and the error of 
+    the other cells containing them."""
+
+    # Cells of the same size are filled together, one offset at a time:
+    sizes = numpy.column_stack((j1 - j0, i1 - i0))
+    for (rows, cols) in set(map(tuple, sizes)):
+        c = (sizes[:,0] == rows) & (sizes[:,1] == cols)
+        for a in xrange(rows + 1):
+            for b in xrange(cols + 1):
+                j = j0[c] + a
+                i = i0[c] + b
+                fill = ~computed[j,i]
+                if not fill.any():
+                    continue
+                dz[:,j[fill],i[fill]] = _bilinear_cells(x, y, dz, 
+                        j0[c][fill], j1[c][fill], i0[c][fill], i1[c][fill], 
+                        j[fill], i[fill])
+                error[j[fill],i[fill]] = numpy.maximum(error[j[fill],i[fill]],
+                                                       cell_error[c][fill])
+
+
+def _okada_parameters(subfaults, dtype):
+    r"""Subfault parameters as arrays of shape (len(subfaults),1,1)."""
+
+    if isinstance(subfaults, SubFaultTable):
+        table = subfaults
+    else:
+        table = SubFaultTable.from_subfaults(subfaults)
+
+    # Okada model assumes x,y are at bottom center:
+    params = {}
+    for n,name in enumerate(['x_bottom', 'y_bottom', 'depth_bottom']):
+        params[name] = table.centers[:,2,n]
+    for name in ['length', 'width', 'dip', 'rake', 'strike', 'slip']:
+        params[name] = getattr(table, name)
+    for name in params.iterkeys():
+        params[name] = numpy.array(params[name], dtype=dtype).reshape(-1,1,1)
+    return params
+
+
+def _okada_rows(params, x, y, row_start, row_end, dz, stack, block_size):
+    r"""Add the Okada deformation of grid rows *row_start:row_end* to *dz*."""
+
+    num_subfaults = params['x_bottom'].shape[0]
+    mx = x.shape[0]
+
+    # Tiles of rows and chunks of subfaults sized to fit in block_size:
+    rows_per_tile = max(1, min(row_end - row_start, block_size // max(mx,1)))
+    subfaults_per_chunk = max(1, block_size // max(rows_per_tile*mx, 1))
+
+    X = x.reshape(1,1,-1)
+    for j0 in xrange(row_start, row_end, rows_per_tile):
+        j1 = min(j0 + rows_per_tile, row_end)
+        Y = y[j0:j1].reshape(1,-1,1)
+        for k0 in xrange(0, num_subfaults, subfaults_per_chunk):
+            k = slice(k0, min(k0 + subfaults_per_chunk, num_subfaults))
+            if stack:
+                dz[k,j0:j1,:] = _okada_block(params, k, X, Y)
+            else:
+                dz[j0:j1,:] += _okada_block(params, k, X, Y).sum(axis=0)
+
+
+def _okada_points(params, x, y, stack, block_size):
+    r"""Okada deformation at the points (*x*, *y*), 1d arrays.
+
+    Returns an array of shape (number of subfaults, len(x)) if *stack* is
+    True and (1, len(x)) with the sum over the subfaults otherwise.
+    """
+
+    num_subfaults = params['x_bottom'].shape[0]
+    num_points = x.shape[0]
+    dz = numpy.zeros((num_subfaults if stack else 1, num_points), 
+                     dtype=x.dtype)
+
+    # Chunks of points and of subfaults sized to fit in block_size:
+    points_per_tile = max(1, min(num_points, block_size))
+    subfaults_per_chunk = max(1, block_size // points_per_tile)
+
+    for n0 in xrange(0, num_points, points_per_tile):
+        n = slice(n0, min(n0 + points_per_tile, num_points))
+        X = x[n].reshape(1,1,-1)
+        Y = y[n].reshape(1,1,-1)
+        for k0 in xrange(0, num_subfaults, subfaults_per_chunk):
+            k = slice(k0, min(k0 + subfaults_per_chunk, num_subfaults))
+            if stack:
+                dz[k,n] = _okada_block(params, k, X, Y)[:,0,:]
+            else:
+                dz[0,n] += _okada_block(params, k, X, Y)[:,0,:].sum(axis=0)
+    return dz
+
+
+def _okada_block(params, k, X, Y):
+    r"""Okada deformation of the subfaults *k* at the points (*X*, *Y*), 
+    broadcast against the parameters of shape (number of subfaults, 1, 1).
+    """
+
+    x_bottom = params['x_bottom'][k]
+    y_bottom = params['y_bottom'][k]
+    depth_bottom = params['depth_bottom'][k]
+    halfL = 0.5*params['length'][k]
+    w = params['width'][k]
+
+    # convert angles to radians:
+    ang_dip = DEG2RAD * params['dip'][k]
+    ang_rake = DEG2RAD * params['rake'][k]
+    ang_strike = DEG2RAD * params['strike'][k]
+    sn = numpy.sin(ang_dip)
+    cs = numpy.cos(ang_dip)
+    sn_strike = numpy.sin(ang_strike)
+    cs_strike = numpy.cos(ang_strike)
+
+    # Displacement in direction of strike and dip:
+    ds = params['slip'][k] * numpy.cos(ang_rake)
+    dd = params['slip'][k] * numpy.sin(ang_rake)
+
+    # Convert distance from (X,Y) to (x_bottom,y_bottom) from degrees to 
+    # meters:
+    xx = LAT2METER * numpy.cos(DEG2RAD * Y) * (X - x_bottom)
+    yy = LAT2METER * (Y - y_bottom)
+
+    # Convert to distance along strike (x1) and dip (x2):
+    x1 = xx * sn_strike + yy * cs_strike
+    x2 = xx * cs_strike - yy * sn_strike
+
+    # In Okada's paper, x2 is distance up the fault plane, not down dip:
+    x2 = -x2
+
+    p = x2 * cs + depth_bottom * sn
+    q = x2 * sn - depth_bottom * cs
+
+    f1 = _okada_strike_slip(x1 + halfL, p,     sn, cs, q)
+    f2 = _okada_strike_slip(x1 + halfL, p - w, sn, cs, q)
+    f3 = _okada_strike_slip(x1 - halfL, p,     sn, cs, q)
+    f4 = _okada_strike_slip(x1 - halfL, p - w, sn, cs, q)
+
+    g1 = _okada_dip_slip(x1 + halfL, p,     sn, cs, q)
+    g2 = _okada_dip_slip(x1 + halfL, p - w, sn, cs, q)
+    g3 = _okada_dip_slip(x1 - halfL, p,     sn, cs, q)
+    g4 = _okada_dip_slip(x1 - halfL, p - w, sn, cs, q)
+
+    us = (f1 - f2 - f3 + f4) * ds
+    ud = (g1 - g2 - g3 + g4) * dd
+
+    return us + ud
+
+
+def _okada_worker_init(raw, shape, params, x, y, stack, block_size):
+    r"""Store the shared state of *okada_deformation* in a worker process."""
+
+    global _okada_worker_state
+    dz = util.shared_array_view(raw, shape, x.dtype)
+    _okada_worker_state = (params, x, y, dz, stack, block_size)
+
+
+def _okada_worker(tile):
+    r"""Evaluate one tile of rows of *okada_deformation* in a worker process."""
+
+    params, x, y, dz, stack, block_size = _okada_worker_state
+    _okada_rows(params, x, y, tile[0], tile[1], dz, stack, block_size)
+
+
+def _okada_strike_slip(y1, y2, sn, cs, q):
+    """
+    Used for Okada's model
+    Methods from Yoshimitsu Okada (1985)
+    """
+    d_bar = y2*sn - q*cs
+    r = numpy.sqrt(y1**2 + y2**2 + q**2)
+    a4 = 2.0*poisson/cs*(numpy.log(r+d_bar) - sn*numpy.log(r+y2))
+    f = -(d_bar*q/r/(r+y2) + q*sn/(r+y2) + a4*sn)/(2.0*3.14159)
+
+    return f
+
+
+def _okada_dip_slip(y1, y2, sn, cs, q):
+    """
+    Based on Okada's paper (1985)
+    Added by Xiaoming Wang
+    """
+    d_bar = y2*sn - q*cs;
+    r = numpy.sqrt(y1**2 + y2**2 + q**2)
+    xx = numpy.sqrt(y1**2 + q**2)
+    a5 = 4.*poisson/cs*numpy.arctan((y2*(xx+q*cs)+xx*(r+xx)*sn)/y1/(r+xx)/cs)
+    f = -(d_bar*q/r/(r+y1) + sn*numpy.arctan(y1*y2/q/r) - a5*sn*cs)/(2.0*3.14159)
+
+    return f
+
+
 
 # ==============================================================================
 #  DTopography Base Class
 # ==============================================================================
+def _time_slice_indices(mt, time_slices):
+    r"""Sorted indices of the time levels *time_slices* out of *mt*."""
+
+    indices = numpy.arange(mt)
+    if time_slices is None:
+        return indices
+    return numpy.unique(numpy.atleast_1d(indices[time_slices]))
+
+
+def _time_slice_gaps(indices):
+    r"""Number of time levels to skip before each of the sorted *indices*."""
+
+    return numpy.diff(numpy.concatenate(([-1], indices))) - 1
+
+
+def _count_lines(data_file, line):
+    r"""Number of lines of *data_file* from *line*, the last line read, on.
+
+    The rest of the file is read in blocks and only the newlines counted.
+    """
+
+    num_lines = line.count('\n')
+    last = line
+    for block in iter(lambda: data_file.read(2**20), ''):
+        num_lines += block.count('\n')
+        last = block
+    if last != '' and not last.endswith('\n'):
+        num_lines += 1
+    return num_lines
+
+
 class DTopography(object):
     r"""Basic object representing moving topography
 
@@ -304,6 +773,7 @@ class DTopography(object):
         """
 
         self.dZ = None
+        self.dZ_error = None
         self.times = []
         self.x = None
         self.y = None
@@ -315,7 +785,8 @@ class DTopography(object):
             self.read(path, dtopo_type)
 
 
-    def read(self, path=None, dtopo_type=None, verbose=False):
+    def read(self, path=None, dtopo_type=None, verbose=False, 
+                   time_slices=None):
         r"""
         Read in a dtopo file and use to set attributes of this object.
 
@@ -324,6 +795,15 @@ class DTopography(object):
          - *path* (path) - Path to existing dtopo file to read in.
          - *dtopo_type* (int) - Type of topography file to read.  Default is 3
             if not specified or apparent from file extension.
+         - *time_slices* (int, slice or list) - Indices of the time levels to
+           read, e.g. *-1* or *slice(0, None, 10)*.  The other time levels
+           are skipped without being parsed.  Default is all of them.
+
+        The size of the file is determined first so that *dZ* is allocated 
+        once and filled one time slice at a time.  A *dtopo_type* of 4 (e.g.
+        a file ending in `.tt4`) is the binary format written by 
+        :meth:`write`, whose *dZ* is mapped into memory with *numpy.memmap* 
+        and only read from disk when accessed.
         """
 
         if path is not None:
@@ -338,105 +818,138 @@ class DTopography(object):
             dtopo_type = topotools.determine_topo_type(path, default=3)
 
         if dtopo_type == 1:
-            data = numpy.loadtxt(path)
+            # Lines of t, x, y, dz starting at the upper left corner of each
+            # time slice, the first slice gives the number of points
+            with topotools.open_data_file(path, 'r') as fid:
+                line = fid.readline()
+                t0 = float(line.split()[0])
+                num_points = 0
+                while line.strip() and float(line.split()[0]) == t0:
+                    num_points += 1
+                    line = fid.readline()
+                num_lines = num_points + _count_lines(fid, line)
+            mt = num_lines // num_points
             if verbose:
-                print "Loaded file %s with %s lines" %(path,data.shape[0])
-            t = list(set(data[:,0]))
-            t.sort()
+                print "Loaded file %s with %s lines" % (path, num_lines)
+
+            selected = _time_slice_indices(mt, time_slices)
+            with topotools.open_data_file(path, 'r') as fid:
+                dZ = None
+                times = numpy.empty(selected.shape[0])
+                for (n, k) in enumerate(_time_slice_gaps(selected)):
+                    if k > 0:
+                        topotools.read_ascii_rows(fid, k * num_points, 4,
+                                      rows=slice(k * num_points, None))
+                    data = topotools.read_ascii_rows(fid, num_points, 4)
+                    if dZ is None:
+                        # Points of a row have the same y
+                        mx = numpy.sum(numpy.cumprod(data[:,2] == data[0,2]))
+                        my = num_points // mx
+                        if verbose:
+                            print "Read dtopo: mx=%s and my=%s, at %s times" \
+                                                % (mx, my, selected.shape[0])
+                        X = numpy.flipud(data[:,1].reshape(my, mx))
+                        Y = numpy.flipud(data[:,2].reshape(my, mx))
+                        dZ = numpy.empty((selected.shape[0], my, mx))
+                    times[n] = data[0,0]
+                    dZ[n,:,:] = numpy.flipud(data[:,3].reshape(my, mx))
             if verbose:
-                print "times found: ",t
-            ntimes = len(t)
-            tlast = t[-1]
-            lastlines = data[data[:,0]==tlast]
-            xvals = list(set(lastlines[:,1]))
-            xvals.sort()
-            mx = len(xvals)
-            my = len(lastlines) / mx
-            if verbose:
-                print "Read dtopo: mx=%s and my=%s, at %s times" % (mx,my,ntimes)
-            X = numpy.reshape(lastlines[:,1],(my,mx))
-            Y = numpy.reshape(lastlines[:,2],(my,mx))
-            Y = numpy.flipud(Y)
-            if verbose:
-                print "Returning dZ as a list of mx*my arrays"
-            dZ = None
-            for n in range(ntimes):
-                i1 = n*mx*my
-                i2 = (n+1)*mx*my
-                dzt = numpy.reshape(data[i1:i2,3],(my,mx))
-                dzt = numpy.flipud(dzt)
-                dzt = numpy.array(dzt, ndmin=3)  # convert to 3d array
-                if dZ is None:
-                    dZ = dzt.copy()
-                else:
-                    dZ = numpy.append(dZ, dzt, axis=0)
+                print "times found: ", times
             self.X = X
             self.Y = Y
             self.x = X[0,:]
             self.y = Y[:,0]
-            self.times = t
+            self.times = times
             self.dZ = dZ
 
-        elif dtopo_type == 2 or dtopo_type == 3:
-            fid = open(path)
-            mx = int(fid.readline().split()[0])
-            my = int(fid.readline().split()[0])
-            mt = int(fid.readline().split()[0])
-            xlower = float(fid.readline().split()[0])
-            ylower = float(fid.readline().split()[0])
-            t0 = float(fid.readline().split()[0])
-            dx = float(fid.readline().split()[0])
-            dy = float(fid.readline().split()[0])
-            dt = float(fid.readline().split()[0])
-            fid.close()
-    
-            xupper = xlower + (mx-1)*dx
-            yupper = ylower + (my-1)*dy
-            x=numpy.linspace(xlower,xupper,mx)
-            y=numpy.linspace(ylower,yupper,my)
-            times = numpy.linspace(t0, t0+(mt-1)*dt, mt)
+        elif dtopo_type in [2, 3, 4]:
+            with topotools.open_data_file(path, 'r') as fid:
+                mx = int(fid.readline().split()[0])
+                my = int(fid.readline().split()[0])
+                mt = int(fid.readline().split()[0])
+                xlower = float(fid.readline().split()[0])
+                ylower = float(fid.readline().split()[0])
+                t0 = float(fid.readline().split()[0])
+                dx = float(fid.readline().split()[0])
+                dy = float(fid.readline().split()[0])
+                dt = float(fid.readline().split()[0])
+                if dtopo_type == 4:
+                    dtype = numpy.dtype(fid.readline().split()[0])
     
-            dZvals = numpy.loadtxt(path, skiprows=9)
-            if dtopo_type==3:
-                # my lines with mx values on each
-                for k,t in enumerate(times):
-                    dZk = numpy.reshape(dZvals[k*my:(k+1)*my, :], (my,mx))
-                    dZk = numpy.flipud(dZk)
-                    dZk = numpy.array(dZk, ndmin=3)  # convert to 3d array
-                    if k==0:
-                        dZ = dZk.copy()
+                xupper = xlower + (mx-1)*dx
+                yupper = ylower + (my-1)*dy
+                x=numpy.linspace(xlower,xupper,mx)
+                y=numpy.linspace(ylower,yupper,my)
+                times = numpy.linspace(t0, t0+(mt-1)*dt, mt)
+                selected = _time_slice_indices(mt, time_slices)
+
+                if dtopo_type == 4:
+                    # Stored from the lower left corner so it can be mapped
+                    # directly, copy on write so the file is never modified
+                    dZ = numpy.memmap(path, dtype=dtype, mode='c', 
+                                      offset=topotools.binary_header_size,
+                                      shape=(mt, my, mx))
+                    step = selected[1] - selected[0] \
+                                        if selected.shape[0] > 1 else 1
+                    if selected.shape[0] > 0 and \
+                                numpy.all(numpy.diff(selected) == step):
+                        # Evenly spaced time levels remain a view of the file
+                        dZ = dZ[selected[0]:selected[-1] + 1:step]
                     else:
-                        dZ = numpy.append(dZ, dZk, axis=0)
-            else:
-                # dtopo_type==2 ==> mx*my lines with 1 values on each
-                for k,t in enumerate(times):
-                    dZk = numpy.reshape(dZvals[k*mx*my:(k+1)*mx*my], (my,mx))
-                    dZk = numpy.flipud(dZk)
-                    dZk = numpy.array(dZk, ndmin=3)  # convert to 3d array
-                    if k==0:
-                        dZ = dZk.copy()
+                        dZ = dZ[selected]
+                else:
+                    # Parse one time slice at a time into preallocated 
+                    # storage, dtopo_type==3 has my lines with mx values on
+                    # each and dtopo_type==2 has mx*my lines with 1 value on
+                    # each
+                    if dtopo_type == 3:
+                        values_per_line = mx
                     else:
-                        dZ = numpy.append(dZ, dZk, axis=0)
+                        values_per_line = 1
+                    dZ = numpy.empty((selected.shape[0], my, mx))
+                    for (n, k) in enumerate(_time_slice_gaps(selected)):
+                        if k > 0:
+                            topotools.read_ascii_rows(fid, k * my, mx, 
+                                        rows=slice(k * my, None),
+                                        values_per_line=values_per_line)
+                        dZ[n,:,:] = numpy.flipud(topotools.read_ascii_rows(
+                                        fid, my, mx, 
+                                        values_per_line=values_per_line))
                     
             self.x = x
             self.y = y
             self.X, self.Y = numpy.meshgrid(x,y)
-            self.times = times
+            self.times = times[selected]
             self.dZ = dZ
 
         else:
-            raise ValueError("Only topography types 1, 2, and 3 are supported,",
-                             " given %s." % dtopo_type)
+            raise ValueError("Only topography types 1, 2, 3 and 4 are "
+                             "supported, given %s." % dtopo_type)
 
 
-    def write(self, path=None, dtopo_type=None):
+    def write(self, path=None, dtopo_type=None, precision=None, dZ=None,
+                    dtype='float64'):
         r"""Write out subfault resulting dtopo to file at *path*.
 
         :input:
         
-         - *path* (path) - Path to the output file to written to.
+         - *path* (path) - Path to the output file to written to.  If it ends
+           in `.gz` the output is compressed with gzip.
          - *dtopo_type* (int) - Type of topography file to write out.  Default
            is 3.
+         - *precision* (int) - Number of digits after the decimal point of 
+           the deformation values in exponential notation.  Defaults to 6
+           for dtopo_type 3, types 0 and 1 use Python's *str* by default.
+         - *dZ* - Sequence or iterator of the 2d deformation at each of 
+           *times*, e.g. a generator computing each time slice on demand, so 
+           that not all of them have to be in memory.  Defaults to *self.dZ*.
+         - *dtype* - Data type of the values of dtopo_type 4, `float64` or 
+           `float32`.
+
+        Each time slice is formatted in blocks of rows at a time.  A 
+        *dtopo_type* of 4 writes a binary file with a fixed size ASCII header
+        like the one of dtopo_type 3 plus the data type, followed by the time
+        slices stored from the lower left corner, see :meth:`read`.
 
         """
 
@@ -456,41 +969,72 @@ class DTopography(object):
         if abs(dx - dy) >= 1e-12:
             raise ValueError("dx = %g not equal to dy = %g" % (dx,dy))
 
+        if dZ is None:
+            dZ = self.dZ
+
+        if precision is None:
+            value_format = '%012.6e'
+            column_format = '%s'
+        else:
+            value_format = '%%0%i.%ie' % (precision + 6, precision)
+            column_format = value_format
+
+        if len(self.times) == 1:
+            dt = 0.
+        else:
+            dt = float(self.times[1] - self.times[0])
+
+        if dtopo_type == 4:
+            if os.path.splitext(path)[-1][1:] in ["gz"]:
+                raise ValueError("Binary dtopo cannot be compressed.")
+            dtype = numpy.dtype(dtype)
+            if dtype not in [numpy.float32, numpy.float64]:
+                raise ValueError("Binary dtopo must be float32 or float64, "
+                                 "given %s." % dtype)
+            header = ''.join(["%7i       mx \n" % x.shape[0],
+                              "%7i       my \n" % y.shape[0],
+                              "%7i       mt \n" % len(self.times),
+                              "%20.14e   xlower\n" % x[0],
+                              "%20.14e   ylower\n" % y[0],
+                              "%20.14e   t0\n" % self.times[0],
+                              "%20.14e   dx\n" % dx,
+                              "%20.14e   dy\n" % dy,
+                              "%20.14e   dt\n" % dt,
+                              "%7s       dtype\n" % dtype.str])
+            with open(path, 'wb') as data_file:
+                data_file.write(header.ljust(topotools.binary_header_size - 1)
+                                + '\n')
+                for dz in dZ:
+                    numpy.asarray(dz, dtype=dtype).tofile(data_file)
+            return
+
         # Construct each interpolating function and evaluate at new grid
         ## Shouldn't need to interpolate in time.
-        with open(path, 'w') as data_file:
-
-            if dtopo_type == 0:
-                # Topography file with 3 columns, x, y, dz written from the
-                # upper left corner of the region. Only final time.
-                Y_flipped = numpy.flipud(self.Y)
-                dZ_flipped = numpy.flipud(self.dZ[-1,:,:]) 
-
-                for j in xrange(self.Y.shape[0]):
-                    for i in xrange(self.X.shape[1]):
-                        data_file.write("%s %s %s\n" % self.X[j,i], 
-                            Y_flipped[j,i], dZ_flipped[j,i])
-
-            elif dtopo_type == 1:
-                # Topography file with 4 columns, t, x, y, dz written from the
-                # upper
-                # left corner of the region
-                Y_flipped = numpy.flipud(self.Y)
-                for (n, time) in enumerate(self.times):
-                    #alpha = (time - self.t[0]) / self.t[-1]
-                    #dZ_flipped = numpy.flipud(alpha * self.dZ[:,:])
-                    dZ_flipped = numpy.flipud(self.dZ[n,:,:])  
-
-                    for j in xrange(self.Y.shape[0]):
-                        for i in xrange(self.X.shape[1]):
-                            data_file.write("%s %s %s %s\n" % (self.times[n],
-                                self.X[j,i], Y_flipped[j,i], dZ_flipped[j,i]))
+        with topotools.open_data_file(path, 'w') as data_file:
+
+            if dtopo_type == 0 or dtopo_type == 1:
+                # Topography file with 3 columns, x, y, dz (only final time)
+                # or 4 columns, t, x, y, dz, written from the upper left
+                # corner of the region
+                if dtopo_type == 0:
+                    for dz in dZ:
+                        pass
+                    time_slices = [(len(self.times) - 1, dz)]
+                else:
+                    time_slices = enumerate(dZ)
+                X_points = numpy.tile(x, y.shape[0])
+                Y_points = numpy.repeat(numpy.flipud(y), x.shape[0])
+                for n,dz in time_slices:
+                    columns = [X_points, Y_points, numpy.flipud(dz).ravel()]
+                    if dtopo_type == 1:
+                        columns.insert(0, self.times[n] 
+                                                * numpy.ones(X_points.shape))
+                    topotools.write_ascii_rows(data_file, 
+                                        numpy.column_stack(columns),
+                                        " ".join(len(columns) * [column_format])
+                                        + "\n")
         
             elif dtopo_type == 2 or dtopo_type == 3:
-                if len(self.times) == 1:
-                    dt = 0.
-                else:
-                    dt = float(self.times[1] - self.times[0])
                 # Write out header
                 data_file.write("%7i       mx \n" % x.shape[0])
                 data_file.write("%7i       my \n" % y.shape[0])
@@ -505,15 +1049,14 @@ class DTopography(object):
                 if dtopo_type == 2:
                     raise ValueError("Topography type 2 is not yet supported.")
                 elif dtopo_type == 3:
-                    for (n, time) in enumerate(self.times):
-                        #alpha = (time - self.t[0]) / (self.t[-1])
-                        for j in range(self.Y.shape[0]-1, -1, -1):
-                            data_file.write(self.X.shape[1] * '%012.6e  ' 
-                                                  % tuple(self.dZ[n,j,:]))
-                            data_file.write("\n")
+                    for dz in dZ:
+                        topotools.write_ascii_rows(data_file, 
+                                        numpy.flipud(dz),
+                                        x.shape[0] * (value_format + '  ') 
+                                        + "\n")
 
             else:
-                raise ValueError("Only topography types 1, 2, and 3 are ",
+                raise ValueError("Only topography types 1, 2, 3 and 4 are "
                                  "supported, given %s." % dtopo_type)
 
 
@@ -521,18 +1064,99 @@ class DTopography(object):
         """
         Interpolate dZ to specified time t and return deformation.
         """
-        from matplotlib.mlab import find
-        if t <= self.times[0]:
-            return self.dZ[0,:,:]
-        elif t >= self.times[-1]:
-            return self.dZ[-1,:,:]
-        else:
-            n = max(find(self.times <= t))
-            t1 = self.times[n]
-            t2 = self.times[n+1]
-            dz = (t2-t)/(t2-t1) * self.dZ[n,:,:] + \
-                 (t-t1)/(t2-t1) * self.dZ[n+1,:,:]
-            return dz
+
+        return self.dZ_at_times(t)
+
+
+    def dZ_at_times(self, times, lazy=False):
+        r"""Interpolate dZ linearly in time to each of *times*.
+
+        The time levels bracketing each time are found with 
+        *numpy.searchsorted* and times outside of *self.times* get the first
+        or last deformation.
+
+        :Input:
+         - *times* (float or ndarray) Times to interpolate to.
+         - *lazy* (bool) If True return a generator of the 2d deformation at
+           each time instead, so that only the time levels needed by each
+           time are read, e.g. when animating many times or writing them 
+           with :meth:`write`.
+
+        :Output:
+         - *dZ* (ndarray) Deformation of shape *times.shape + (my, mx)*, 2d
+           for a single time.
+        """
+
+        n, w = self._time_weights(times)
+        if lazy:
+            return self._dZ_slices(n.ravel(), w.ravel())
+        w = w.reshape(w.shape + (1, 1))
+        return (1.0 - w) * self.dZ[n,:,:] + w * self.dZ[n + 1,:,:]
+
+
+    def _dZ_slices(self, n, w):
+        r"""Generate the deformation at the time weights *n*, *w*."""
+
+        for k in xrange(n.shape[0]):
+            yield (1.0 - w[k]) * self.dZ[n[k],:,:] \
+                            + w[k] * self.dZ[n[k] + 1,:,:]
+
+
+    def _time_weights(self, times):
+        r"""Index *n* of the time level before each of *times* and weight *w*
+        of time level *n* + 1 in the linear interpolation in time."""
+
+        times = numpy.asarray(times, dtype=float)
+        levels = numpy.asarray(self.times, dtype=float)
+        if levels.shape[0] == 1:
+            # dZ[n + 1] is the same time level with weight 0
+            return (numpy.zeros(times.shape, dtype=int) - 1, 
+                    numpy.ones(times.shape))
+        n = numpy.searchsorted(levels, times, side='right') - 1
+        n = numpy.clip(n, 0, levels.shape[0] - 2)
+        dt = levels[n + 1] - levels[n]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            w = numpy.where(dt > 0, (times - levels[n]) / dt, 1.0)
+        return n, numpy.clip(w, 0.0, 1.0)
+
+
+    def dZ_at_points(self, x, y, t=None):
+        r"""Deformation at the points (*x*, *y*) and times *t*.
+
+        The deformation is interpolated bilinearly in space and linearly in
+        time, reading only the values of *dZ* next to each point, e.g. to 
+        compare with many GPS or tide gauge observations at once.  Points 
+        outside of the grid are nan.
+
+        :Input:
+         - *x*, *y* (ndarray) Coordinates of the points.
+         - *t* (float or ndarray) Times of the points, broadcast with *x* and
+           *y*.  Defaults to the last time, the final deformation.
+
+        :Output:
+         - *dz* (ndarray) Deformation with the broadcast shape of the input.
+        """
+
+        if t is None:
+            t = self.times[-1]
+        x, y, t = numpy.broadcast_arrays(numpy.asarray(x, dtype=float),
+                                         numpy.asarray(y, dtype=float),
+                                         numpy.asarray(t, dtype=float))
+        grid_x = numpy.asarray(self.x, dtype=float)
+        grid_y = numpy.asarray(self.y, dtype=float)
+        i, offset_x, inside_x = topotools._grid_locate(grid_x, x)
+        j, offset_y, inside_y = topotools._grid_locate(grid_y, y)
+        s = offset_x / (grid_x[i + 1] - grid_x[i])
+        r = offset_y / (grid_y[j + 1] - grid_y[j])
+        n, w = self._time_weights(t)
+
+        dz = numpy.zeros(x.shape)
+        for (level, weight) in [(n, 1.0 - w), (n + 1, w)]:
+            dz += weight * ((1.0 - r) * ((1.0 - s) * self.dZ[level, j, i] 
+                                           + s * self.dZ[level, j, i + 1])
+                                  + r * ((1.0 - s) * self.dZ[level, j + 1, i] 
+                                           + s * self.dZ[level, j + 1, i + 1]))
+        return numpy.where(inside_x & inside_y, dz, numpy.nan)
 
 
     def dZ_max(self):
@@ -577,6 +1201,12 @@ class Fault(object):
 
     A class describing a fault possibly composed of subfaults.
 
+    The parameters of *subfaults* are stored in the columns of 
+    *subfault_table*, a :class:`SubFaultTable` whose rows the subfaults 
+    view, so that geometry, moments and unit conversions are computed for 
+    all subfaults at once.  If the list *subfaults* is changed the table is
+    rebuilt the next time it is needed.
+
     :Properties:
 
     :Initialization:
@@ -600,13 +1230,26 @@ class Fault(object):
         # Default units of each parameter type
         self.input_units = standard_units
         self.input_units.update(input_units)
+
+        self._subfault_table = None
         
         if subfaults is not None:
             if not isinstance(subfaults, list):
                 raise ValueError("Input parameter subfaults must be a list.")
             self.subfaults = subfaults
-            for subfault in self.subfaults:
-                subfault.convert_to_standard_units(self.input_units)
+            self.subfault_table.convert_to_standard_units(self.input_units)
+
+
+    @property
+    def subfault_table(self):
+        r"""The :class:`SubFaultTable` of *subfaults*, which become views of
+        its rows."""
+
+        table = getattr(self, '_subfault_table', None)
+        if table is None or not table.views(self.subfaults):
+            table = SubFaultTable.from_subfaults(self.subfaults, bind=True)
+            self._subfault_table = table
+        return table
 
 
     def read(self, path, column_map, coordinate_specification="centroid",
@@ -651,26 +1294,35 @@ class Fault(object):
         self.coordinate_specification = coordinate_specification
         self.input_units = standard_units
         self.input_units.update(input_units)
-        self.subfaults = []
-        for n in xrange(data.shape[0]):
 
-            new_subfault = SubFault()
-            new_subfault.coordinate_specification = coordinate_specification
-            
-            for (var, column) in column_map.iteritems():
-                if isinstance(column, tuple) or isinstance(column, list):
-                    setattr(new_subfault, var, [None for k in column])
-                    for (k, index) in enumerate(column):
-                        getattr(new_subfault, var)[k] = data[n, index]
-                else:
-                    setattr(new_subfault, var, data[n, column])
+        # Columns of the file are stored directly in the table, other values
+        # are attributes of each subfault
+        table = SubFaultTable(data.shape[0], 
+                            coordinate_specification=coordinate_specification)
+        attributes = {}
+        for (var, column) in column_map.iteritems():
+            if isinstance(column, tuple) or isinstance(column, list):
+                values = data[:, list(column)].tolist()
+            else:
+                values = data[:, column]
+            if var in subfault_parameters:
+                setattr(table, var, values)
+            else:
+                attributes[var] = values
 
-            if defaults is not None:
-                for param in defaults.iterkeys():
-                    setattr(new_subfault, param, defaults[param]) 
+        if defaults is not None:
+            for param in defaults.iterkeys():
+                if param in subfault_parameters:
+                    setattr(table, param, defaults[param])
+                else:
+                    attributes[param] = [defaults[param]] * data.shape[0]
 
-            new_subfault.convert_to_standard_units(self.input_units)
-            self.subfaults.append(new_subfault)
+        table.convert_to_standard_units(self.input_units)
+        self.subfaults = table.subfaults()
+        self._subfault_table = table
+        for (var, values) in attributes.iteritems():
+            for (subfault, value) in zip(self.subfaults, values):
+                setattr(subfault, var, value)
 
 
     def write(self, path, style=None, column_list=None, output_units={}, 
@@ -751,10 +1403,7 @@ class Fault(object):
         in units N-m.
         """
 
-        total_Mo = 0.0
-        for subfault in self.subfaults:
-            total_Mo += subfault.Mo()
-        return total_Mo
+        return numpy.sum(self.subfault_table.Mo())
 
 
     def Mw(self):
@@ -762,11 +1411,38 @@ class Fault(object):
         return Mw(self.Mo())
 
     
-    def create_dtopography(self, x, y, times=[0., 1.], verbose=False):
+    def create_dtopography(self, x, y, times=[0., 1.], verbose=False,
+                                 dtype='float64', block_size=None, n_workers=1,
+                                 path=None, dtopo_type=None, precision=None,
+                                 adaptive=False, tolerance=None, 
+                                 coarsening=16):
         r"""Compute change in topography and construct a dtopography object.
 
-        Use subfaults' `okada` routine and add all 
-        deformations together.
+        Evaluate the Okada deformation of all subfaults with the batched
+        :func:`okada_deformation` and add all deformations together.
+
+        *dtype* sets the floating point type of the computation and of
+        *dtopo.dZ*, e.g. *'float32'* for large grids.  *block_size* bounds
+        the number of values in each temporary array and *n_workers* sets
+        the number of processes evaluating tiles of the grid in parallel
+        (*None* for all cores), see :func:`okada_deformation`.
+
+        For *dynamic* or *kinematic* ruptures the deformation at each time is
+        the product of the matrix of rise fractions of all subfaults at all
+        *times* with the stacked static deformations of the subfaults.
+
+        If *adaptive* is True the deformation is evaluated with
+        :func:`okada_deformation_adaptive`, computed only where it is needed
+        to resolve it to within *tolerance* starting from every
+        *coarsening*-th grid point and interpolated elsewhere, which is much
+        faster for grids with a large buffer around the source.  The error
+        estimate of shape *(len(y), len(x))* is stored in
+        *dtopo.dZ_error*.  *n_workers* is not used in this case.
+
+        If *path* is given the dtopo file is also written there with
+        *dtopo_type* and *precision*, see :meth:`DTopography.write`.  For
+        *dynamic* or *kinematic* ruptures each time slice is then written as
+        soon as it is computed and not kept, so *dtopo.dZ* is *None*.
 
         Raises a ValueError exception if the *rupture_type* is an unknown type.
 
@@ -782,56 +1458,54 @@ class Fault(object):
         dtopo.times = times
 
         if verbose:
-            print "Making Okada dz for each of %s subfaults" \
-                  % len(self.subfaults)
-
-        for k,subfault in enumerate(self.subfaults):
+            print "Making Okada dz for %s subfaults" % len(self.subfaults)
+
+        stack = self.rupture_type in ['dynamic','kinematic']
+        if adaptive:
+            dz, dtopo.dZ_error = okada_deformation_adaptive(
+                            self.subfault_table, x, y, tolerance=tolerance,
+                            coarsening=coarsening, stack=stack, dtype=dtype, 
+                            block_size=block_size)
             if verbose:
-                sys.stdout.write("%s.." % k)
-                sys.stdout.flush()
-            subfault.okada(x,y)  # sets subfault.dtopo with times=[0]
-                                 # and subfault.dtopo.dZ.shape[0] == 1
-        if verbose:
-            sys.stdout.write("\nDone\n")
+                print "Adaptive dz, max error estimate %g" \
+                      % dtopo.dZ_error.max()
 
         if self.rupture_type == 'static':
             if len(times) > 2:
                 raise ValueError("For static deformation, need len(times) <= 2")
-            dz = numpy.zeros(X.shape)
-            for subfault in self.subfaults:
-                dz += subfault.dtopo.dZ[0,:,:]
+            if not adaptive:
+                dz = self._deformation(x, y, False, dtype, block_size, 
+                                       n_workers)
 
             if len(times) == 1:
                 # only final deformation stored:
                 dtopo.dZ = numpy.array(dz, ndmin=3) 
             elif len(times) == 2:
                 # store 0 at first time and final deformation at second:
-                dz0 = numpy.zeros(X.shape)
+                dz0 = numpy.zeros(X.shape, dtype=dz.dtype)
                 dtopo.dZ = numpy.array([dz0, dz])
                 if dtopo.dZ.shape != (2, dz.shape[0], dz.shape[1]):
                     raise ValueError("dtopo.dZ does not have expected shape")
 
+            if path is not None:
+                dtopo.write(path, dtopo_type=dtopo_type, precision=precision)
+
         elif self.rupture_type in ['dynamic','kinematic']:
 
-            t_prev = -1.e99
-            dzt = numpy.zeros(X.shape)
-            dZ = None
-            for t in times:
-                for k,subfault in enumerate(self.subfaults):
-                    t0 = getattr(subfault,'rupture_time',0)
-                    t1 = getattr(subfault,'rise_time',0.5)
-                    t2 = getattr(subfault,'rise_time_ending',None)
-                    rf = rise_fraction([t_prev,t],t0,t1,t2)
-                    dfrac = rf[1] - rf[0]
-                    if dfrac > 0.:
-                        dzt = dzt + dfrac * subfault.dtopo.dZ[0,:,:]
-                dzt = numpy.array(dzt, ndmin=3)  # convert to 3d array
-                if dZ is None:
-                    dZ = dzt.copy()
-                else:
-                    dZ = numpy.append(dZ, dzt, axis=0)
-                t_prev = t
-            dtopo.dZ = dZ
+            if adaptive:
+                dz_subfaults = dz
+            else:
+                dz_subfaults = self._deformation(x, y, True, dtype, 
+                                                 block_size, n_workers)
+            dZ_slices = self._kinematic_slices(times, dz_subfaults)
+            if path is None:
+                dtopo.dZ = numpy.empty((len(times),) + X.shape, 
+                                       dtype=dz_subfaults.dtype)
+                for n,dz in enumerate(dZ_slices):
+                    dtopo.dZ[n,:,:] = dz
+            else:
+                dtopo.write(path, dtopo_type=dtopo_type, precision=precision,
+                            dZ=dZ_slices)
 
         else:   
             raise ValueError("Unrecognized rupture_type: %s" % self.rupture_type)
@@ -842,6 +1516,50 @@ class Fault(object):
         return dtopo
 
 
+    def _deformation(self, x, y, stack, dtype, block_size, n_workers):
+        r"""
+        Okada deformation of the subfaults used by *create_dtopography*, 
+        see :func:`okada_deformation` for the arguments.
+        """
+        return okada_deformation(self.subfault_table, x, y, stack=stack, 
+                                 dtype=dtype, block_size=block_size,
+                                 n_workers=n_workers)
+
+
+    def _kinematic_slices(self, times, dz_subfaults):
+        r"""
+        Generate the deformation at each of *times* from the stacked static
+        deformations *dz_subfaults* of the subfaults.
+
+        Row *n* of the weight matrix holds the fraction of each subfault's 
+        slip reached by *times[n]*, accumulated over the increases of the 
+        rise fractions between successive times.
+        """
+
+        table = self.subfault_table
+        t0 = numpy.array(getattr(table, 'rupture_time', numpy.nan), 
+                         dtype=float) * numpy.ones(len(table))
+        t0[numpy.isnan(t0)] = 0.
+        t1 = numpy.array(getattr(table, 'rise_time', numpy.nan), 
+                         dtype=float) * numpy.ones(len(table))
+        t1[numpy.isnan(t1)] = 0.5
+        t2 = numpy.array(getattr(table, 'rise_time_ending', numpy.nan), 
+                         dtype=float) * numpy.ones(len(table))
+        t2 = numpy.where(numpy.isnan(t2), t1, t2)
+
+        times = numpy.array(times, dtype=float).reshape(-1,1)
+        rf = rise_fraction(times, t0, t1, t2)
+        rf = numpy.vstack((numpy.zeros((1,t0.shape[0])), rf))
+        weights = numpy.cumsum(numpy.maximum(numpy.diff(rf, axis=0), 0.), 
+                               axis=0)
+        weights = numpy.array(weights, dtype=dz_subfaults.dtype)
+
+        shape = dz_subfaults.shape[1:]
+        dz_subfaults = dz_subfaults.reshape(dz_subfaults.shape[0], -1)
+        for n in xrange(weights.shape[0]):
+            yield numpy.dot(weights[n,:], dz_subfaults).reshape(shape)
+
+
     
     def plot_subfaults(self, axes=None, plot_centerline=False, slip_color=False,
                              cmap_slip=None, cmin_slip=None, cmax_slip=None,
@@ -879,6 +1597,7 @@ class Fault(object):
         """
     
         import matplotlib
+        import matplotlib.collections
         import matplotlib.pyplot as plt
 
         if (slip_time is not None) and (self.rupture_type == 'static'):
@@ -887,12 +1606,9 @@ class Fault(object):
             fig = plt.figure()
             axes = fig.add_subplot(1, 1, 1)
     
-        max_slip = 0.
-        min_slip = 0.
-        for subfault in self.subfaults:
-            slip = subfault.slip
-            max_slip = max(abs(slip), max_slip)
-            min_slip = min(abs(slip), min_slip)
+        table = self.subfault_table
+        max_slip = max(numpy.abs(table.slip).max(), 0.)
+        min_slip = min(numpy.abs(table.slip).min(), 0.)
         if verbose:
             print "Max slip, Min slip: ",max_slip, min_slip
     
@@ -906,50 +1622,53 @@ class Fault(object):
             if cmin_slip is None:
                 cmin_slip = 0.
             
-        y_ave = 0.
-        for subfault in self.subfaults:
-
-            x_top = subfault.centers[0][0]
-            y_top = subfault.centers[0][1]
-            x_centroid = subfault.centers[1][0]
-            y_centroid = subfault.centers[1][1]
-            x_corners = [subfault.corners[2][0],
-                         subfault.corners[3][0],
-                         subfault.corners[0][0],
-                         subfault.corners[1][0],
-                         subfault.corners[2][0]]
-            y_corners = [subfault.corners[2][1],
-                         subfault.corners[3][1],
-                         subfault.corners[0][1],
-                         subfault.corners[1][1],
-                         subfault.corners[2][1]]
-    
-            y_ave += y_centroid
-    
-    
-            # Plot projection of planes to x-y surface:
-            if plot_centerline:
-                axes.plot([x_top],[y_top],'bo',label="Top center")
-                axes.plot([x_centroid],[y_centroid],'ro',label="Centroid")
-                axes.plot([x_top,x_centroid],[y_top,y_centroid],'r-')
-            if plot_rake:
-                tau = (subfault.rake - 90) * numpy.pi/180.
-                axes.plot([x_centroid],[y_centroid],'go',markersize=5,label="Centroid")
-                dxr = x_top - x_centroid
-                dyr = y_top - y_centroid
-                x_rake = x_centroid + numpy.cos(tau)*dxr - numpy.sin(tau)*dyr
-                y_rake = y_centroid + numpy.sin(tau)*dxr + numpy.cos(tau)*dyr
-                axes.plot([x_rake,x_centroid],[y_rake,y_centroid],'g-',linewidth=1)
-            if slip_color:
-                if slip_time is not None:
-                    slip = subfault.dynamic_slip(slip_time)
-                else:
-                    slip = subfault.slip
-                s = min(1, max(0, (slip-cmin_slip)/(cmax_slip-cmin_slip)))
-                c = cmap_slip(s*.99)  # since 1 does not map properly with jet
-                axes.fill(x_corners,y_corners,color=c,edgecolor='none')
-            if plot_box:
-                axes.plot(x_corners, y_corners, 'k-')
+        x_top = table.centers[:,0,0]
+        y_top = table.centers[:,0,1]
+        x_centroid = table.centers[:,1,0]
+        y_centroid = table.centers[:,1,1]
+        # Corners c, d, a, b, c of each subfault
+        x_corners = table.corners[:,[2, 3, 0, 1, 2],0]
+        y_corners = table.corners[:,[2, 3, 0, 1, 2],1]
+        y_ave = y_centroid.sum()
+
+        # Plot projection of planes to x-y surface, all subfaults at once
+        # with their lines separated by nan:
+        if plot_centerline:
+            axes.plot(x_top,y_top,'bo',label="Top center")
+            axes.plot(x_centroid,y_centroid,'ro',label="Centroid")
+            axes.plot(_nan_separated([x_top,x_centroid]),
+                      _nan_separated([y_top,y_centroid]),'r-')
+        if plot_rake:
+            tau = (table.rake - 90) * numpy.pi/180.
+            axes.plot(x_centroid,y_centroid,'go',markersize=5,label="Centroid")
+            dxr = x_top - x_centroid
+            dyr = y_top - y_centroid
+            x_rake = x_centroid + numpy.cos(tau)*dxr - numpy.sin(tau)*dyr
+            y_rake = y_centroid + numpy.sin(tau)*dxr + numpy.cos(tau)*dyr
+            axes.plot(_nan_separated([x_rake,x_centroid]),
+                      _nan_separated([y_rake,y_centroid]),'g-',linewidth=1)
+        if slip_color:
+            if slip_time is not None:
+                rise_time_ending = getattr(table, 'rise_time_ending', 
+                                           table.rise_time)
+                rise_time_ending = numpy.where(numpy.isnan(rise_time_ending),
+                                               table.rise_time, 
+                                               rise_time_ending)
+                slip = rise_fraction(slip_time, table.rupture_time, 
+                                     table.rise_time, rise_time_ending) \
+                                                                * table.slip
+            else:
+                slip = table.slip
+            s = numpy.clip((slip-cmin_slip)/(cmax_slip-cmin_slip), 0, 1)
+            c = cmap_slip(s*.99)  # since 1 does not map properly with jet
+            polygons = matplotlib.collections.PolyCollection(
+                            numpy.dstack((x_corners, y_corners)), 
+                            facecolors=c, edgecolors='none')
+            axes.add_collection(polygons)
+            axes.autoscale_view()
+        if plot_box:
+            axes.plot(_nan_separated(x_corners.T), 
+                      _nan_separated(y_corners.T), 'k-')
     
         slipax = axes
             
@@ -1023,15 +1742,7 @@ class Fault(object):
 
         """
 
-        extent = [numpy.infty, -numpy.infty, numpy.infty, -numpy.infty]
-        for subfault in self.subfaults:
-            for corner in subfault.corners:
-                extent[0] = min(corner[0], extent[0])
-                extent[1] = max(corner[0], extent[1])
-                extent[2] = min(corner[1], extent[2])
-                extent[3] = max(corner[1], extent[3])
-
-        return extent
+        return self.subfault_table.containing_rect()
 
     
     def create_dtopo_xy(self, rect=None, dx=1/60., buffer_size=0.5):
@@ -1095,6 +1806,310 @@ class Fault(object):
 
 
 
+# ==============================================================================
+#  Sub-Fault Table Class
+# ==============================================================================
+class SubFaultTable(object):
+    r"""Parameters of many subfaults stored as one array per parameter.
+
+    Each of *subfault_parameters* that is set is a column of length
+    *num_subfaults*, e.g. *table.slip*, and assigning to a column broadcasts
+    the value.  Parameters that are not set are nan, *None* for 
+    *coordinate_specification* and the other columns of strings or lists.
+    The geometry, moments and unit conversion are computed for all 
+    subfaults at once and :class:`SubFault` objects are views of single rows
+    of a table, so that large finite fault models are loaded and 
+    manipulated with array operations:
+
+        >>> table = SubFaultTable(1000, strike=10., dip=15., rake=90.)
+        >>> table.slip = numpy.random.rand(1000)
+        >>> subfaults = table.subfaults()
+
+    The geometry is computed again whenever a column it depends on is
+    assigned.  After modifying such a column in place call 
+    :meth:`calculate_geometry`.
+
+    """
+
+    @property
+    def corners(self):
+        r"""Corners of the fault planes, array of shape (num_subfaults, 4, 3)
+        of (x, y, depth) of the corners a, b, c, d of :class:`SubFault`."""
+        if self._corners is None:
+            self.calculate_geometry()
+        return self._corners
+
+    @property
+    def centers(self):
+        r"""Points along the center-line of the fault planes, array of shape
+        (num_subfaults, 3, 3) of (x, y, depth) of the points 0, 1, 2 of 
+        :class:`SubFault`."""
+        if self._centers is None:
+            self.calculate_geometry()
+        return self._centers
+
+    def __init__(self, num_subfaults=0, **columns):
+        r"""SubFaultTable initialization routine.
+
+        *columns* are initial values of parameters, broadcast to 
+        *num_subfaults* values.  See :class:`SubFaultTable` for more info.
+
+        """
+
+        super(SubFaultTable, self).__init__()
+
+        self.num_subfaults = num_subfaults
+        self._columns = {}
+        self._centers = None
+        self._corners = None
+        for name in subfault_parameters:
+            if name not in _optional_parameters:
+                setattr(self, name, None)
+        # default value for rigidity = shear modulus in Pascals
+        self.mu = 4e10
+        self.coordinate_specification = "top center"
+        for (name, values) in columns.iteritems():
+            setattr(self, name, values)
+
+
+    def __len__(self):
+        return self.num_subfaults
+
+
+    def __getattr__(self, name):
+        # Only called if *name* is not a regular attribute
+        columns = self.__dict__.get('_columns', {})
+        if name in columns:
+            return columns[name]
+        raise AttributeError("'SubFaultTable' object has no attribute '%s'"
+                             % name)
+
+
+    def __setattr__(self, name, values):
+        if name in subfault_parameters:
+            self._columns[name] = self._column(values)
+            if name in _geometry_parameters:
+                self._centers = None
+                self._corners = None
+        else:
+            super(SubFaultTable, self).__setattr__(name, values)
+
+
+    def _column(self, values):
+        r"""Column of *num_subfaults* values broadcast from *values*, float if
+        the values are numbers or *None* and of objects otherwise."""
+
+        if values is None:
+            values = numpy.nan
+        if isinstance(values, basestring) or \
+                            numpy.asarray(values).dtype.kind not in 'biuf':
+            column = numpy.empty(self.num_subfaults, dtype=object)
+            if isinstance(values, (list, tuple, numpy.ndarray)):
+                for (k, value) in enumerate(values):
+                    column[k] = value
+            else:
+                column.fill(values)
+            return column
+        column = numpy.empty(self.num_subfaults)
+        column[:] = values
+        return column
+
+
+    def get(self, name, index):
+        r"""Value of parameter *name* of subfault *index*, *None* if unset.
+
+        Raises an AttributeError exception if no subfault has the parameter.
+        """
+
+        value = getattr(self, name)[index]
+        if isinstance(value, float) and numpy.isnan(value):
+            return None
+        return value
+
+
+    def set(self, name, index, value):
+        r"""Set the parameter *name* of subfault *index* to *value*."""
+
+        if name not in self._columns:
+            setattr(self, name, None)
+        column = self._columns[name]
+        if value is None:
+            value = numpy.nan if column.dtype != object else None
+        elif column.dtype != object and (not numpy.isscalar(value) 
+                                         or isinstance(value, basestring)):
+            column = self._columns[name] = column.astype(object)
+        column[index] = value
+        if name in _geometry_parameters:
+            self._centers = None
+            self._corners = None
+
+
+    def subfaults(self):
+        r"""List of :class:`SubFault` views of the rows of the table."""
+
+        subfaults = []
+        for k in xrange(self.num_subfaults):
+            subfault = SubFault.__new__(SubFault)
+            subfault._table = self
+            subfault._index = k
+            subfaults.append(subfault)
+        return subfaults
+
+
+    def views(self, subfaults):
+        r"""True if *subfaults* are exactly the views of the rows in order."""
+
+        return len(subfaults) == self.num_subfaults and \
+               all(subfault._table is self and subfault._index == k
+                   for (k, subfault) in enumerate(subfaults))
+
+
+    def take(self, indices):
+        r"""New table with copies of the rows *indices*."""
+
+        indices = numpy.asarray(indices, dtype=int)
+        table = SubFaultTable(indices.shape[0])
+        for (name, column) in self._columns.iteritems():
+            table._columns[name] = column[indices]
+        if self._centers is not None:
+            table._centers = self._centers[indices]
+            table._corners = self._corners[indices]
+        return table
+
+
+    @classmethod
+    def from_subfaults(cls, subfaults, bind=False):
+        r"""Gather the parameters of *subfaults* into a new table.
+
+        The rows of each table the subfaults are views of are copied at 
+        once.  If *bind* is True the subfaults become views of the new 
+        table.
+        """
+
+        subfaults = list(subfaults)
+        table = cls(len(subfaults))
+        indices = numpy.array([subfault._index for subfault in subfaults],
+                              dtype=int)
+        sources = [subfault._table for subfault in subfaults]
+        unique_sources = dict((id(source), source) for source in sources)
+        source_ids = numpy.array([id(source) for source in sources])
+
+        for source in unique_sources.itervalues():
+            rows = (source_ids == id(source)).nonzero()[0]
+            for (name, column) in source._columns.iteritems():
+                if name not in table._columns:
+                    setattr(table, name, None)
+                if column.dtype == object:
+                    table._columns[name] = table._columns[name].astype(object)
+                table._columns[name][rows] = column[indices[rows]]
+
+        if bind:
+            for (k, subfault) in enumerate(subfaults):
+                subfault._table = table
+                subfault._index = k
+        return table
+
+
+    def convert_to_standard_units(self, input_units, verbose=False):
+        r"""
+        Convert the columns from the units used for input into the standard
+        units used in this module, see :func:`convert_units`.
+        """
+
+        for (param, units) in input_units.iteritems():
+            if param in self._columns:
+                setattr(self, param, convert_units(self._columns[param], 
+                                                   units, 1))
+                if verbose:
+                    print "%s converted from %s to %s" \
+                                    % (param, units, standard_units[param])
+
+
+    def Mo(self):
+        r"""Seismic moment of each subfault in N-m, mu is in Pascals."""
+
+        return self.mu * self.length * self.width * self.slip
+
+
+    def containing_rect(self):
+        r"""Extent [x1, x2, y1, y2] of the corners of all subfaults."""
+
+        corners = self.corners
+        return [corners[:,:,0].min(), corners[:,:,0].max(),
+                corners[:,:,1].min(), corners[:,:,1].max()]
+
+
+    def calculate_geometry(self):
+        r"""Calculate the corners and centers of all fault planes.
+
+        See :meth:`SubFault.calculate_geometry` for the meaning of 
+        *coordinate_specification*.  The points are found for all subfaults
+        at once, with offsets along the dip depending on the specification.
+        """
+
+        # Simple conversion factor of latitude to meters
+        lat2meter = util.dist_latlong2meters(0.0, 1.0)[1]
+
+        # Position of the point given by (longitude, latitude) and of the
+        # point at the given depth down dip from the top edge, as a 
+        # fraction of the width
+        specifications = self.coordinate_specification
+        position = numpy.empty(self.num_subfaults)
+        depth_position = numpy.empty(self.num_subfaults)
+        for specification in set(specifications):
+            if specification not in _coordinate_positions:
+                raise ValueError("Invalid coordinate specification %s." 
+                                                            % specification)
+            rows = specifications == specification
+            position[rows], depth_position[rows] = \
+                                    _coordinate_positions[specification]
+
+        dip = self.dip * DEG2RAD
+        strike = self.strike * DEG2RAD
+
+        # Vector *up_dip* goes from bottom edge to top edge, in meters,
+        # from point 2 to point 0 in the figure in the SubFault docstring.
+        up_dip_x = -self.width * numpy.cos(dip) * numpy.cos(strike) \
+                        / (LAT2METER * numpy.cos(self.latitude * DEG2RAD))
+        up_dip_y = self.width * numpy.cos(dip) * numpy.sin(strike) / LAT2METER
+
+        self._centers = numpy.empty((self.num_subfaults, 3, 3))
+        for k in xrange(3):
+            self._centers[:,k,0] = self.longitude \
+                                        + (position - 0.5 * k) * up_dip_x
+            self._centers[:,k,1] = self.latitude \
+                                        + (position - 0.5 * k) * up_dip_y
+            self._centers[:,k,2] = self.depth \
+                    + (0.5 * k - depth_position) * self.width * numpy.sin(dip)
+
+        # Vector *strike* goes along the top edge from point 1 to point a
+        # in the figure in the SubFault docstring.
+        up_strike_x = 0.5 * self.length * numpy.sin(strike) \
+                        / (lat2meter * numpy.cos(self._centers[:,2,1] 
+                                                 * DEG2RAD))
+        up_strike_y = 0.5 * self.length * numpy.cos(strike) / lat2meter
+
+        self._corners = numpy.empty((self.num_subfaults, 4, 3))
+        for (k, center, sign) in [(0, 0, 1), (1, 2, 1), (2, 2, -1), 
+                                  (3, 0, -1)]:
+            self._corners[:,k,0] = self._centers[:,center,0] \
+                                        + sign * up_strike_x
+            self._corners[:,k,1] = self._centers[:,center,1] \
+                                        + sign * up_strike_y
+            self._corners[:,k,2] = self._centers[:,center,2]
+
+
+
+def _subfault_parameter(name, doc):
+    r"""Property of :class:`SubFault` for the parameter *name* in the row of
+    its table."""
+
+    return property(lambda self: self._table.get(name, self._index),
+                    lambda self, value: self._table.set(name, self._index, 
+                                                        value),
+                    doc=doc)
+
+
 # ==============================================================================
 #  Sub-Fault Class
 # ==============================================================================
@@ -1135,22 +2150,53 @@ class SubFault(object):
       <-- up dip direction
 
 
+    The parameters are stored in a :class:`SubFaultTable` and a subfault is
+    a view of one of its rows, e.g. of the table of a :class:`Fault`, so 
+    that setting *fault.subfaults[k].slip* changes the fault.  A new 
+    subfault or a copy has a table of its own.
 
     """
 
+    strike = _subfault_parameter('strike', 
+                        r"""Strike direction of subfault in degrees.""")
+    length = _subfault_parameter('length', 
+                        r"""Length of subfault in meters.""")
+    width = _subfault_parameter('width', 
+                        r"""Width of subfault in meters.""")
+    depth = _subfault_parameter('depth', 
+        r"""Depth of subfault based on *coordinate_specification* in meters.""")
+    slip = _subfault_parameter('slip', 
+                        r"""Slip on subfault in strike direction in meters.""")
+    rake = _subfault_parameter('rake', 
+                        r"""Rake of subfault movement in degrees.""")
+    dip = _subfault_parameter('dip', r"""Subfault's angle of dip""")
+    latitude = _subfault_parameter('latitude', 
+        r"""Latitutde of the subfault based on *coordinate_specification*.""")
+    longitude = _subfault_parameter('longitude', 
+        r"""Longitude of the subfault based on *coordinate_specification*.""")
+    coordinate_specification = _subfault_parameter('coordinate_specification',
+        r"""Specifies where the latitude, longitude and depth are measured 
+        from.""")
+    mu = _subfault_parameter('mu', 
+                        r"""Rigidity (== shear modulus) in Pascals.""")
+    rupture_time = _subfault_parameter('rupture_time', 
+                        r"""Time at which the rupture of a dynamic subfault
+                        starts.""")
+    rise_time = _subfault_parameter('rise_time', 
+                        r"""Rise time of a dynamic subfault.""")
+    rise_time_ending = _subfault_parameter('rise_time_ending',
+                        r"""Ending rise time of a dynamic subfault, 
+                        defaults to *rise_time*.""")
+
     @property
     def corners(self):
         r"""Coordinates of the corners of the fault plane."""
-        if self._corners is None:
-            self.calculate_geometry()
-        return self._corners
+        return self._table.corners[self._index].tolist()
 
     @property
     def centers(self):
         r"""Coordinates along the center-line of the fault plane."""
-        if self._centers is None:
-            self.calculate_geometry()
-        return self._centers
+        return self._table.centers[self._index].tolist()
 
     def __init__(self):
         r"""SubFault initialization routine.
@@ -1161,35 +2207,31 @@ class SubFault(object):
         
         super(SubFault, self).__init__()
 
-        self.strike = None
-        r"""Strike direction of subfault in degrees."""
-        self.length = None
-        r"""Length of subfault in meters."""
-        self.width = None
-        r"""Width of subfault in meters."""
-        self.depth = None
-        r"""Depth of subfault based on *coordinate_specification* in meters."""
-        self.slip = None
-        r"""Slip on subfault in strike direction in meters."""
-        self.rake = None
-        r"""Rake of subfault movement in degrees."""
-        self.dip = None
-        r"""Subfault's angle of dip"""
-        self.latitude = None
-        r"""Latitutde of the subfault based on *coordinate_specification*."""
-        self.longitude = None
-        r"""Longitude of the subfault based on *coordinate_specification*."""
-        self.coordinate_specification = "top center"
-        r"""Specifies where the latitude, longitude and depth are measured from."""
-
-        # default value for rigidity = shear modulus
-        # Note that standard units for mu is now Pascals.
+        # The parameters are stored in the only row of a table of its own,
+        # default value for rigidity = shear modulus is 4e10 Pascals.
         # Multiply by 10 to get dyne/cm^2 value.
-        self.mu = 4e10
-        r"""Rigidity (== shear modulus) in Pascals."""
+        self._table = SubFaultTable(1)
+        self._index = 0
 
-        self._centers = None
-        self._corners = None
+
+    def __copy__(self):
+        # Copies own their parameters instead of viewing the same row
+        subfault = self.__class__.__new__(self.__class__)
+        subfault.__dict__.update(self.__dict__)
+        subfault._table = self._table.take([self._index])
+        subfault._index = 0
+        return subfault
+
+
+    def __deepcopy__(self, memo):
+        subfault = self.__class__.__new__(self.__class__)
+        memo[id(self)] = subfault
+        for (name, value) in self.__dict__.iteritems():
+            if name not in ['_table', '_index']:
+                subfault.__dict__[name] = copy.deepcopy(value, memo)
+        subfault._table = self._table.take([self._index])
+        subfault._index = 0
+        return subfault
 
 
     def convert_to_standard_units(self, input_units, verbose=False):
@@ -1238,7 +2280,8 @@ class SubFault(object):
 
         Routine calculates the class attributes *corners* and 
         *centers* which are the corners of the fault plane and 
-        points along the centerline respecitvely in 3D space.
+        points along the centerline respecitvely in 3D space, see
+        :meth:`SubFaultTable.calculate_geometry`.
 
         **Note:** *self.coordinate_specification*  specifies the location on each
         subfault that corresponds to the (longitude,latitude) and depth 
@@ -1258,118 +2301,8 @@ class SubFault(object):
         shifted or other specifications.
         """
 
-        # Simple conversion factor of latitude to meters
-        lat2meter = util.dist_latlong2meters(0.0, 1.0)[1]
-
-        # Setup coordinate arrays
-        self._corners = [[None, None, None], # a 
-                                     [None, None, None], # b
-                                     [None, None, None], # c
-                                     [None, None, None]] # d
-        self._centers = [[None, None, None], # 1
-                                     [None, None, None], # 2 
-                                     [None, None, None]] # 3
-
-        # Set depths
-        if self.coordinate_specification == 'top center' or \
-           self.coordinate_specification == 'noaa sift':
-
-            self._centers[0][2] = self.depth
-            self._centers[1][2] = self.depth            \
-                              + 0.5 * self.width * numpy.sin(self.dip * DEG2RAD)
-            self._centers[2][2] = self.depth            \
-                                    + self.width * numpy.sin(self.dip * DEG2RAD)
-
-        elif self.coordinate_specification == 'centroid':
-            self._centers[0][2] = self.depth            \
-                              - 0.5 * self.width * numpy.sin(self.dip * DEG2RAD)
-            self._centers[1][2] = self.depth
-            self._centers[2][2] = self.depth            \
-                              + 0.5 * self.width * numpy.sin(self.dip * DEG2RAD)
-
-        elif self.coordinate_specification == 'bottom center':
-            self._centers[0][2] = self.depth            \
-                              - self.width * numpy.sin(self.dip * DEG2RAD)
-            self._centers[1][2] = self.depth            \
-                              - 0.5 * self.width * numpy.sin(self.dip * DEG2RAD)
-            self._centers[2][2] = self.depth
-            
-        else:
-            raise ValueError("Invalid coordinate specification %s." \
-                                                % self.coordinate_specification)
-
-        self._corners[0][2] = self._centers[0][2]
-        self._corners[3][2] = self._centers[0][2]
-        self._corners[1][2] = self._centers[2][2]
-        self._corners[2][2] = self._centers[2][2]
-        
-        # Locate fault plane in 3D space:  
-        # See the class docstring for a guide to labeling of corners/centers.
-
-        # Vector *up_dip* goes from bottom edge to top edge, in meters,
-        # from point 2 to point 0 in the figure in the class docstring.
-
-
-        up_dip = (-self.width * numpy.cos(self.dip * DEG2RAD)           \
-                              * numpy.cos(self.strike * DEG2RAD)        \
-                              / (LAT2METER * numpy.cos(self.latitude * DEG2RAD)),
-                   self.width * numpy.cos(self.dip * DEG2RAD)           \
-                              * numpy.sin(self.strike * DEG2RAD) / LAT2METER)
-        if self.coordinate_specification == 'top center':
-
-            self._centers[0][:2] = (self.longitude, self.latitude)
-            self._centers[1][:2] = (self.longitude - 0.5 * up_dip[0],
-                                                self.latitude - 0.5 * up_dip[1])
-            self._centers[2][:2] = (self.longitude - up_dip[0],
-                                                self.latitude - up_dip[1])
-
-        elif self.coordinate_specification == 'centroid':
-
-            self._centers[0][:2] = (self.longitude + 0.5 * up_dip[0],
-                                                self.latitude + 0.5 * up_dip[1])
-            self._centers[1][:2] = (self.longitude, self.latitude)
-            self._centers[2][:2] = (self.longitude - 0.5 * up_dip[0],
-                                                self.latitude  - 0.5 * up_dip[1])
-
-        elif self.coordinate_specification == 'bottom center' or \
-             self.coordinate_specification == 'noaa sift':
-
-            # Non-rotated lcoations of center-line coordinates
-            self._centers[0][:2] = (self.longitude + up_dip[0],
-                                                self.latitude + up_dip[1])
-            self._centers[1][:2] = (self.longitude + 0.5 * up_dip[0],
-                                                self.latitude + 0.5 * up_dip[1])
-            self._centers[2][:2] = (self.longitude, self.latitude)
-
-        else:
-            raise ValueError("Unknown coordinate specification '%s'."       \
-                                                % self.coordinate_specification)
-
-        # Calculate coordinates of corners:
-        # Vector *strike* goes along the top edge from point 1 to point a
-        # in the figure in the class docstring.
-
-        up_strike = (0.5 * self.length * numpy.sin(self.strike * DEG2RAD) \
-           / (lat2meter * numpy.cos(self._centers[2][1] * DEG2RAD)),
-                     0.5 * self.length * numpy.cos(self.strike * DEG2RAD) \
-           / lat2meter)
-        
-        self._corners[0][:2] = (self._centers[0][0] 
-                                                                 + up_strike[0],
-                                            self._centers[0][1] 
-                                                                 + up_strike[1])
-        self._corners[1][:2] = (self._centers[2][0] 
-                                                                 + up_strike[0], 
-                                            self._centers[2][1] 
-                                                                 + up_strike[1])
-        self._corners[2][:2] = (self._centers[2][0] 
-                                                                 - up_strike[0],
-                                            self._centers[2][1] 
-                                                                 - up_strike[1])
-        self._corners[3][:2] = (self._centers[0][0] 
-                                                                 - up_strike[0],
-                                            self._centers[0][1] 
-                                                                 - up_strike[1])
+        # The geometry of all rows of the table is calculated at once
+        self._table.calculate_geometry()
 
     
     def okada(self, x, y):
@@ -1473,15 +2406,8 @@ class SubFault(object):
         Used for Okada's model
         Methods from Yoshimitsu Okada (1985)
         """
-        sn = numpy.sin(ang_dip)
-        cs = numpy.cos(ang_dip)
-        d_bar = y2*sn - q*cs
-        r = numpy.sqrt(y1**2 + y2**2 + q**2)
-        xx = numpy.sqrt(y1**2 + q**2)
-        a4 = 2.0*poisson/cs*(numpy.log(r+d_bar) - sn*numpy.log(r+y2))
-        f = -(d_bar*q/r/(r+y2) + q*sn/(r+y2) + a4*sn)/(2.0*3.14159)
-    
-        return f
+        return _okada_strike_slip(y1, y2, numpy.sin(ang_dip),
+                                  numpy.cos(ang_dip), q)
     
     
     def _dip_slip(self, y1, y2, ang_dip, q):
@@ -1489,16 +2415,8 @@ class SubFault(object):
         Based on Okada's paper (1985)
         Added by Xiaoming Wang
         """
-        sn = numpy.sin(ang_dip)
-        cs = numpy.cos(ang_dip)
-    
-        d_bar = y2*sn - q*cs;
-        r = numpy.sqrt(y1**2 + y2**2 + q**2)
-        xx = numpy.sqrt(y1**2 + q**2)
-        a5 = 4.*poisson/cs*numpy.arctan((y2*(xx+q*cs)+xx*(r+xx)*sn)/y1/(r+xx)/cs)
-        f = -(d_bar*q/r/(r+y1) + sn*numpy.arctan(y1*y2/q/r) - a5*sn*cs)/(2.0*3.14159)
-    
-        return f
+        return _okada_dip_slip(y1, y2, numpy.sin(ang_dip),
+                               numpy.cos(ang_dip), q)
 
     
     def dynamic_slip(self, t):
@@ -1747,9 +2665,18 @@ class SiftFault(Fault):
         >>> fault = SiftFault(sift_slip)
 
     results in a fault with two specified subfaults with slip of 2 and 3 meters.
+
+    Since the deformation is linear in the slip, the deformation of each unit
+    source with unit slip can be cached on disk by passing *cache_dir*:
+
+        >>> fault = SiftFault(sift_slip, cache_dir='sift_cache')
+        >>> dtopo = fault.create_dtopography(x, y)
+
+    The first call computes and saves the missing unit source fields, any
+    later *sift_slip* on the same grid is then a weighted sum of cached fields.
     """
 
-    def __init__(self, sift_slip=None):
+    def __init__(self, sift_slip=None, cache_dir=None):
         r"""SiftFault initialization routine.
         
         See :class:`SiftFault` for more info.
@@ -1757,6 +2684,8 @@ class SiftFault(Fault):
         """
         
         super(SiftFault, self).__init__()
+        self.cache_dir = cache_dir
+        self.sift_names = []
         self._load_sift_unit_sources()
         if sift_slip is not None:
             self.set_subfaults(sift_slip)
@@ -1768,10 +2697,111 @@ class SiftFault(Fault):
                     and value = magnitude of slip to assign (in meters).
         """
         self.subfaults = []
+        self.sift_names = []
         for k,v in sift_slip.iteritems():
             subfault = self.sift_subfaults[k]
             subfault.slip = v
             self.subfaults.append(subfault)
+            self.sift_names.append(k)
+
+
+    def unit_source_deformation(self, names, x, y, block_size=None, 
+                                      n_workers=1):
+        r"""
+        Return the deformation of the unit sources *names* with unit slip.
+
+        Fields are loaded from *cache_dir* when present and otherwise computed
+        with :func:`okada_deformation` and saved there.  Each field is stored
+        as a *.npy* file whose name includes a hash of the unit source name, 
+        the grid *x*, *y* and the Okada parameters of the unit source, so a
+        change to any of them yields a new cache entry.
+
+        :Input:
+          - *names* (list) Names of unit sources.
+          - *x*, *y* (numpy.ndarray) 1d arrays of the grid.
+          - *block_size*, *n_workers* passed to :func:`okada_deformation`.
+
+        :Output:
+          - List of arrays of shape *(len(y), len(x))*, memory-mapped 
+            read-only from the cache files.
+
+        """
+
+        if self.cache_dir is None:
+            raise ValueError("SiftFault.cache_dir is not set")
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        x = numpy.asarray(x, dtype=numpy.float64)
+        y = numpy.asarray(y, dtype=numpy.float64)
+        paths = [os.path.join(self.cache_dir, "%s_%s.npy" 
+                              % (name, self._cache_key(name, x, y)))
+                 for name in names]
+
+        missing = [n for n,path in enumerate(paths) 
+                     if not os.path.exists(path)]
+        if len(missing) > 0:
+            unit_subfaults = []
+            for n in missing:
+                subfault = copy.copy(self.sift_subfaults[names[n]])
+                subfault.slip = 1.
+                unit_subfaults.append(subfault)
+            dz = okada_deformation(unit_subfaults, x, y, stack=True, 
+                                   block_size=block_size, n_workers=n_workers)
+            for i,n in enumerate(missing):
+                # Write to a temporary file first so that concurrent runs 
+                # never load a partially written field:
+                tmp_path = "%s.%s.tmp" % (paths[n], os.getpid())
+                try:
+                    with open(tmp_path, 'wb') as tmp_file:
+                        numpy.save(tmp_file, dz[i,:,:])
+                    os.rename(tmp_path, paths[n])
+                except:
+                    # e.g. a full disk, leave no partial file behind
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+
+        return [numpy.load(path, mmap_mode='r') for path in paths]
+
+
+    def _cache_key(self, name, x, y):
+        r"""Hash of unit source *name*, grid and Okada parameters."""
+
+        subfault = self.sift_subfaults[name]
+        key = hashlib.sha1(name)
+        key.update(numpy.ascontiguousarray(x).tostring())
+        key.update(numpy.ascontiguousarray(y).tostring())
+        key.update(repr([subfault.centers[2], subfault.length, subfault.width,
+                         subfault.dip, subfault.rake, subfault.strike, 
+                         poisson]))
+        return key.hexdigest()[:16]
+
+
+    def _deformation(self, x, y, stack, dtype, block_size, n_workers):
+        r"""
+        Okada deformation of the subfaults as a weighted sum of the cached
+        unit source fields if *cache_dir* is set.
+        """
+
+        if self.cache_dir is None \
+           or len(self.sift_names) != len(self.subfaults):
+            return super(SiftFault, self)._deformation(x, y, stack, dtype, 
+                                                      block_size, n_workers)
+
+        fields = self.unit_source_deformation(self.sift_names, x, y,
+                                              block_size=block_size,
+                                              n_workers=n_workers)
+        dtype = numpy.dtype(dtype)
+        if stack:
+            dz = numpy.empty((len(fields), len(y), len(x)), dtype=dtype)
+            for k,subfault in enumerate(self.subfaults):
+                numpy.multiply(subfault.slip, fields[k], dz[k,:,:])
+        else:
+            dz = numpy.zeros((len(y), len(x)), dtype=dtype)
+            for k,subfault in enumerate(self.subfaults):
+                dz += subfault.slip * fields[k]
+        return dz
 
 
     def _load_sift_unit_sources(self):
@@ -1786,29 +2816,27 @@ class SiftFault(Fault):
         self.input_units = {'length':'km', 'width':'km', 'depth':'km', 'slip':'m',
                  'mu':"dyne/cm^2"}
 
-        self.sift_subfaults = {}
-
+        names = []
+        values = []
         with open(unit_source_file, 'r') as sift_file:
             # Skip first two lines
             sift_file.readline(); sift_file.readline()
             for line in sift_file:
                 tokens = line.split(',')
-                name = tokens[0]
+                names.append(tokens[0])
                 # url = tokens[1]
-                subfault = SubFault()
-                subfault.longitude = float(tokens[2])
-                subfault.latitude = float(tokens[3])
-                subfault.slip = float(tokens[4])
-                subfault.strike = float(tokens[5])
-                subfault.dip = float(tokens[6])
-                subfault.depth = float(tokens[7])
-                subfault.length = float(tokens[8])
-                subfault.width = float(tokens[9])
-                subfault.rake = float(tokens[10])
-                subfault.coordinate_specification = "noaa sift"
-                # subfault.mu = ??  ## currently using SubFault default
-                subfault.convert_to_standard_units(self.input_units)
-                self.sift_subfaults[name] = subfault
+                values.append([float(token) for token in tokens[2:11]])
+        values = numpy.array(values)
+
+        # All unit sources are rows of one table
+        # subfault.mu = ??  ## currently using SubFault default
+        table = SubFaultTable(len(names), coordinate_specification="noaa sift")
+        for (n, param) in enumerate(['longitude', 'latitude', 'slip', 
+                                     'strike', 'dip', 'depth', 'length', 
+                                     'width', 'rake']):
+            setattr(table, param, values[:,n])
+        table.convert_to_standard_units(self.input_units)
+        self.sift_subfaults = dict(zip(names, table.subfaults()))
 
 
 # ==============================================================================
@@ -1905,52 +2933,50 @@ class SubdividedPlaneFault(Fault):
               d_corners[2] - d_corners[1], 
               d_corners[3] + d_corners[1] - d_corners[2] - d_corners[0]]
 
-        self.subfaults = []
-
-        # determine coordinates for each subfault.
+        # determine coordinates for all subfaults at once, ordered by dip
+        # and then by strike.
         # note that xi goes from 0 to 1 from top to bottom in dip direction,
         #          eta goes from 0 to 1 in along-strike direction.
         dxi = 1. / ndip
         deta = 1. / nstrike
-        for i in range(ndip):
-            xi = numpy.array([i, i+0.5, i+1.]) * dxi # xi at top, center, bottom
-            for j in range(nstrike):
-                eta = (j+0.5)*deta
-                # interpolate longitude,latitude,depth from corners:
-                x_sf = cx[0] + cx[1]*xi + cx[2]*eta + cx[3]*xi*eta
-                y_sf = cy[0] + cy[1]*xi + cy[2]*eta + cy[3]*xi*eta
-                d_sf = cd[0] + cd[1]*xi + cd[2]*eta + cd[3]*xi*eta
-
-                subfault = SubFault()
-
-                if base_subfault.coordinate_specification == 'centroid':
-                    subfault.longitude = x_sf[1]
-                    subfault.latitude = y_sf[1]
-                    subfault.depth = d_sf[1]
-                elif base_subfault.coordinate_specification == 'top center':
-                    subfault.longitude = x_sf[0]
-                    subfault.latitude = y_sf[0]
-                    subfault.depth = d_sf[0]
-                elif base_subfault.coordinate_specification == 'noaa sift':
-                    subfault.longitude = x_sf[2]
-                    subfault.latitude = y_sf[2]
-                    subfault.depth = d_sf[0]
-                else:   
-                    msg = "Unrecognized coordinate_specification: %s" \
-                            % base_subfault.coordinate_specification
-                    raise NotImplementedError(msg)
-
-                subfault.dip = dip
-                subfault.strike = strike
-                subfault.rake = rake
-                subfault.length = length / nstrike
-                subfault.width = width / ndip
-                subfault.slip = slip
-                subfault.coordinate_specification = \
-                        base_subfault.coordinate_specification
-                subfault.mu = base_subfault.mu
-
-                self.subfaults.append(subfault)
+        i = numpy.arange(ndip).reshape(-1,1,1)
+        xi = (i + numpy.array([0., 0.5, 1.])) * dxi # xi at top, center, bottom
+        eta = ((numpy.arange(nstrike) + 0.5) * deta).reshape(1,-1,1)
+        # interpolate longitude,latitude,depth from corners:
+        x_sf = (cx[0] + cx[1]*xi + cx[2]*eta + cx[3]*xi*eta).reshape(-1,3)
+        y_sf = (cy[0] + cy[1]*xi + cy[2]*eta + cy[3]*xi*eta).reshape(-1,3)
+        d_sf = (cd[0] + cd[1]*xi + cd[2]*eta + cd[3]*xi*eta).reshape(-1,3)
+
+        table = SubFaultTable(ndip * nstrike)
+        if base_subfault.coordinate_specification == 'centroid':
+            table.longitude = x_sf[:,1]
+            table.latitude = y_sf[:,1]
+            table.depth = d_sf[:,1]
+        elif base_subfault.coordinate_specification == 'top center':
+            table.longitude = x_sf[:,0]
+            table.latitude = y_sf[:,0]
+            table.depth = d_sf[:,0]
+        elif base_subfault.coordinate_specification == 'noaa sift':
+            table.longitude = x_sf[:,2]
+            table.latitude = y_sf[:,2]
+            table.depth = d_sf[:,0]
+        else:   
+            msg = "Unrecognized coordinate_specification: %s" \
+                    % base_subfault.coordinate_specification
+            raise NotImplementedError(msg)
+
+        table.dip = dip
+        table.strike = strike
+        table.rake = rake
+        table.length = length / nstrike
+        table.width = width / ndip
+        table.slip = slip
+        table.coordinate_specification = \
+                base_subfault.coordinate_specification
+        table.mu = base_subfault.mu
+
+        self.subfaults = table.subfaults()
+        self._subfault_table = table
 
         if slip_function is not None:
             self.set_slip(nstrike, ndip, slip_function, Mo)
@@ -1960,22 +2986,21 @@ class SubdividedPlaneFault(Fault):
         self.slip_function = slip_function
         dxi = 1. / ndip
         deta = 1. / nstrike
-        Mo_0 = 0.
+        slip = numpy.empty(ndip * nstrike)
         k = 0
         for i in range(ndip):
             xi = (i+0.5) * dxi
             for j in range(nstrike):
                 eta = (j+0.5) * deta
-                subfault = self.subfaults[k]  
+                slip[k] = slip_function(xi,eta)
                 k = k+1
-                subfault.slip = slip_function(xi,eta)
-                Mo_0 += subfault.Mo()
+        table = self.subfault_table
+        table.slip = slip
 
         if Mo is not None:
             # rescale slip on each subfault to achieve desired seismic moment
-            Mo_ratio = Mo / Mo_0
-            for k in range(len(self.subfaults)):
-                self.subfaults[k].slip *= Mo_ratio
+            Mo_0 = numpy.sum(table.Mo())
+            table.slip = slip * (Mo / Mo_0)
 
 
 
@@ -2022,3 +3047,319 @@ class TensorProductFault(SubdividedPlaneFault):
         if slip_down_dip is None:
             # set to constant in the dip direction if not specified
             slip_down_dip = lambda xi: 1.0
+
+
+# ==============================================================================
+#  Random slip ensembles
+# ==============================================================================
+class SlipEnsemble(object):
+
+    r"""
+    Generate correlated random slip distributions on the subfaults of a 
+    fault, e.g. a :class:`SubdividedPlaneFault`, and their deformations.
+
+    The slip is a Gaussian or log-normal random field over the subfaults
+    represented by a truncated Karhunen-Loeve expansion of the *correlation*
+    between subfaults, which depends on their distances along strike and 
+    down dip scaled by *correlation_lengths*.  The leading eigenvectors of
+    the correlation matrix scaled by the square root of their eigenvalues 
+    are stored as *modes*, so a realization only needs independent standard
+    normal coefficients.
+
+    Since the deformation is linear in the slip, the deformation of each 
+    subfault with unit slip is computed once by :func:`okada_deformation`
+    and stored as the rows of *basis*.  The deformation of a batch of 
+    realizations is then a single matrix product of their slips with the 
+    basis:
+
+        >>> ensemble = SlipEnsemble(fault, x, y, Mw=9.0)
+        >>> slips = ensemble.slips(1000, seed=1)
+        >>> dz = ensemble.deformation(slips[0])
+        >>> ensemble.write('dz.npy', 10000, seed=2, n_workers=4)
+
+    """
+
+    def __init__(self, fault, x, y, mean_slip=None, cv=0.75, 
+                       correlation='exponential', correlation_lengths=None,
+                       distribution='lognormal', num_modes=None, Mw=None,
+                       dtype='float64', basis_path=None):
+        r"""SlipEnsemble initialization routine.
+
+        :Input:
+         - *fault* (Fault) Fault whose subfaults are given random slips.
+         - *x*, *y* (numpy.ndarray) 1d arrays of the grid of the deformation.
+         - *mean_slip* (float or array) Mean slip of each subfault, defaults
+           to the slip of the subfaults of *fault*.
+         - *cv* (float or array) Coefficient of variation, the standard 
+           deviation of the slip divided by its mean.
+         - *correlation* (str or function) Correlation as a function of the
+           scaled distance *r*, *'exponential'* for *exp(-r)*, *'gaussian'*
+           for *exp(-r**2)* or a function of an array of distances.
+         - *correlation_lengths* (tuple) Correlation lengths along strike 
+           and down dip in meters, default is 0.4 times the extent of the 
+           fault in each direction.
+         - *distribution* (str) *'lognormal'* for positive slips with the 
+           given mean and standard deviation, or *'normal'*.
+         - *num_modes* (int) Number of terms of the expansion kept, default
+           is all with positive eigenvalues.
+         - *Mw* (float) If given each realization is scaled to this moment
+           magnitude.
+         - *dtype* Floating point type of the basis and deformations.
+         - *basis_path* (str) If given the basis is saved there as a *.npy*
+           file, or loaded if the file exists, and mapped read-only into 
+           memory so that worker processes share it.  The file has to be
+           removed when the fault or the grid change.
+
+        """
+
+        super(SlipEnsemble, self).__init__()
+
+        self.fault = fault
+        self.x = numpy.asarray(x, dtype=float)
+        self.y = numpy.asarray(y, dtype=float)
+        self.dtype = numpy.dtype(dtype)
+        self.basis_path = basis_path
+        self.distribution = distribution
+        self.Mw = Mw
+        self._basis = None
+
+        table = fault.subfault_table
+        if mean_slip is None:
+            mean_slip = table.slip
+        self.mean_slip = numpy.array(mean_slip, dtype=float) \
+                                                    * numpy.ones(len(table))
+        self.cv = numpy.array(cv, dtype=float) * numpy.ones(len(table))
+        if distribution not in ['normal', 'lognormal']:
+            raise ValueError("Unknown slip distribution %s" % distribution)
+
+        # Distances of the centroids along strike and down dip from their 
+        # mean, using the mean strike and dip
+        centroids = table.centers[:,1,:]
+        strike = numpy.arctan2(numpy.sin(table.strike * DEG2RAD).mean(),
+                               numpy.cos(table.strike * DEG2RAD).mean())
+        dip = table.dip.mean() * DEG2RAD
+        latitude = centroids[:,1].mean()
+        east = LAT2METER * numpy.cos(latitude * DEG2RAD) \
+                                 * (centroids[:,0] - centroids[:,0].mean())
+        north = LAT2METER * (centroids[:,1] - latitude)
+        down = centroids[:,2] - centroids[:,2].mean()
+        along_strike = east * numpy.sin(strike) + north * numpy.cos(strike)
+        down_dip = (east * numpy.cos(strike) - north * numpy.sin(strike)) \
+                                    * numpy.cos(dip) + down * numpy.sin(dip)
+
+        if correlation_lengths is None:
+            correlation_lengths = (
+                0.4 * (numpy.ptp(along_strike) + table.length.mean()),
+                0.4 * (numpy.ptp(down_dip) + table.width.mean()))
+        self.correlation_lengths = correlation_lengths
+
+        r = numpy.sqrt(((along_strike.reshape(-1,1) - along_strike) 
+                                                / correlation_lengths[0])**2
+                     + ((down_dip.reshape(-1,1) - down_dip) 
+                                                / correlation_lengths[1])**2)
+        if correlation == 'exponential':
+            C = numpy.exp(-r)
+        elif correlation == 'gaussian':
+            C = numpy.exp(-r**2)
+        elif callable(correlation):
+            C = correlation(r)
+        else:
+            raise ValueError("Unknown correlation %s" % correlation)
+
+        # Karhunen-Loeve modes in order of decreasing eigenvalues
+        eigenvalues, eigenvectors = numpy.linalg.eigh(C)
+        order = numpy.argsort(eigenvalues)[::-1]
+        eigenvalues = eigenvalues[order]
+        if num_modes is None:
+            num_modes = numpy.sum(eigenvalues > 0)
+        self.eigenvalues = eigenvalues[:num_modes]
+        self.modes = eigenvectors[:,order[:num_modes]] \
+                                * numpy.sqrt(numpy.maximum(self.eigenvalues, 0))
+
+
+    @property
+    def basis(self):
+        r"""Deformation of each subfault with unit slip, array of shape 
+        (number of subfaults, len(y) * len(x))."""
+
+        if self._basis is None:
+            if self.basis_path is not None and \
+                                        os.path.exists(self.basis_path):
+                self._basis = numpy.load(self.basis_path, mmap_mode='r')
+            else:
+                self.compute_basis()
+        return self._basis
+
+
+    def compute_basis(self, block_size=None, n_workers=1):
+        r"""Compute the basis with :func:`okada_deformation`, see there for
+        *block_size* and *n_workers*."""
+
+        unit_subfaults = self.fault.subfault_table.take(
+                                    numpy.arange(len(self.fault.subfaults)))
+        unit_subfaults.slip = 1.
+        basis = okada_deformation(unit_subfaults, self.x, self.y, stack=True, 
+                                  dtype=self.dtype, block_size=block_size,
+                                  n_workers=n_workers)
+        basis = basis.reshape(basis.shape[0], -1)
+        if self.basis_path is not None:
+            # Write to a temporary file first so that concurrent runs 
+            # never load a partially written basis:
+            tmp_path = "%s.%s.tmp" % (self.basis_path, os.getpid())
+            try:
+                with open(tmp_path, 'wb') as tmp_file:
+                    numpy.save(tmp_file, basis)
+                os.rename(tmp_path, self.basis_path)
+            except:
+                # e.g. a full disk, leave no partial file behind
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            basis = numpy.load(self.basis_path, mmap_mode='r')
+        self._basis = basis
+
+
+    def slips(self, num_realizations, seed=None):
+        r"""Draw *num_realizations* random slip distributions.
+
+        :Input:
+         - *num_realizations* (int) Number of realizations.
+         - *seed* (int or numpy.random.RandomState) Seed of the random 
+           numbers.
+
+        :Output:
+         - *slips* (numpy.ndarray) Array of shape (num_realizations, number
+           of subfaults).
+        """
+
+        if isinstance(seed, numpy.random.RandomState):
+            random_state = seed
+        else:
+            random_state = numpy.random.RandomState(seed)
+
+        # Standard normal field with the given correlation
+        z = random_state.standard_normal((num_realizations, 
+                                          self.modes.shape[1]))
+        field = numpy.dot(z, self.modes.T)
+
+        if self.distribution == 'lognormal':
+            sigma2 = numpy.log(1. + self.cv**2)
+            slips = numpy.exp(numpy.log(self.mean_slip) - 0.5 * sigma2 
+                              + numpy.sqrt(sigma2) * field)
+        else:
+            slips = self.mean_slip * (1. + self.cv * field)
+
+        if self.Mw is not None:
+            table = self.fault.subfault_table
+            Mo = numpy.dot(slips, table.mu * table.length * table.width)
+            Mo_target = 10.**(1.5 * self.Mw + 9.05)
+            slips *= (Mo_target / Mo).reshape(-1,1)
+        return slips
+
+
+    def deformation(self, slips):
+        r"""Deformation of the slip distributions *slips*.
+
+        Returns an array of shape (len(y), len(x)) for a single slip 
+        distribution and (len(slips), len(y), len(x)) for a 2d array of 
+        them.
+        """
+
+        slips = numpy.asarray(slips, dtype=self.dtype)
+        dz = numpy.dot(slips, self.basis)
+        return dz.reshape(slips.shape[:-1] + (self.y.shape[0], 
+                                              self.x.shape[0]))
+
+
+    def create_dtopography(self, slip, times=[0., 1.]):
+        r"""Return a static :class:`DTopography` for the slip distribution 
+        *slip* at *times*, see :meth:`Fault.create_dtopography`."""
+
+        dtopo = DTopography()
+        dtopo.x = self.x
+        dtopo.y = self.y
+        dtopo.X, dtopo.Y = numpy.meshgrid(self.x, self.y)
+        dtopo.times = times
+        dz = self.deformation(slip)
+        if len(times) == 1:
+            dtopo.dZ = numpy.array(dz, ndmin=3)
+        elif len(times) == 2:
+            dtopo.dZ = numpy.array([numpy.zeros(dz.shape, dtype=dz.dtype), 
+                                    dz])
+        else:
+            raise ValueError("For static deformation, need len(times) <= 2")
+        return dtopo
+
+
+    def write(self, path, num_realizations, seed=None, batch_size=None,
+                    n_workers=1):
+        r"""Write the deformations of *num_realizations* random slips to the
+        *.npy* file *path*.
+
+        The deformations are computed in batches of *batch_size* 
+        realizations, by default about *ensemble_block_size* values at a 
+        time, and written straight into the file opened as a memory-mapped
+        array of shape (num_realizations, len(y), len(x)).  *n_workers* 
+        processes of a *multiprocessing.Pool* compute the batches in 
+        parallel, *None* uses all cores.  The slips are drawn before in the 
+        main process, so the result does not depend on *n_workers*.
+
+        :Output:
+         - *slips* (numpy.ndarray) The slips of the realizations, see 
+           :meth:`slips`.
+        """
+
+        slips = self.slips(num_realizations, seed=seed)
+        basis = self.basis
+        shape = (num_realizations, self.y.shape[0], self.x.shape[0])
+        if batch_size is None:
+            batch_size = max(1, ensemble_block_size // basis.shape[1])
+        batches = [(k, min(k + batch_size, num_realizations)) 
+                   for k in xrange(0, num_realizations, batch_size)]
+
+        dZ = numpy.lib.format.open_memmap(path, mode='w+', dtype=self.dtype,
+                                          shape=shape)
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        n_workers = min(n_workers, len(batches))
+        if n_workers <= 1:
+            for (start, end) in batches:
+                dZ[start:end] = self.deformation(slips[start:end])
+            dZ.flush()
+        else:
+            del dZ
+            if isinstance(basis, numpy.memmap):
+                # Workers map the basis file themselves
+                basis = self.basis_path
+            pool = multiprocessing.Pool(n_workers, 
+                                        initializer=_ensemble_worker_init,
+                                        initargs=(basis, path, slips))
+            try:
+                pool.map(_ensemble_worker, batches)
+            finally:
+                pool.close()
+                pool.join()
+        return slips
+
+
+def _ensemble_worker_init(basis, path, slips):
+    r"""Store the shared state of *SlipEnsemble.write* in a worker process."""
+
+    global _ensemble_worker_state
+    if isinstance(basis, basestring):
+        basis = numpy.load(basis, mmap_mode='r')
+    _ensemble_worker_state = (basis, path, slips)
+
+
+def _ensemble_worker(batch):
+    r"""Write the deformations of one batch of realizations in a worker 
+    process."""
+
+    basis, path, slips = _ensemble_worker_state
+    start, end = batch
+    dZ = numpy.lib.format.open_memmap(path, mode='r+')
+    dZ[start:end] = numpy.dot(numpy.asarray(slips[start:end], 
+                                            dtype=basis.dtype),
+                              basis).reshape((end - start,) + dZ.shape[1:])
+    dZ.flush()
+    del dZ
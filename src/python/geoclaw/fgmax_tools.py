@@ -7,10 +7,17 @@ and to read in the fgmax output after doing a GeoClaw run.
 """
 
 from clawpack.geoclaw import kmltools
+from clawpack.geoclaw import topotools
 import os
+import itertools
+import multiprocessing
 from numpy import sqrt, ma
 import numpy
 
+# Attributes of FGmaxGrid that read_output can set
+fgmax_quantities = ['B', 'h', 'h_time', 's', 's_time', 'hs', 'hs_time', 
+                    'hss', 'hss_time', 'hmin', 'hmin_time', 'arrival_time']
+
 
 class FGmaxGrid(object):
 
@@ -275,9 +282,25 @@ class FGmaxGrid(object):
             kml_file = fname_root + '.kml'
             kmltools.quad2kml(xy, kml_file, fname_root, color='8888FF')
 
-    def read_output(self, fgno=None, outdir=None):
+    def read_output(self, fgno=None, outdir=None, quantities=None, 
+                          cache=True, output_format=None):
         r"""
         Read the GeoClaw results on the fgmax grid numbered *fgno*.
+
+        *quantities* is a list of the attributes to set, e.g. 
+        *['h', 'arrival_time']*, from *fgmax_quantities*.  Defaults to all
+        quantities in the output.  *X*, *Y* and *level* are always set, the
+        topography *B* is only read from *fort.FG*.aux1* if requested.
+
+        If *cache* is True the text output is converted to binary files on
+        the first read, see :func:`read_fgmax_columns`, and later reads only
+        load the columns of the requested quantities.
+
+        *output_format* is *'ascii'* for the text files *fort.FG*.valuemax*
+        and *fort.FG*.aux1*, or *'binary'* for the files *fort.FG*.valuemax.bin*
+        and *fort.FG*.aux1.bin* written if *FGmaxData.fgmax_output_format* is
+        *'binary'*, see :func:`read_fgmax_binary`.  By default the binary
+        files are read if they exist and are newer than the text files.
         """
     
         if self.point_style is None:
@@ -288,110 +311,377 @@ class FGmaxGrid(object):
             self.fgno = fgno
         if outdir is not None:
             self.outdir = outdir
+        if quantities is None:
+            quantities = fgmax_quantities
+        for q in quantities:
+            if q not in fgmax_quantities:
+                raise ValueError("Unknown fgmax quantity %s" % q)
+
+        if point_style in [0,1]:
+            fg_shape = (self.npts,)
+        elif point_style == 2:
+            fg_shape = (self.nx,self.ny)
+        elif point_style == 3:
+            fg_shape = (self.n12,self.n23)
+        else:
+            raise NotImplemented("Not implemented for point_style %s" \
+                % point_style)
+        npts = int(numpy.prod(fg_shape))
     
+        def read_columns(fname):
+            binary = output_format == 'binary'
+            if output_format is None and os.path.isfile(fname + '.bin'):
+                binary = not os.path.isfile(fname) or \
+                         os.path.getmtime(fname + '.bin') \
+                                >= os.path.getmtime(fname)
+            elif output_format not in [None, 'ascii', 'binary']:
+                raise ValueError("Unknown output_format %s" % output_format)
+            if binary:
+                fname = fname + '.bin'
+            if not os.path.isfile(fname):
+                raise IOError("File not found: %s" % fname)
+            print "Reading %s ..." % fname
+            if binary:
+                return read_fgmax_binary(fname, npts)
+            else:
+                return read_fgmax_columns(fname, npts, cache=cache)
+
         fname = self.outdir + '/fort.FG%s.valuemax' % self.fgno
-        if not os.path.isfile(fname):
-            raise IOError("File not found: %s" % fname)
-        print "Reading %s ..." % fname
-        d = numpy.loadtxt(fname)
+        d = read_columns(fname)
     
-        fname = os.path.join(self.outdir, '/fort.FG%s.aux1' % self.fgno)
-        fname = self.outdir + '/fort.FG%s.aux1' % self.fgno
-        if not os.path.isfile(fname):
-            raise IOError("File not found: %s" % fname)
-        print "Reading %s ..." % fname
-        daux = numpy.loadtxt(fname)
-    
-        ncols = d.shape[1]  
+        ncols = d.shape[0]  
         if ncols not in [6,8,14]:
             raise IOError("*** Unexpected number of columns %s in file %s" \
                     % (ncols, fname))
     
-        ind_x = 0
-        ind_y = 1
-        ind_level = 2
-        ind_h = 3
+        # Column of each quantity:
+        ind = {'X': 0, 'Y': 1, 'level': 2, 'h': 3}
         if ncols == 6:
-            ind_h_time = 4
-            ind_arrival_time = 5
+            names = ['h_time']
         elif ncols == 8:
-            ind_s = 4
-            ind_h_time = 5
-            ind_s_time = 6
-            ind_arrival_time = 7
+            names = ['s', 'h_time', 's_time']
         elif ncols == 14:
-            ind_s = 4
-            ind_hs = 5
-            ind_hss = 6
-            ind_hmin = 7
-            ind_h_time = 8
-            ind_s_time = 9
-            ind_hs_time = 10
-            ind_hss_time = 11
-            ind_hmin_time = 12
-            ind_arrival_time = 13
-    
-        if point_style in [0,1]:
-            fg_shape = (self.npts,)
-        elif point_style == 2:
-            fg_shape = (self.nx,self.ny)
-        elif point_style == 3:
-            fg_shape = (self.n12,self.n23)
-        else:
-            raise NotImplemented("Not implemented for point_style %s" \
-                % point_style)
+            names = ['s', 'hs', 'hss', 'hmin', 'h_time', 's_time', 'hs_time',
+                     'hss_time', 'hmin_time']
+        for i,name in enumerate(names):
+            ind[name] = 4 + i
+        ind['arrival_time'] = ncols - 1
+
+        def column(name):
+            return numpy.reshape(d[ind[name]], fg_shape, order='F')
     
-        X = numpy.reshape(d[:,0],fg_shape,order='F')
-        Y = numpy.reshape(d[:,1],fg_shape,order='F')
-        y0 = 0.5*(Y.min() + Y.max())   # mid-latitude for scaling plots
-        h = numpy.reshape(d[:,ind_h],fg_shape,order='F')
+        X = column('X')
+        Y = column('Y')
+        h = column('h')
     
         # AMR level used for each fgmax value:
-        level = numpy.reshape(d[:,ind_level].astype('int'),fg_shape,order='F')
+        level = column('level').astype('int')
         
-        topo = []
-        nlevels = daux.shape[1]
-        for i in range(2,nlevels):
-            topoi = numpy.reshape(daux[:,i],fg_shape,order='F')
-            topoi = ma.masked_where(topoi < -1e50, topoi)
-            topo.append(topoi)
-    
-        B = ma.masked_where(level==0, topo[0])  # level==0 ==> never updated
-        levelmax = level.max()
-        for i in range(levelmax):
-            B = numpy.where(level==i+1, topo[i], B)
-    
         mask = (h < -1e50)  # points that were never set
-        B = ma.masked_where(mask, B)
-        h = ma.masked_where(mask, h)
-
-        def set_q_time(ind_q, ind_q_time):  
-            q = numpy.reshape(d[:,ind_q],fg_shape,order='F')
-            q = ma.masked_where(mask,q) 
-            q_time = numpy.reshape(d[:,ind_q_time],fg_shape,order='F')  
-            q_time = ma.masked_where(mask, q_time)      
-            return q, q_time
-    
-        self.h, self.h_time = set_q_time(ind_h, ind_h_time)
-        if ncols > 6:
-            self.s, self.s_time = set_q_time(ind_s, ind_s_time)
-        if ncols > 8:
-            self.hs, self.hs_time = set_q_time(ind_hs, ind_hs_time)
-            self.hss, self.hss_time = set_q_time(ind_hss, ind_hss_time)
-            self.hmin, self.hmin_time = set_q_time(ind_hmin, ind_hmin_time)
-    
-        # last column is arrival times:
-        arrival_time = numpy.reshape(d[:,ind_arrival_time],fg_shape,order='F')
-        arrival_time = ma.masked_where(arrival_time < -1e50, arrival_time)  
-        arrival_time = ma.masked_where(mask, arrival_time)
-        self.arrival_time = arrival_time
+
+        for name in fgmax_quantities:
+            if name in ['B', 'arrival_time']:
+                continue
+            elif name in quantities and name in ind:
+                setattr(self, name, ma.masked_where(mask, column(name)))
+            else:
+                setattr(self, name, None)
+
+        if 'arrival_time' in quantities:
+            # last column is arrival times:
+            arrival_time = column('arrival_time')
+            arrival_time = ma.masked_where(mask | (arrival_time < -1e50), 
+                                           arrival_time)
+            self.arrival_time = arrival_time
+        else:
+            self.arrival_time = None
+
+        if 'B' in quantities:
+            fname = self.outdir + '/fort.FG%s.aux1' % self.fgno
+            daux = read_columns(fname)
+
+            # topography on the level used for each value, level 0 is
+            # never updated:
+            levelmax = level.max()
+            if 2 + levelmax > daux.shape[0]:
+                raise IOError("*** Too few columns in %s for level %s" 
+                              % (fname, levelmax))
+            level_flat = level.ravel(order='F')
+            B = daux[numpy.maximum(level_flat, 1) + 1, 
+                     numpy.arange(npts)]
+            B = numpy.reshape(B, fg_shape, order='F')
+            if levelmax == 0:
+                B = ma.masked_where(level==0, B)
+            B = ma.masked_where(mask, B)
+            self.B = B
+        else:
+            self.B = None
     
         self.level = level
         self.X = X
         self.Y = Y
-        self.B = B
-        self.h = h
-    
+
+
+def read_fgmax_binary(fname, npts):
+    r"""
+    Read the binary fgmax output file *fname* with *npts* points.
+
+    The file holds the columns of the corresponding text file one after
+    another in double precision, as written by *fgmax_finalize* with stream
+    access.  Returns a read-only memory-mapped array of shape *(ncols, npts)*
+    like :func:`read_fgmax_columns`.
+    """
+
+    num_values = os.path.getsize(fname) // 8
+    if npts == 0 or num_values % npts != 0 \
+                 or os.path.getsize(fname) % 8 != 0:
+        raise IOError("*** Size of %s does not match %s points" 
+                      % (fname, npts))
+    return numpy.memmap(fname, dtype=numpy.float64, mode='r', 
+                        shape=(num_values // npts, npts))
+
+
+def read_fgmax_columns(fname, npts, cache=True):
+    r"""
+    Read the columns of the fgmax output file *fname* with *npts* lines.
+
+    Returns an array of shape *(ncols, npts)* holding one column of the file
+    in each row, so that each column is contiguous.  The text is parsed in 
+    blocks of lines.
+
+    If *cache* is True the columns are also saved to the binary file 
+    *fname + '.npy'*, whose modification time is set to that of *fname*.
+    Later reads memory-map this file instead of parsing the text as long as
+    *fname* has the same modification time, so only the columns that are 
+    used are read from disk.
+    """
+
+    cache_path = fname + '.npy'
+    mtime = os.path.getmtime(fname)
+    if cache and os.path.isfile(cache_path) \
+             and abs(os.path.getmtime(cache_path) - mtime) < 1e-3:
+        columns = numpy.load(cache_path, mmap_mode='r')
+        if columns.ndim == 2 and columns.shape[1] == npts:
+            return columns
+
+    with open(fname) as data_file:
+        ncols = len(data_file.readline().split())
+        data_file.seek(0)
+
+        tmp_path = "%s.%s.tmp" % (cache_path, os.getpid())
+        columns = None
+        if cache:
+            try:
+                columns = numpy.lib.format.open_memmap(tmp_path, mode='w+',
+                                                       shape=(ncols, npts))
+            except (IOError, OSError):
+                # e.g. the output directory is read-only
+                cache = False
+        if columns is None:
+            columns = numpy.empty((ncols, npts))
+
+        rows_per_block = max(1, topotools.ascii_block_values // max(ncols,1))
+        try:
+            for k in xrange(0, npts, rows_per_block):
+                num_rows = min(rows_per_block, npts - k)
+                block = topotools.read_ascii_rows(data_file, num_rows, ncols)
+                columns[:,k:k + num_rows] = block.T
+        except:
+            # e.g. a truncated file of a running job, leave no partial cache
+            if cache:
+                del columns
+                os.remove(tmp_path)
+            raise
+
+    if cache:
+        columns.flush()
+        del columns
+        os.rename(tmp_path, cache_path)
+        os.utime(cache_path, (mtime, mtime))
+        columns = numpy.load(cache_path, mmap_mode='r')
+
+    return columns
+
+
+class FGmaxEnsemble(FGmaxGrid):
+
+    """
+    Statistics of the fgmax results of an ensemble of GeoClaw runs on the 
+    same fgmax grid, e.g. the scenarios of a probabilistic hazard study.
+
+    Set up the grid as for *FGmaxGrid*, e.g. with *read_input_data*, then
+    call *read_ensemble* with the output directories of all runs.  The runs
+    are read one at a time, possibly by several processes, and only the
+    running statistics are kept in memory.  Afterwards each quantity 
+    attribute, e.g. *h*, holds its maximum over the ensemble (the earliest
+    time for *arrival_time*) and
+
+     - *exceedance[q]* holds the weighted probability that *q* exceeds each
+       of *exceedance_levels[q]* (for *arrival_time* the probability of
+       arrival by each time), with shape *(len(levels),) + grid shape*,
+     - *percentile_values[q]* holds the values of *q* at each of 
+       *percentiles*, interpolated in the exceedance curve, with shape 
+       *(len(percentiles),) + grid shape*.
+    """
+
+    def __init__(self):
+        super(FGmaxEnsemble, self).__init__()
+        self.exceedance_levels = {}
+        self.exceedance = {}
+        self.percentiles = []
+        self.percentile_values = {}
+        self.total_weight = None
+        self.num_runs = 0
+
+
+    def read_ensemble(self, outdirs, exceedance_levels, weights=None,
+                            percentiles=[50., 90.], fgno=None, n_workers=1, 
+                            cache=True, output_format=None):
+        r"""
+        Accumulate the fgmax results in each of *outdirs*.
+
+        :Input:
+          - *outdirs* (list) Output directories of the runs.
+          - *exceedance_levels* (dict) Sorted levels of each quantity at which
+            to compute exceedance probabilities, e.g. 
+            *{'h': [0.1, 0.5, 1., 2.], 'arrival_time': [600., 1800.]}*.  Its
+            keys are the quantities read from each run.
+          - *weights* (list) Weight of each run, e.g. scenario probabilities.
+            Defaults to equal weights.
+          - *percentiles* (list) Percentiles, in percent, to estimate from
+            the exceedance curves.  Values below the first level are
+            reported as the first level and above the last level as the
+            ensemble maximum.  Arrival times later than the last level are
+            masked.
+          - *n_workers* (int) Number of processes reading runs in parallel,
+            each accumulating statistics of a share of the runs.  *None*
+            uses all cores.
+          - *fgno*, *cache*, *output_format* are passed to *read_output*.
+        """
+
+        if fgno is not None:
+            self.fgno = fgno
+        if weights is None:
+            weights = numpy.ones(len(outdirs))
+        weights = numpy.asarray(weights, dtype=float)
+        if weights.shape != (len(outdirs),):
+            raise ValueError("Need one weight for each of %s outdirs" 
+                             % len(outdirs))
+        if len(outdirs) == 0:
+            raise ValueError("No outdirs given")
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+
+        levels = {}
+        for q in exceedance_levels.keys():
+            if q not in fgmax_quantities or q == 'B':
+                raise ValueError("Unknown fgmax quantity %s" % q)
+            levels[q] = numpy.array(exceedance_levels[q], dtype=float)
+            if numpy.any(numpy.diff(levels[q]) <= 0.):
+                raise ValueError("exceedance_levels[%s] must be increasing" 
+                                 % q)
+
+        # Plain FGmaxGrid with the grid parameters for reading each run:
+        fg = FGmaxGrid()
+        for name in ['point_style', 'npts', 'nx', 'ny', 'n12', 'n23', 'fgno']:
+            setattr(fg, name, getattr(self, name))
+
+        num_chunks = min(len(outdirs), 4 * max(n_workers, 1))
+        edges = numpy.linspace(0, len(outdirs), num_chunks + 1).astype(int)
+        chunks = [(fg, outdirs[i:j], weights[i:j], levels, cache, 
+                   output_format) for i,j in zip(edges[:-1], edges[1:])]
+        if n_workers > 1:
+            pool = multiprocessing.Pool(n_workers)
+            try:
+                chunk_stats = pool.imap_unordered(_ensemble_chunk, chunks)
+                stats = reduce(_merge_ensemble_stats, chunk_stats)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            stats = reduce(_merge_ensemble_stats, 
+                           itertools.imap(_ensemble_chunk, chunks))
+
+        self.X = stats['X']
+        self.Y = stats['Y']
+        self.num_runs = stats['num_runs']
+        self.total_weight = stats['weight']
+        self.exceedance_levels = levels
+        self.percentiles = list(percentiles)
+        for q in levels.keys():
+            extreme = stats['extreme'][q]
+            setattr(self, q, ma.masked_invalid(extreme))
+            exceedance = stats['exceedance'][q] / self.total_weight
+            self.exceedance[q] = exceedance
+
+            # Percentiles from the cumulative distribution at the levels:
+            if q == 'arrival_time':
+                cdf = exceedance
+            else:
+                cdf = 1. - exceedance
+            L = levels[q]
+            cdf = cdf.reshape(L.shape[0], -1)
+            points = numpy.arange(cdf.shape[1])
+            values = numpy.empty((len(percentiles), cdf.shape[1]))
+            for n,p in enumerate(percentiles):
+                # first level where the distribution reaches the percentile
+                f = 0.01 * p
+                j = (cdf < f).sum(axis=0)
+                j0 = numpy.maximum(j - 1, 0)
+                j1 = numpy.minimum(j, L.shape[0] - 1)
+                c0 = cdf[j0, points]
+                c1 = cdf[j1, points]
+                with numpy.errstate(divide='ignore', invalid='ignore'):
+                    v = L[j0] + (f - c0) / (c1 - c0) * (L[j1] - L[j0])
+                v = numpy.where(j == 0, L[0], v)
+                if q == 'arrival_time':
+                    # later than the last level, or never arrived
+                    v = numpy.where(j == L.shape[0], numpy.nan, v)
+                else:
+                    v = numpy.where(j == L.shape[0], extreme.ravel(), v)
+                values[n] = v
+            values = values.reshape((len(percentiles),) + extreme.shape)
+            self.percentile_values[q] = ma.masked_invalid(values)
+
+
+def _ensemble_chunk(args):
+    r"""Accumulate the statistics of a chunk of runs of *read_ensemble*."""
+
+    fg, outdirs, weights, levels, cache, output_format = args
+    stats = None
+    for outdir, weight in zip(outdirs, weights):
+        fg.read_output(outdir=outdir, quantities=levels.keys(), cache=cache,
+                       output_format=output_format)
+        run_stats = {'X': fg.X, 'Y': fg.Y, 'weight': weight, 'num_runs': 1,
+                     'extreme': {}, 'exceedance': {}}
+        for q,L in levels.items():
+            L = L.reshape((-1,) + (1,)*fg.X.ndim)
+            if q == 'arrival_time':
+                # never arrived counts as arriving after all levels
+                v = ma.filled(getattr(fg, q).astype(float), numpy.inf)
+                run_stats['exceedance'][q] = weight * (v <= L)
+            else:
+                v = ma.filled(getattr(fg, q).astype(float), -numpy.inf)
+                run_stats['exceedance'][q] = weight * (v > L)
+            run_stats['extreme'][q] = v
+        stats = _merge_ensemble_stats(stats, run_stats)
+    return stats
+
+
+def _merge_ensemble_stats(a, b):
+    r"""Combine statistics *a* and *b* of two sets of runs."""
+
+    if a is None:
+        return b
+    for q in a['extreme'].keys():
+        if q == 'arrival_time':
+            a['extreme'][q] = numpy.minimum(a['extreme'][q], b['extreme'][q])
+        else:
+            a['extreme'][q] = numpy.maximum(a['extreme'][q], b['extreme'][q])
+        a['exceedance'][q] = a['exceedance'][q] + b['exceedance'][q]
+    a['weight'] += b['weight']
+    a['num_runs'] += b['num_runs']
+    return a
 
 
 ## == Old versions now deprecated....
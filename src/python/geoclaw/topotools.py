@@ -9,10 +9,17 @@ topography (bathymetry) files.
 
 :Classes:
  - Topography 
+ - TopoCatalog
 
 :Functions:
 
  - determine_topo_type
+ - read_ascii_rows
+ - write_ascii_rows
+ - open_data_file
+ - polygon_mask
+ - contour_lines
+ - mosaic
  - create_topo_func
  - topo1writer
  - topo2writer 
@@ -25,17 +32,48 @@ topography (bathymetry) files.
  - Add functions for creating topography based off a topo function, incorporate
    the create_topo_func into Topography class, maybe allow more broad 
    initialization ability to the class to handle this?
- - Fix `in_poly` function
  - Add remove/fill no data value
  - Add more robust plotting capabilities
 """
 
 import os
+import io
+import gzip
+import itertools
+import collections
+import multiprocessing
 
 import numpy
 
 import clawpack.geoclaw.util as util
 import clawpack.geoclaw.data
+import clawpack.geoclaw.datatools.fixdata as fixdata
+
+# Size in bytes of the ASCII header that precedes the raster in binary
+# (topo_type 4) files
+binary_header_size = 1024
+
+# Approximate number of values parsed at once when streaming ASCII files
+ascii_block_values = 2**18
+
+# Number of points processed at once by Topography.interp_unstructured
+interp_block_size = 2**16
+
+# Approximate number of grid points or edge crossings handled at once by
+# polygon_mask
+polygon_block_size = 2**18
+
+# Approximate number of values read at once by Topography.resample
+resample_block_size = 2**20
+
+# Number of grid cells in each tile of rows searched by contour_lines
+contour_block_size = 2**18
+
+# Number of target grid points merged at once by mosaic
+mosaic_block_size = 2**16
+
+# Maximum number of children of a node of the TopoCatalog search tree
+catalog_node_size = 16
 
 # ==============================================================================
 #  Topography Related Functions
@@ -50,7 +88,9 @@ def determine_topo_type(path, default=None):
      - *default* (object) - Value returned if no suitable topo type was 
        determined.  Default is *None*.
 
-    returns integer between 1-3 or *default* if nothing matches.
+    returns integer between 1-4 or *default* if nothing matches.  Note that
+    topo_type 4 refers to the binary format written by :meth:`Topography.write`
+    and is only understood by the Python tools.
     
     """
 
@@ -69,6 +109,694 @@ def determine_topo_type(path, default=None):
     return topo_type
 
 
+def read_ascii_rows(data_file, num_rows, num_cols, rows=None, cols=None,
+                    values_per_line=None):
+    r"""Parse rows of an ASCII raster from an open file in blocks.
+
+    Reads the rows *rows* of a raster with *num_rows* rows of *num_cols* 
+    values each from *data_file*, which should be positioned at the start of
+    the first row.  Rows before *rows* are skipped without being parsed and
+    the file is left positioned after the last row requested, so that only
+    memory for the requested window is needed.  Blocks of about 
+    *ascii_block_values* values are tokenized at once rather than line by 
+    line.
+
+    :Input:
+     - *data_file* (file) - Open file positioned at the first row.
+     - *num_rows* (int) - Number of rows in the raster.
+     - *num_cols* (int) - Number of values in each row.
+     - *rows* (slice) - Rows to return counted from the start of the file.  
+       Defaults to all rows.
+     - *cols* (slice) - Columns to return.  Defaults to all columns.
+     - *values_per_line* (int) - Number of values on each line of the file, 
+       must divide *num_cols*.  Defaults to *num_cols*, i.e. one row per line.
+
+    returns a 2d array of the requested rows in the order they are stored in
+    the file.
+    """
+
+    if rows is None:
+        rows = slice(0, num_rows)
+    if cols is None:
+        cols = slice(0, num_cols)
+    if values_per_line is None:
+        values_per_line = num_cols
+    if num_cols % values_per_line != 0:
+        raise ValueError("values_per_line = %s does not divide num_cols = %s"
+                         % (values_per_line, num_cols))
+    lines_per_row = num_cols // values_per_line
+    row_start, row_stop = rows.indices(num_rows)[:2]
+    col_start, col_stop = cols.indices(num_cols)[:2]
+
+    # Skip rows before the window without parsing them
+    collections.deque(itertools.islice(data_file, row_start * lines_per_row),
+                      maxlen=0)
+
+    num_out = max(0, row_stop - row_start)
+    data = numpy.empty((num_out, max(0, col_stop - col_start)))
+    rows_per_block = max(1, ascii_block_values // num_cols)
+    for j in xrange(0, num_out, rows_per_block):
+        num_block = min(rows_per_block, num_out - j)
+        lines = list(itertools.islice(data_file, num_block * lines_per_row))
+        values = _parse_ascii_values(lines)
+        if values.shape[0] != num_block * num_cols:
+            raise IOError("Expected %s values in rows %s to %s, found %s." 
+                          % (num_block * num_cols, row_start + j, 
+                             row_start + j + num_block, values.shape[0]))
+        data[j:j + num_block, :] = values.reshape(num_block, 
+                                                  num_cols)[:, cols]
+
+    return data
+
+
+def write_ascii_rows(data_file, data, line_format):
+    r"""Write the rows of the 2d array *data* to *data_file* in blocks.
+
+    Each row is written by applying *line_format* to its values, formatting 
+    blocks of about *ascii_block_values* values at once.  For example,
+    *line_format = "%s %s %s\n"* for an array with 3 columns.
+    """
+
+    rows_per_block = max(1, ascii_block_values // max(1, data.shape[1]))
+    for i in xrange(0, data.shape[0], rows_per_block):
+        block = numpy.asarray(data[i:i + rows_per_block, :])
+        data_file.write((line_format * block.shape[0]) 
+                                                % tuple(block.ravel().tolist()))
+
+
+def open_data_file(path, mode='r'):
+    r"""Open the data file at *path*, (de)compressing it if it ends in `.gz`.
+    """
+
+    if os.path.splitext(path)[-1][1:] in ["gz"]:
+        if 'r' in mode:
+            return io.BufferedReader(gzip.open(path, 'rb'))
+        else:
+            return gzip.open(path, 'wb')
+    return open(path, mode)
+
+
+def _parse_ascii_values(lines):
+    r"""Convert a list of lines of whitespace separated numbers to a 1d array.
+    """
+    return numpy.array(''.join(lines).split(), dtype=float)
+
+
+def _region_slices(x, y, filter_region):
+    r"""Return slices (rows, cols) of the grid defined by 1d arrays *x* and *y*
+    that lie inside of *filter_region* = [x1, x2, y1, y2], including the edges.
+    """
+
+    indices_x = ((x >= filter_region[0]) * (x <= filter_region[1])).nonzero()[0]
+    indices_y = ((y >= filter_region[2]) * (y <= filter_region[3])).nonzero()[0]
+    if len(indices_x) == 0 or len(indices_y) == 0:
+        raise ValueError("No points were found inside requested filter "
+                         "region %s." % str(filter_region))
+
+    return (slice(indices_y[0], indices_y[-1] + 1),
+            slice(indices_x[0], indices_x[-1] + 1))
+
+
+def _grid_coordinates(x, y):
+    r"""Return 2d coordinate arrays (X, Y) with the layout of numpy.meshgrid
+    for the 1d arrays *x* and *y*.
+
+    The arrays are read-only views of *x* and *y* with zero strides along the
+    broadcast dimension, so they take no memory of their own.
+    """
+
+    x = numpy.asarray(x)
+    y = numpy.asarray(y)
+    shape = (y.shape[0], x.shape[0])
+    X = numpy.lib.stride_tricks.as_strided(x, shape=shape, 
+                                           strides=(0, x.strides[0]))
+    Y = numpy.lib.stride_tricks.as_strided(y, shape=shape, 
+                                           strides=(y.strides[0], 0))
+    X.flags.writeable = False
+    Y.flags.writeable = False
+    return X, Y
+
+
+def _polygon_edges(polygon):
+    r"""Return the edges of the closed rings in *polygon* as an array with
+    columns x0, y0, x1, y1.
+
+    *polygon* is either a single ring given as a sequence of points (x,y),
+    a list of such rings or an array with two columns in which rings are
+    separated by rows of nan, as returned by 
+    :meth:`Topography.make_shoreline_xy`.
+    """
+
+    if isinstance(polygon, numpy.ndarray) and polygon.ndim == 2:
+        rings = [polygon]
+    else:
+        rings = list(polygon)
+        if len(rings) > 0 and numpy.ndim(rings[0]) == 1:
+            rings = [rings]
+
+    edges = []
+    for ring in rings:
+        ring = numpy.asarray(ring, dtype=float).reshape(-1, 2)
+        breaks = numpy.isnan(ring).any(axis=1).nonzero()[0]
+        for part in numpy.split(ring, breaks):
+            part = part[~numpy.isnan(part).any(axis=1)]
+            if part.shape[0] > 2:
+                edges.append(numpy.hstack((part, numpy.roll(part, -1, 
+                                                                axis=0))))
+    if len(edges) == 0:
+        return numpy.empty((0, 4))
+    return numpy.vstack(edges)
+
+
+def polygon_mask(x, y, polygon):
+    r"""Return a boolean array that is True for the points of the grid defined
+    by 1d arrays *x* and *y* that lie inside of *polygon*.
+
+    Uses the even-odd rule, so several polygons can be given at once and
+    rings that lie inside of another ring are holes.  Each grid row is treated
+    as a scanline: the crossings of all polygon edges with the row are
+    located in *x* and the crossing counts are accumulated along the row.  
+    Rows are processed in blocks of about *polygon_block_size* points and 
+    crossings so the 2d coordinate arrays are never formed.
+
+    :Input:
+     - *x* (ndarray) Increasing 1d coordinate array in x direction.
+     - *y* (ndarray) 1d coordinate array in y direction.
+     - *polygon* (list) A ring of points (x,y), a list of rings or an array
+       with two columns in which rings are separated by rows of nan.  The 
+       rings are closed automatically and may have either orientation.
+
+    :Output:
+     - *mask* (ndarray) Boolean array of shape (len(y), len(x)).
+    """
+
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    mask = numpy.zeros((y.shape[0], x.shape[0]), dtype=bool)
+
+    edges = _polygon_edges(polygon)
+    # Horizontal edges never cross a scanline
+    edges = edges[edges[:,1] != edges[:,3]]
+    if edges.shape[0] == 0 or x.shape[0] == 0:
+        return mask
+
+    # Only rows and edges within the y range of the polygon matter
+    rows = ((y >= edges[:,[1,3]].min()) 
+          * (y <= edges[:,[1,3]].max())).nonzero()[0]
+    x0, y0, x1, y1 = edges.T
+    slope = (x1 - x0) / (y1 - y0)
+
+    num_cols = x.shape[0] + 1
+    rows_per_block = max(1, polygon_block_size // max(num_cols, 
+                                                       edges.shape[0]))
+    for k in xrange(0, rows.shape[0], rows_per_block):
+        block = rows[k:k + rows_per_block]
+        y_block = y[block].reshape(-1, 1)
+
+        # Half open rule so that vertices are counted exactly once
+        crosses = (y0 <= y_block) != (y1 <= y_block)
+        row, edge = crosses.nonzero()
+        x_cross = x0[edge] + (y_block[row, 0] - y0[edge]) * slope[edge]
+
+        # Points strictly to the right of a crossing change parity
+        col = numpy.searchsorted(x, x_cross, side='right')
+        parity = numpy.bincount(row * num_cols + col,
+                                minlength=block.shape[0] * num_cols)
+        parity = parity.reshape(block.shape[0], num_cols)[:,:-1]
+        mask[block,:] = numpy.cumsum(parity, axis=1) % 2 == 1
+
+    return mask
+
+
+def _grid_locate(x, points):
+    r"""Locate *points* in the increasing 1d grid *x*.
+
+    Returns the index *i* of the grid interval [x[i], x[i+1]] containing each
+    point, the offset of the point from x[i] and whether the point lies
+    inside of the grid at all.
+    """
+
+    i = numpy.searchsorted(x, points, side='right') - 1
+    i = numpy.clip(i, 0, x.shape[0] - 2)
+    inside = (x[0] <= points) & (points <= x[-1])
+    return i, points - x[i], inside
+
+
+def _contour_table():
+    r"""Segments of the marching squares cases.
+
+    Returns arrays *start* and *end* of shape (16, 2, 2) with the edges at
+    which the segments of a cell start and end, indexed by the case, whether
+    the center of the cell is above the level and the segment number, -1
+    where there is no segment.  Corners are numbered counterclockwise from
+    the lower left, bit *k* of the case is set if corner *k* is at or above
+    the level and edge *k* runs from corner *k* to corner *k+1* (bottom,
+    right, top, left).  Segments are oriented with the higher values on the
+    left, so they start where the counterclockwise traversal of the cell
+    boundary goes from high to low and end where it goes from low to high.
+    """
+
+    start = -numpy.ones((16, 2, 2), dtype=int)
+    end = -numpy.ones((16, 2, 2), dtype=int)
+    for case in xrange(16):
+        high = [(case >> k) & 1 for k in xrange(4)]
+        down = [k for k in xrange(4) if high[k] and not high[(k + 1) % 4]]
+        up = [k for k in xrange(4) if not high[k] and high[(k + 1) % 4]]
+        if len(down) == 1:
+            start[case,:,0] = down[0]
+            end[case,:,0] = up[0]
+    # Saddles, a high center connects the high corners
+    start[5,0], end[5,0] = [0, 2], [3, 1]
+    start[5,1], end[5,1] = [0, 2], [1, 3]
+    start[10,0], end[10,0] = [1, 3], [0, 2]
+    start[10,1], end[10,1] = [3, 1], [0, 2]
+    return start, end
+
+
+def _contour_rows(x, y, Z, levels, row_start, row_end):
+    r"""Contour segments of the cells in rows *row_start* to *row_end* - 1.
+
+    Returns the global ids of the edges at which the segments start and end
+    and the coordinates of these points.  Horizontal edge (j, i) from
+    (x[i], y[j]) to (x[i+1], y[j]) has id j*(nx-1) + i, vertical edge (j, i)
+    from (x[i], y[j]) to (x[i], y[j+1]) follows with id ny*(nx-1) + j*nx + i
+    and the ids of level *n* are offset by *n* times the number of edges.
+    """
+
+    ny, nx = Z.shape
+    num_horizontal = ny * (nx - 1)
+    num_edges = num_horizontal + (ny - 1) * nx
+    table_start, table_end = _contour_table()
+
+    Z = numpy.ma.filled(numpy.ma.asarray(Z[row_start:row_end + 1,:],
+                                         dtype=float), numpy.nan)
+    finite = numpy.isfinite(Z)
+    if not finite.all():
+        # Compare without nan, cells with missing corners are dropped anyway
+        Z_compare = numpy.where(finite, Z, -numpy.inf)
+        finite = finite[:-1,:-1] & finite[:-1,1:] & finite[1:,1:] \
+               & finite[1:,:-1]
+    else:
+        Z_compare = Z
+        finite = None
+
+    start_ids = []
+    end_ids = []
+    start_points = []
+    end_points = []
+    for (n, level) in enumerate(levels):
+        # Only cells with corners on both sides of the level are needed
+        high = (Z_compare >= level).astype(numpy.uint8)
+        case = high[:-1,:-1] + 2 * high[:-1,1:] + 4 * high[1:,1:] \
+                             + 8 * high[1:,:-1]
+        crossed = (case != 0) & (case != 15)
+        if finite is not None:
+            crossed &= finite
+        j, i = crossed.nonzero()
+        case = case[j,i].astype(int)
+
+        # Corners counterclockwise from the lower left of each cell
+        corners = numpy.array([Z[j,i], Z[j,i + 1], Z[j + 1,i + 1], 
+                               Z[j + 1,i]])
+        x_corners = numpy.array([x[i], x[i + 1], x[i + 1], x[i]])
+        j = j + row_start
+        y_corners = numpy.array([y[j], y[j], y[j + 1], y[j + 1]])
+        center = (corners.mean(axis=0) >= level).astype(int)
+
+        # Edge ids of the cells, bottom, right, top and left
+        cell_edges = numpy.array([j * (nx - 1) + i,
+                                  num_horizontal + j * nx + i + 1,
+                                  (j + 1) * (nx - 1) + i,
+                                  num_horizontal + j * nx + i]) \
+                     + n * num_edges
+        cells = numpy.arange(j.shape[0])
+
+        for segment in xrange(2):
+            start = table_start[case, center, segment]
+            end = table_end[case, center, segment]
+            present = start >= 0
+            c = cells[present]
+            for (edges, ids, points) in [(start, start_ids, start_points),
+                                         (end, end_ids, end_points)]:
+                edges = edges[present]
+                ids.append(cell_edges[edges, c])
+                z0 = corners[edges, c]
+                z1 = corners[(edges + 1) % 4, c]
+                t = (level - z0) / (z1 - z0)
+                px = x_corners[edges, c]
+                py = y_corners[edges, c]
+                points.append(numpy.column_stack(
+                    (px + t * (x_corners[(edges + 1) % 4, c] - px),
+                     py + t * (y_corners[(edges + 1) % 4, c] - py))))
+
+    return (numpy.concatenate(start_ids), numpy.concatenate(end_ids),
+            numpy.concatenate(start_points), numpy.concatenate(end_points))
+
+
+def _contour_worker_init(x, y, Z, levels):
+    r"""Store the shared state of *contour_lines* in a worker process."""
+
+    global _contour_worker_state
+    _contour_worker_state = (x, y, Z, levels)
+
+
+def _contour_worker(tile):
+    r"""Find the contour segments of one tile of rows in a worker process."""
+
+    x, y, Z, levels = _contour_worker_state
+    return _contour_rows(x, y, Z, levels, tile[0], tile[1])
+
+
+def _pointer_jump(previous, jump, rank, smallest, active):
+    r"""Pointer jumping on linked chains given by the *previous* node of each
+    node or -1.
+
+    Advances the *active* nodes until *jump* is the head of their chain and
+    *rank* their distance to it, keeping in *smallest* the smallest node 
+    passed.  Nodes are dropped from the work as soon as they reach their
+    head, nodes on loops are returned once their pointers went around the
+    whole loop.
+    """
+
+    # Chains and loops are at most as long as the number of nodes
+    max_length = active.shape[0]
+    active = active[previous[jump[active]] >= 0]
+    steps = 1
+    while active.shape[0] > 0 and steps < max_length:
+        target = jump[active]
+        rank[active] += rank[target]
+        smallest[active] = numpy.minimum(smallest[active], smallest[target])
+        jump[active] = jump[target]
+        steps *= 2
+        active = active[previous[jump[active]] >= 0]
+    return active
+
+
+def contour_lines(x, y, Z, levels, n_workers=1):
+    r"""Contour lines of the gridded data *Z* by marching squares.
+
+    Each cell of the grid is classified by which of its corners are at or
+    above the level, the segments of all cells are found at once and joined
+    into lines through the ids of the cell edges they cross.  Cells with nan
+    or masked corners are skipped.  The lines are oriented with higher
+    values on the left and closed lines repeat their first point at the end.
+
+    :Input:
+     - *x*, *y* (ndarray) 1d coordinate arrays of the grid.
+     - *Z* (ndarray) Data of shape (len(y), len(x)).
+     - *levels* (float or list) Contour level or list of levels.
+     - *n_workers* (int) Number of processes finding segments.  The rows of
+       the grid are split into tiles of about *contour_block_size* cells that
+       a *multiprocessing.Pool* processes in parallel before the segments are
+       joined.  *None* uses all cores.  Default is 1, no worker processes.
+
+    :Output:
+     - *xy* (ndarray) Array with 2 columns of the points of the lines, which
+       are separated by rows of nan, or a list of such arrays if *levels* is
+       a list.
+    """
+
+    single_level = numpy.ndim(levels) == 0
+    levels = numpy.atleast_1d(numpy.asarray(levels, dtype=float))
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    ny, nx = Z.shape
+    num_edges = ny * (nx - 1) + (ny - 1) * nx
+    if nx < 2 or ny < 2:
+        if single_level:
+            return numpy.empty((0, 2))
+        return [numpy.empty((0, 2)) for level in levels]
+
+    # Tiles of rows of cells, neighbouring tiles share a row of grid points
+    rows_per_tile = max(1, contour_block_size // max(nx, 1))
+    tiles = [(j, min(j + rows_per_tile, ny - 1))
+             for j in xrange(0, ny - 1, rows_per_tile)]
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = min(n_workers, len(tiles))
+    if n_workers <= 1:
+        segments = [_contour_rows(x, y, Z, levels, *tile) for tile in tiles]
+    else:
+        pool = multiprocessing.Pool(n_workers,
+                                    initializer=_contour_worker_init,
+                                    initargs=(x, y, Z, levels))
+        try:
+            segments = pool.map(_contour_worker, tiles)
+        finally:
+            pool.close()
+            pool.join()
+
+    start_ids, end_ids, start_points, end_points = \
+                    [numpy.concatenate(arrays) for arrays in zip(*segments)]
+
+    # Edge ids of level n are offset by n times the number of edges
+    level = start_ids // num_edges
+    lines = []
+    for n in xrange(levels.shape[0]):
+        on_level = level == n
+        lines.append(_join_segments(start_ids[on_level], end_ids[on_level],
+                                    start_points[on_level], 
+                                    end_points[on_level]))
+    if single_level:
+        return lines[0]
+    return lines
+
+
+def _join_segments(start_ids, end_ids, start_points, end_points):
+    r"""Join contour segments into lines separated by rows of nan."""
+
+    num_segments = start_ids.shape[0]
+    if num_segments == 0:
+        return numpy.empty((0, 2))
+
+    # The segment following each segment starts at the edge where it ends,
+    # each edge is the start of at most one segment
+    order = numpy.argsort(start_ids)
+    position = numpy.searchsorted(start_ids[order], end_ids)
+    following = order[numpy.minimum(position, num_segments - 1)]
+    has_following = start_ids[following] == end_ids
+    previous = -numpy.ones(num_segments, dtype=int)
+    previous[following[has_following]] = has_following.nonzero()[0]
+
+    # Rank the segments in their lines, closed lines are opened at their
+    # segment with the smallest index and ranked again
+    nodes = numpy.arange(num_segments)
+    jump = numpy.where(previous < 0, nodes, previous)
+    rank = (previous >= 0).astype(int)
+    smallest = nodes.copy()
+    in_loop = _pointer_jump(previous, jump, rank, smallest, nodes)
+    if in_loop.shape[0] > 0:
+        previous[in_loop[smallest[in_loop] == in_loop]] = -1
+        jump[in_loop] = numpy.where(previous[in_loop] < 0, in_loop, 
+                                    previous[in_loop])
+        rank[in_loop] = previous[in_loop] >= 0
+        _pointer_jump(previous, jump, rank, smallest, in_loop)
+
+    # Points of the lines in order of their first segment, each line ends 
+    # with the end point of its last segment and is followed by a row of nan
+    heads = (previous < 0).nonzero()[0]
+    line_of_head = numpy.zeros(num_segments, dtype=int)
+    line_of_head[heads] = numpy.arange(heads.shape[0])
+    line = line_of_head[jump]
+    length = numpy.bincount(line)
+    first_row = numpy.cumsum(length + 2) - length - 2
+    rows = first_row[line] + rank
+    xy = numpy.empty((num_segments + 2 * heads.shape[0], 2))
+    xy.fill(numpy.nan)
+    xy[rows,:] = start_points
+    last = rank == length[line] - 1
+    xy[rows[last] + 1,:] = end_points[last]
+    return xy[:-1]
+
+
+def mosaic(topofiles, extent, delta, method='cell_average', n_workers=1):
+    r"""Merge several topography files into one raster as GeoClaw sees them.
+
+    Where files overlap the finest one is used, with the resolution measured
+    by the area of a grid cell of each file, and of files with the same
+    resolution the one listed last is used, as in the Fortran *topo_module*.
+
+    The raster consists of the cells of size *delta* that cover *extent*, 
+    like a computational grid, and its points are the cell centers.  With 
+    *cell_average* each value is the average of the topography over the cell
+    computed like GeoClaw integrates topography into a grid cell: every part
+    of the cell is integrated with the bilinear interpolant of the finest 
+    file covering it.  Cells not covered completely by the files are nan.  
+    The work is done with array operations per file on blocks of about 
+    *mosaic_block_size* cells.
+
+    :Input:
+     - *topofiles* (list) Topography objects, paths or entries of
+       *TopographyData.topofiles*, i.e. lists whose first entry is the 
+       topo_type and last entry is the path.
+     - *extent* (tuple) Region [x1, x2, y1, y2] covered by the raster.
+     - *delta* (float or tuple) Cell size *dx* or *(dx, dy)*.
+     - *method* (string) *cell_average* or *bilinear*, which interpolates the
+       finest file covering each cell center.
+     - *n_workers* (int) Number of processes sharing the work.  The rows of 
+       the raster are split into tiles that a *multiprocessing.Pool* merges
+       in parallel into an array in shared memory.  *None* uses all cores.
+       Default is 1, no worker processes.
+
+    :Output:
+     - *topo* (Topography) The merged topography.
+    """
+
+    if method not in ['cell_average', 'bilinear']:
+        raise ValueError("Unknown mosaic method %s" % method)
+
+    topos = []
+    for topo in topofiles:
+        topo = _as_topography(topo)
+        if topo.unstructured:
+            raise ValueError("Unstructured topography cannot be merged, "
+                             "first interpolate the data.")
+        # Read the data once, worker processes share it
+        topo.Z
+        topos.append(topo)
+    if len(topos) == 0:
+        raise ValueError("No topography files to merge.")
+
+    # Finest first, later files first for equal resolution
+    cell_areas = [(topo.x[1] - topo.x[0]) * (topo.y[1] - topo.y[0])
+                  for topo in topos]
+    order = sorted(xrange(len(topos)), key=lambda k: (cell_areas[k], -k))
+    topos = [topos[k] for k in order]
+
+    try:
+        delta_x, delta_y = delta
+    except TypeError:
+        delta_x = delta_y = delta
+    num_cells = (max(1, int(round((extent[1] - extent[0]) / delta_x))),
+                 max(1, int(round((extent[3] - extent[2]) / delta_y))))
+    x = extent[0] + (numpy.arange(num_cells[0]) + 0.5) * delta_x
+    y = extent[2] + (numpy.arange(num_cells[1]) + 0.5) * delta_y
+
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = min(n_workers, y.shape[0])
+    shape = (y.shape[0], x.shape[0])
+    if n_workers <= 1:
+        Z = numpy.empty(shape)
+        _mosaic_rows(topos, x, y, delta_x, delta_y, method, 0, shape[0], Z)
+    else:
+        raw, Z = util.shared_array(shape, float)
+        num_tiles = min(shape[0], 4 * n_workers)
+        edges = numpy.linspace(0, shape[0], num_tiles + 1).astype(int)
+        tiles = zip(edges[:-1], edges[1:])
+        pool = multiprocessing.Pool(n_workers, 
+                     initializer=_mosaic_worker_init,
+                     initargs=(raw, shape, topos, x, y, delta_x, delta_y, 
+                               method))
+        try:
+            pool.map(_mosaic_worker, tiles)
+        finally:
+            pool.close()
+            pool.join()
+        Z = numpy.array(Z)
+
+    merged = Topography()
+    merged.x = x
+    merged.y = y
+    merged.Z = Z
+    merged.topo_type = 3
+    return merged
+
+
+def _as_topography(topofile):
+    r"""Return a Topography for *topofile*, which may be a Topography, a path
+    or an entry of *TopographyData.topofiles*."""
+
+    if isinstance(topofile, Topography):
+        return topofile
+    elif isinstance(topofile, basestring):
+        return Topography(path=topofile)
+    return Topography(path=topofile[-1], topo_type=topofile[0])
+
+
+def _mosaic_rows(topos, x, y, delta_x, delta_y, method, row_start, row_end,
+                 Z):
+    r"""Merge rows *row_start* to *row_end* of the raster of *mosaic* into 
+    *Z*."""
+
+    rows_per_block = max(1, mosaic_block_size // x.shape[0])
+    for j0 in xrange(row_start, row_end, rows_per_block):
+        j1 = min(j0 + rows_per_block, row_end)
+        X, Y = _grid_coordinates(x, y[j0:j1])
+        if method == 'bilinear':
+            values = numpy.empty(X.shape)
+            values.fill(numpy.nan)
+            for topo in reversed(topos):
+                inside = (topo.x[0] <= X) & (X <= topo.x[-1]) \
+                       & (topo.y[0] <= Y) & (Y <= topo.y[-1])
+                values[inside] = topo.sample(X[inside], Y[inside])
+        else:
+            x1 = (X - 0.5 * delta_x).ravel()
+            y1 = (Y - 0.5 * delta_y).ravel()
+            integral, area = _mosaic_integral(topos, 0, x1, x1 + delta_x, 
+                                              y1, y1 + delta_y)
+            cell_area = delta_x * delta_y
+            values = numpy.where(area >= (1.0 - 1e-10) * cell_area, 
+                                 integral / cell_area, numpy.nan)
+        Z[j0:j1,:] = values.reshape(X.shape)
+
+
+def _mosaic_integral(topos, m, x1, x2, y1, y2):
+    r"""Integral of the topography and the area covered by it over the 
+    rectangles [x1, x2] x [y1, y2] using *topos[m:]*, finest first.
+
+    Same recursion as *rectintegral* in the Fortran *topo_module*: the 
+    integral using the coarser files is corrected where *topos[m]* 
+    intersects a rectangle by subtracting their integral over the 
+    intersection and adding the one of *topos[m]*.
+    """
+
+    topo = topos[m]
+    grid_x = numpy.asarray(topo.x, dtype=float)
+    grid_y = numpy.asarray(topo.y, dtype=float)
+    xm1 = numpy.maximum(x1, grid_x[0])
+    xm2 = numpy.minimum(x2, grid_x[-1])
+    ym1 = numpy.maximum(y1, grid_y[0])
+    ym2 = numpy.minimum(y2, grid_y[-1])
+    hit = (xm1 < xm2) & (ym1 < ym2)
+
+    if m == len(topos) - 1:
+        integral = numpy.zeros(x1.shape)
+        area = numpy.zeros(x1.shape)
+    else:
+        integral, area = _mosaic_integral(topos, m + 1, x1, x2, y1, y2)
+
+    if hit.any():
+        xm1, xm2, ym1, ym2 = xm1[hit], xm2[hit], ym1[hit], ym2[hit]
+        area_m = (xm2 - xm1) * (ym2 - ym1)
+        integral_m = topo._cell_average(grid_x, grid_y, xm1, xm2, ym1, ym2) \
+                     * area_m
+        if m < len(topos) - 1:
+            integral_c, area_c = _mosaic_integral(topos, m + 1, 
+                                                  xm1, xm2, ym1, ym2)
+            integral_m -= integral_c
+            area_m -= area_c
+        integral[hit] += integral_m
+        area[hit] += area_m
+
+    return integral, area
+
+
+def _mosaic_worker_init(raw, shape, topos, x, y, delta_x, delta_y, method):
+    r"""Store the shared state of *mosaic* in a worker process."""
+
+    global _mosaic_worker_state
+    Z = util.shared_array_view(raw, shape, float)
+    _mosaic_worker_state = (topos, x, y, delta_x, delta_y, method, Z)
+
+
+def _mosaic_worker(tile):
+    r"""Merge one tile of rows of *mosaic* in a worker process."""
+
+    topos, x, y, delta_x, delta_y, method, Z = _mosaic_worker_state
+    _mosaic_rows(topos, x, y, delta_x, delta_y, method, tile[0], tile[1], Z)
+
+
 def create_topo_func(loc,verbose=False):
     """
     Given a 1-dimensional topography profile specfied by a set of (x,z) 
@@ -312,6 +1040,8 @@ class Topography(object):
     @x.setter
     def x(self, value):
         self._extent = None
+        self._X = None
+        self._Y = None
         self._x = value
     @x.deleter
     def x(self):
@@ -319,7 +1049,11 @@ class Topography(object):
 
     @property
     def X(self):
-        r"""Two dimensional coordinate array in x direction."""
+        r"""Two dimensional coordinate array in x direction.
+
+        For gridded data this is a read-only view of *x*, see 
+        :meth:`generate_2d_coordinates`.
+        """
         if self._X is None:
             self.generate_2d_coordinates(mask=False)
         return self._X
@@ -336,6 +1070,8 @@ class Topography(object):
     @y.setter
     def y(self, value):
         self._extent = None
+        self._X = None
+        self._Y = None
         self._y = value
     @y.deleter
     def y(self):
@@ -343,7 +1079,11 @@ class Topography(object):
 
     @property
     def Y(self):
-        r"""Two dimensional coordinate array in y direction."""
+        r"""Two dimensional coordinate array in y direction.
+
+        For gridded data this is a read-only view of *y*, see 
+        :meth:`generate_2d_coordinates`.
+        """
         if self._Y is None:
             self.generate_2d_coordinates(mask=False)
         return self._Y
@@ -420,6 +1160,7 @@ class Topography(object):
         self._Y = None
         self._extent = None
         self._delta = None
+        self._binary_dtype = None
 
         self.coordinate_transform = lambda x,y: (x,y)
 
@@ -471,7 +1212,12 @@ class Topography(object):
 
 
     def generate_2d_coordinates(self, mask=False):
-        r"""Generate 2d coordinate arrays."""
+        r"""Generate 2d coordinate arrays.
+
+        The arrays are read-only views of the 1d arrays *x* and *y* that are
+        broadcast to the shape of *Z*, so no memory is needed to store them.
+        Copy them before modifying them in place.
+        """
 
         # Check to see if we need to generate these
         if self._X is None and self._Y is None:
@@ -479,7 +1225,7 @@ class Topography(object):
             # RJL: Added this to generate from _x and _y if available.
             # Correct?
             if (self._x is not None) and (self._y is not None):
-                self._X,self._Y = numpy.meshgrid(self._x, self._y)
+                self._X, self._Y = _grid_coordinates(self._x, self._y)
 
         if self._X is None and self._Y is None:
             if self.unstructured:
@@ -494,12 +1240,12 @@ class Topography(object):
                 if abs(self.topo_type) == 1:
                     # Reading this topo_type should produce the X and Y arrays
                     self.read(mask=mask)
-                elif abs(self.topo_type) in [2,3]:
+                elif abs(self.topo_type) in [2,3,4]:
                     if self._x is None or self._y is None:
                         # Try to read the data to get these, may not have been done yet
                         self.read(mask=mask)
                     # Generate arrays
-                    self._X, self._Y = numpy.meshgrid(self._x, self._y)
+                    self._X, self._Y = _grid_coordinates(self._x, self._y)
                 else:
                     raise ValueError("Unrecognized topo_type: %s" % self.topo_type)
 
@@ -507,7 +1253,7 @@ class Topography(object):
                 if self._x is None or self._y is None:
                     raise ValueError("The x and y arrays must be set to ",
                                      "create 2d coordinate arrays.")
-                self._X, self._Y = numpy.meshgrid(self._x, self._y)
+                self._X, self._Y = _grid_coordinates(self._x, self._y)
 
             
             # If masking has been requested try to get the mask first from 
@@ -540,10 +1286,17 @@ class Topography(object):
          - *unstructured* (bool) - default is False for lat-long grids.
          - *mask* (bool) - whether to store as masked array for missing
            values (default if False)
-         - *filter_region* (tuple)
+         - *filter_region* (tuple) - Only keep the part of the data inside of
+           the rectangle (x1, x2, y1, y2), edges included.
 
         The first three might have already been set when instatiating object.
 
+        ASCII files are parsed in blocks of rows (see *read_ascii_rows*).  For
+        topo_type 2 and 3 the rows outside of *filter_region* are skipped
+        without being parsed and reading stops after the last row needed, so
+        that the memory used is proportional to the region kept rather than
+        the file.
+
         """
 
         if (path is None) and (self.path is None):
@@ -577,25 +1330,20 @@ class Topography(object):
         if self.unstructured:
             # Read in the data as series of tuples
             data = numpy.loadtxt(self.path)
-            points = []
-            values = []
-
             # Filter region if requested
             if filter_region is not None:
-                for coordinate in data:
-                    if filter_region[0] <= coordinate[0] <= filter_region[1]:
-                        if filter_region[2] <= coordinate[1] <= filter_region[3]:
-                            points.append(coordinate[0:2])
-                            values.append(coordinate[2])
+                data = data[(filter_region[0] <= data[:,0]) * 
+                            (data[:,0] <= filter_region[1]) *
+                            (filter_region[2] <= data[:,1]) *
+                            (data[:,1] <= filter_region[3])]
 
-                if len(points) == 0:
+                if data.shape[0] == 0:
                     raise Exception("No points were found inside requested " \
                                   + "filter region.")
 
-                # Cast lists as ndarrays
-                self._x = numpy.array(points[:,0])
-                self._y = numpy.array(points[:,1])
-                self._z = numpy.array(values)
+                self._x = data[:,0]
+                self._y = data[:,1]
+                self._z = data[:,2]
 
             else:
                 self._x = data[:,0]
@@ -605,33 +1353,84 @@ class Topography(object):
         else:
             # Data is in one of the GeoClaw supported formats
             if abs(self.topo_type) == 1:
-                data = numpy.loadtxt(self.path)
-                N = [0,0]
-                y0 = data[0,1]
-                for (n, y) in enumerate(data[1:,1]):
-                    if y != y0:
-                        N[1] = n + 1
-                        break
-                N[0] = data.shape[0] / N[1]
-
-                self._x = data[:N[1],0]
-                self._y = data[::N[1],1]
+                # Stream the file in blocks of lines, only keeping points 
+                # inside of the filter region
+                blocks = []
+                with open_data_file(self.path, 'r') as data_file:
+                    while True:
+                        lines = list(itertools.islice(data_file, 
+                                                      ascii_block_values // 3))
+                        if len(lines) == 0:
+                            break
+                        data = _parse_ascii_values(lines).reshape(-1, 3)
+                        if filter_region is not None:
+                            data = data[(filter_region[0] <= data[:,0]) * 
+                                        (data[:,0] <= filter_region[1]) *
+                                        (filter_region[2] <= data[:,1]) *
+                                        (data[:,1] <= filter_region[3])]
+                        blocks.append(data)
+                data = numpy.concatenate(blocks)
+                if data.shape[0] == 0:
+                    raise Exception("No points were found inside requested " \
+                                  + "filter region.")
+
+                # Number of points in each row, the first change in y
+                row_change = (data[1:,1] != data[0,1]).nonzero()[0]
+                if len(row_change) > 0:
+                    N = [data.shape[0] // (row_change[0] + 1), 
+                         row_change[0] + 1]
+                else:
+                    N = [1, data.shape[0]]
+
+                self._x = data[:N[1],0].copy()
+                self._y = numpy.flipud(data[::N[1],1])
                 self._Z = numpy.flipud(data[:,2].reshape(N))
-                self._delta = self.X[0,1] - self.X[0,0]
+                if N[1] > 1:
+                    self._delta = self._x[1] - self._x[0]
+                else:
+                    self._delta = None
 
-            elif abs(self.topo_type) in [2,3]:
+            elif abs(self.topo_type) in [2,3,4]:
                 # Get header information
                 N = self.read_header()  # note this also sets self._extent
                 self._x = numpy.linspace(self.extent[0], self.extent[1], N[0])
                 self._y = numpy.linspace(self.extent[2], self.extent[3], N[1])
 
-                if abs(self.topo_type) == 2:
-                    # Data is read in as a single column, reshape it
-                    self._Z = numpy.loadtxt(self.path, skiprows=6).reshape(N[1],N[0])
-                    self._Z = numpy.flipud(self._Z)
-                elif abs(self.topo_type) == 3:
-                    # Data is read in starting at the top right corner
-                    self._Z = numpy.flipud(numpy.loadtxt(self.path, skiprows=6))
+                # Slices of the grid to keep, rows counted from the south
+                rows, cols = slice(0, N[1]), slice(0, N[0])
+                if filter_region is not None:
+                    rows, cols = _region_slices(self._x, self._y, 
+                                                filter_region)
+                    self._x = self._x[cols]
+                    self._y = self._y[rows]
+                    self._extent = None
+
+                if abs(self.topo_type) in [2,3]:
+                    # Data is stored starting at the top left corner, only
+                    # parse the rows needed.  Type 2 has one value per line.
+                    if abs(self.topo_type) == 2:
+                        values_per_line = 1
+                    else:
+                        values_per_line = N[0]
+                    with open_data_file(self.path, 'r') as data_file:
+                        for n in xrange(6):
+                            data_file.readline()
+                        self._Z = numpy.flipud(read_ascii_rows(data_file, 
+                                    N[1], N[0], 
+                                    rows=slice(N[1] - rows.stop, 
+                                               N[1] - rows.start),
+                                    cols=cols, 
+                                    values_per_line=values_per_line))
+                elif abs(self.topo_type) == 4:
+                    # Binary data is stored starting at the lower left corner
+                    # so it can be mapped directly without flipping, slices
+                    # of Z are then only read from disk when accessed.  Copy
+                    # on write so that modifications never touch the file.
+                    self._Z = numpy.memmap(self.path, 
+                                           dtype=self._binary_dtype, 
+                                           mode='c', 
+                                           offset=binary_header_size, 
+                                           shape=(N[1], N[0]))[rows, cols]
         
                 if mask:
                     self._Z = numpy.ma.masked_values(self._Z, self.no_data_value, copy=False)
@@ -647,29 +1446,6 @@ class Topography(object):
             # Make sure these are set to None to force re-generating:
             self._X = None
             self._Y = None
-                
-            # Perform region filtering
-            if filter_region is not None:
-                # Find indices of region
-                region_index = [None, None, None, None]
-                region_index[0] = (self.x >= filter_region[0]).nonzero()[0][0]
-                region_index[1] = (self.x <= filter_region[1]).nonzero()[0][-1]
-                region_index[2] = (self.y >= filter_region[2]).nonzero()[0][0]
-                region_index[3] = (self.y <= filter_region[3]).nonzero()[0][-1]
-
-                self._x = self._x[region_index[0]:region_index[1]]
-                self._y = self._y[region_index[2]:region_index[3]]
-
-                # Force regeneration of 2d coordinate arrays and extent
-                if self._X is not None or self._Y is not None:
-                    del self._X, self._Y
-                    self._X = None
-                    self._Y = None
-                self._extent = None
-
-                # Modify Z array as well
-                self._Z = self._Z[region_index[2]:region_index[3],
-                                  region_index[0]:region_index[1]]
 
 
     def read_header(self):
@@ -681,14 +1457,14 @@ class Topography(object):
 
         """
 
-        if abs(self.topo_type) in [2,3]:
+        if abs(self.topo_type) in [2,3,4]:
 
             # Default values to track errors
             num_cells = [numpy.nan,numpy.nan]
             self._extent = [numpy.nan,numpy.nan,numpy.nan,numpy.nan]
             self._delta = numpy.nan
 
-            with open(self.path, 'r') as topo_file:
+            with open_data_file(self.path, 'r') as topo_file:
                 # Check to see if we need to flip the header values
                 first_line = topo_file.readline()
                 try:
@@ -722,6 +1498,11 @@ class Topography(object):
                     
                         
                 self.no_data_value = float(topo_file.readline().split()[value_index])
+
+                if abs(self.topo_type) == 4:
+                    # Binary files also record the data type of the raster
+                    self._binary_dtype = numpy.dtype(
+                                     topo_file.readline().split()[value_index])
                 
                 self._extent[1] = self._extent[0] + \
                                     (num_cells[0]-1)*self._delta[0]
@@ -733,7 +1514,8 @@ class Topography(object):
             
         return num_cells
 
-    def write(self, path, no_data_value=None, topo_type=None, masked=True):
+    def write(self, path, no_data_value=None, topo_type=None, masked=True,
+                    dtype='float64', precision=None):
         r"""Write out a topography file to path of type *topo_type*.
 
         Writes out a topography file of topo type specified with *topo_type* or
@@ -741,6 +1523,21 @@ class Topography(object):
         from data in Z.  The rest of the arguments are used to write the header
         data.
 
+        Data is formatted in blocks of rows at a time.  Values are written 
+        with *precision* digits after the decimal point in exponential 
+        notation, by default 15 for topo_type 2 and 3 while topo_type 1 and
+        unstructured data use Python's *str*.  If *masked* is True masked 
+        values are replaced by *no_data_value*.  If *path* ends in `.gz` 
+        the output is compressed with gzip, which *read* handles 
+        transparently.
+
+        A *topo_type* of 4 (e.g. a file ending in `.tt4`) writes a binary file
+        consisting of a fixed size ASCII header, in the same form as the 
+        header of topo_type 3, followed by the raster stored contiguously 
+        from the lower left corner with data type *dtype* (`float64` or 
+        `float32`).  Reading such a file maps the raster into memory with
+        *numpy.memmap* so that *Z* and *crop* only read the parts needed.
+
         """
 
         # Determine topo type if not specified
@@ -764,62 +1561,102 @@ class Topography(object):
         if no_data_value is None:
             no_data_value = self.no_data_value
 
-        # Check to see if masks have been applied to topography, if so use them
-        # if masked is True
-        if isinstance(self.Z, numpy.ma.MaskedArray) and masked:
-            pass
+        if topo_type == 4 and not self.unstructured:
+            if os.path.splitext(path)[-1][1:] in ["gz"]:
+                raise ValueError("Binary topography cannot be compressed.")
+            dtype = numpy.dtype(dtype)
+            if dtype not in [numpy.float32, numpy.float64]:
+                raise ValueError("Binary topography must be float32 or "
+                                 "float64, given %s." % dtype)
+            # Delta may be stored as (dx, dy) if read from a header
+            delta = numpy.atleast_1d(self.delta)
+            header = ''.join(['%6i                              ncols\n' 
+                                                              % self.Z.shape[1],
+                              '%6i                              nrows\n' 
+                                                              % self.Z.shape[0],
+                              '%22.15e              xlower\n' % self.extent[0],
+                              '%22.15e              ylower\n' % self.extent[2],
+                              '%22.15e %22.15e   cellsize\n' % (delta[0], 
+                                                                  delta[-1]),
+                              '%10i                          nodata_value\n' 
+                                                                % no_data_value,
+                              '%6s                              dtype\n'
+                                                                % dtype.str])
+            if len(header) >= binary_header_size:
+                raise ValueError("Binary header too long: %s" % header)
+
+            with open(path, 'wb') as outfile:
+                outfile.write(header.ljust(binary_header_size - 1) + '\n')
+
+                # Write blocks of rows so that memory mapped or very large 
+                # arrays do not need to be copied in full
+                block_size = max(1, 2**22 // self.Z.shape[1])
+                for j in xrange(0, self.Z.shape[0], block_size):
+                    Z_block = self.Z[j:j + block_size, :]
+                    if isinstance(Z_block, numpy.ma.MaskedArray):
+                        Z_block = Z_block.filled(no_data_value)
+                    numpy.asarray(Z_block, dtype=dtype).tofile(outfile)
+            return
+
+        if precision is None:
+            value_format = "%22.15e"
+            coordinate_format = "%s"
         else:
-            pass
+            value_format = "%%%i.%ie" % (precision + 7, precision)
+            coordinate_format = value_format
 
-        with open(path, 'w') as outfile:
+        with open_data_file(path, 'w') as outfile:
             if self.unstructured:
-                for (i, topo) in enumerate(self.z):
-                    outfile.write("%s %s %s\n" % (self.x[i], self.y[i], topo))
-
-            elif topo_type == 1:
-                # longitudes = numpy.linspace(lower[0], lower[0] + delta * Z.shape[0], Z.shape[0])
-                # latitudes = numpy.linspace(lower[1], lower[1] + delta * Z.shape[1], Z.shape[1])
-                for j in range(len(self.y)-1, -1, -1):
-                    latitude = self.y[j]
-                    for (i, longitude) in enumerate(self.x):
-                        outfile.write("%s %s %s\n" % (longitude, latitude, self.Z[j,i]))
-
-            elif topo_type == 2 or topo_type == 3:
-                # Write out header
-                outfile.write('%6i                              ncols\n' % self.Z.shape[1])
-                outfile.write('%6i                              nrows\n' % self.Z.shape[0])
-                outfile.write('%22.15e              xlower\n' % self.extent[0])
-                outfile.write('%22.15e              ylower\n' % self.extent[2])
-                outfile.write('%22.15e              cellsize\n' % self.delta)
-                outfile.write('%10i                          nodata_value\n' % no_data_value)
-
-                masked_Z = isinstance(self.Z, numpy.ma.MaskedArray)
-
-                # Write out topography data
-                if topo_type == 2:
-                    if masked_Z:
-                        Z_filled = numpy.flipud(self.Z.filled())
-                    else:
-                        Z_filled = numpy.flipud(self.Z)
-                    for i in xrange(self.Z.shape[0]):
-                        for j in xrange(self.Z.shape[1]):
-                            outfile.write("%22.15e\n" % Z_filled[i,j])
-                    if masked_Z:
-                        del Z_filled
-                elif topo_type == 3:
-                    if masked_Z:
-                        Z_flipped = numpy.flipud(self.Z.filled())
-                    else:
-                        Z_flipped = numpy.flipud(self.Z)
-                    for i in xrange(self.Z.shape[0]):
-                        for j in xrange(self.Z.shape[1]):
-                            outfile.write("%22.15e   " % (Z_flipped[i,j]))
-                        outfile.write("\n")
-                    if masked_Z:
-                        del Z_flipped
+                write_ascii_rows(outfile, 
+                                 numpy.column_stack((self.x, self.y, self.z)),
+                                 " ".join(3 * [coordinate_format]) + "\n")
+
+            elif topo_type in [1, 2, 3]:
+                if topo_type in [2, 3]:
+                    # Write out header
+                    delta = numpy.atleast_1d(self.delta)
+                    if delta[0] == delta[-1]:
+                        delta = delta[:1]
+                    outfile.write('%6i                              ncols\n' % self.Z.shape[1])
+                    outfile.write('%6i                              nrows\n' % self.Z.shape[0])
+                    outfile.write('%22.15e              xlower\n' % self.extent[0])
+                    outfile.write('%22.15e              ylower\n' % self.extent[2])
+                    outfile.write(len(delta) * '%22.15e ' % tuple(delta) 
+                                             + '             cellsize\n')
+                    outfile.write('%10i                          nodata_value\n' % no_data_value)
+
+                # Write out topography data starting from the upper left
+                # corner in blocks of rows
+                Z_flipped = numpy.flipud(self.Z)
+                y_flipped = numpy.flipud(self.y)
+                num_cols = self.Z.shape[1]
+                rows_per_block = max(1, ascii_block_values // num_cols)
+                for i in xrange(0, self.Z.shape[0], rows_per_block):
+                    Z_block = Z_flipped[i:i + rows_per_block, :]
+                    if isinstance(Z_block, numpy.ma.MaskedArray):
+                        if masked:
+                            Z_block = Z_block.filled(no_data_value)
+                        else:
+                            Z_block = Z_block.data
+
+                    if topo_type == 1:
+                        num_rows = Z_block.shape[0]
+                        write_ascii_rows(outfile, numpy.column_stack((
+                              numpy.tile(self.x, num_rows),
+                              numpy.repeat(y_flipped[i:i + num_rows], num_cols),
+                              Z_block.ravel())),
+                              " ".join(3 * [coordinate_format]) + "\n")
+                    elif topo_type == 2:
+                        write_ascii_rows(outfile, Z_block.reshape(-1, 1), 
+                                         value_format + "\n")
+                    elif topo_type == 3:
+                        write_ascii_rows(outfile, Z_block, 
+                                         num_cols * (value_format + "   ") 
+                                         + "\n")
 
             else:
-                raise NotImplemented("Output type %s not implemented." % topo_type)
+                raise NotImplementedError("Output type %s not implemented." 
+                                          % topo_type)
 
 
     def plot(self, axes=None, contour_levels=None, contour_kwargs={}, 
@@ -903,8 +1740,9 @@ class Topography(object):
                                     marker=',', linewidths=(0.0,))
         elif isinstance(self.Z, numpy.ma.MaskedArray):
             # Adjust coordinates so color pixels centered at X,Y locations
-            plot = axes.pcolor(self.X - self.delta / 2.0, 
-                               self.Y - self.delta / 2.0, 
+            delta = numpy.atleast_1d(self.delta)
+            plot = axes.pcolor(self.x - delta[0] / 2.0, 
+                               self.y - delta[-1] / 2.0, 
                                self.Z, 
                                vmin=topo_extent[0], 
                                vmax=topo_extent[1],
@@ -922,7 +1760,7 @@ class Topography(object):
         # levels = range(0,int(-numpy.min(Z)),500)
 
         if (contour_levels is not None) and (not self.unstructured):
-            axes.contour(self.X, self.Y, self.Z, levels=contour_levels,
+            axes.contour(self.x, self.y, self.Z, levels=contour_levels,
                  **contour_kwargs)
 
         axes.set_xlim(region_extent[0:2])
@@ -956,14 +1794,17 @@ class Topography(object):
         fill data with the extents, the value *no_data_value* and if 
         *proximity_radius* (meters) is not 0, by a radius of *proximity_radius* 
         from all grid points in the object.  Stores the 
-        result in the *self.X*, *self.Y* and *self.Z* object attributes.  The
+        result in the *self.x*, *self.y* and *self.Z* object attributes.  The
         resolution of the final grid is determined by calculating the minimum
         distance between all *x* and *y* data with a hard lower limit of 
         *delta_limit* (meters).
 
-        Note that the function *scipy.interpolate.griddata* does not respect
-        masks so a call to *numpy.ma.MaskedArray.compressed()* must be made to 
-        remove the masked data.
+        The proximity mask queries a KD-tree (*scipy.spatial.cKDTree*) of the
+        unstructured points, only the part of structured fill data inside of
+        the extent is used, and the interpolant that 
+        *scipy.interpolate.griddata* would use is evaluated on blocks of about
+        *interp_block_size* grid points, so that large surveys and fill DEMs
+        can be merged.
 
         :Input:
          - *fill_topo* (list) - List of Topography objects to use as fill data
@@ -993,6 +1834,7 @@ class Topography(object):
         """
 
         import scipy.interpolate as interpolate
+        import scipy.spatial
 
         # Convert meter inputs to degrees
         mean_latitude = numpy.mean(self.y)
@@ -1024,14 +1866,17 @@ class Topography(object):
               numpy.ceil((extent[3] - extent[2]) / delta_y) )
         if not numpy.all(N[:] < numpy.ones((2)) * resolution_limit):
             ValueError("Calculated resolution too high, N=%s!" % str(N))
-        self._X, self._Y = numpy.meshgrid( 
-                                     numpy.linspace(extent[0], extent[1], N[0]),
-                                     numpy.linspace(extent[2], extent[3], N[1]))
+        x = numpy.linspace(extent[0], extent[1], N[0])
+        y = numpy.linspace(extent[2], extent[3], N[1])
 
         # Add the unstructured points to the data
         points = numpy.array([self.x, self.y]).transpose()
         values = self.z
 
+        # Spatial index of the unstructured points for the proximity mask
+        if proximity_radius > 0.0:
+            tree = scipy.spatial.cKDTree(points)
+
         # Mask fill topography and flatten the arrays if needed
         if not isinstance(fill_topo, list):
             fill_topo = [fill_topo]
@@ -1039,246 +1884,487 @@ class Topography(object):
             if topo.unstructured:
                 x_fill = topo.x
                 y_fill = topo.y
-                z_fill = topo.z
+                z_fill = numpy.ma.getdata(topo.z)
 
-                extent_mask = extent[0] > x_fill
-                extent_mask = numpy.logical_or(extent_mask,extent[1] < x_fill)
-                extent_mask = numpy.logical_or(extent_mask,extent[2] > y_fill)
-                extent_mask = numpy.logical_or(extent_mask,extent[3] < y_fill)
-                
-                # Create fill no-data value mask
-                no_data_mask = numpy.logical_or(extent_mask, z_fill == no_data_value)
-
-                all_mask = numpy.logical_or(extent_mask, no_data_mask)
+                # Create extent mask
+                keep = (extent[0] <= x_fill) & (x_fill <= extent[1]) \
+                     & (extent[2] <= y_fill) & (y_fill <= extent[3]) \
+                     & ~numpy.ma.getmaskarray(topo.z)
 
-                # Create proximity mask
-                if proximity_radius > 0.0:
-                    indices = (~all_mask).nonzero()
-                    for n in xrange(indices[0].shape[0]):
-                        i = indices[0][n]
-                        all_mask[i] = numpy.any(numpy.sqrt((self.x - x_fill[i])**2 
-                                                         + (self.y - y_fill[i])**2)
-                                                     < proximity_radius_deg)
+            else:
+                # Structured fill data, only the part inside of the extent
+                try:
+                    rows, cols = _region_slices(topo.x, topo.y, extent)
+                except ValueError:
+                    continue
+                X_fill, Y_fill = _grid_coordinates(topo.x[cols], topo.y[rows])
+                x_fill = X_fill.ravel()
+                y_fill = Y_fill.ravel()
+                Z_fill = topo.Z[rows, cols]
+                z_fill = numpy.asarray(numpy.ma.getdata(Z_fill)).ravel()
+                keep = ~numpy.ma.getmaskarray(Z_fill).ravel()
+
+            # Create fill no-data value mask
+            keep &= z_fill != no_data_value
+
+            # Create proximity mask, drop fill points closer than 
+            # proximity_radius to any unstructured point
+            if proximity_radius > 0.0:
+                indices = keep.nonzero()[0]
+                for k in xrange(0, indices.shape[0], interp_block_size):
+                    block = indices[k:k + interp_block_size]
+                    distance = tree.query(numpy.column_stack((x_fill[block],
+                                                              y_fill[block])),
+                                  distance_upper_bound=proximity_radius_deg)[0]
+                    keep[block] = distance >= proximity_radius_deg
+
+            # Add the fill bathymetry to points and values
+            fill_points = numpy.column_stack((x_fill[keep], y_fill[keep]))
+
+            points = numpy.concatenate((fill_points, points))
+            values = numpy.concatenate((z_fill[keep], values))
+
+        # Use specified interpolation, as scipy.interpolate.griddata does but
+        # evaluated on blocks of rows of the grid
+        if method == 'nearest':
+            interpolator = interpolate.NearestNDInterpolator(points, values)
+        elif method == 'linear':
+            interpolator = interpolate.LinearNDInterpolator(points, values)
+        elif method == 'cubic':
+            interpolator = interpolate.CloughTocher2DInterpolator(points, 
+                                                                  values)
+        else:
+            raise ValueError("Unknown interpolation method %s" % method)
 
-                x_fill_masked = numpy.ma.masked_where(all_mask, x_fill)
-                y_fill_masked = numpy.ma.masked_where(all_mask, y_fill)
-                z_fill_masked = numpy.ma.masked_where(all_mask, z_fill)    
+        self._Z = numpy.empty((y.shape[0], x.shape[0]))
+        rows_per_block = max(1, interp_block_size // max(x.shape[0], 1))
+        for j in xrange(0, y.shape[0], rows_per_block):
+            block = slice(j, j + rows_per_block)
+            self._Z[block,:] = interpolator(_grid_coordinates(x, y[block]))
 
-                # Add the fill bathymetry to points and values
-                fill_points = numpy.column_stack((x_fill_masked.compressed(), 
-                                                  y_fill_masked.compressed()))
+        self._x = x
+        self._y = y
+        self._X = None
+        self._Y = None
+        self._extent = extent
+        self._delta = (delta_x, delta_y)
+        self.unstructured = False
 
-                points = numpy.concatenate((fill_points, points))
-                values = numpy.concatenate((z_fill_masked.compressed(), values))
 
-            else:
-                # Structured fill data
-                X_fill = topo.X
-                Y_fill = topo.Y
-                Z_fill = topo.Z
+    def in_poly(self, polygon, masked=False):
+        r"""Find the points of the topography that lie inside of *polygon*.
 
-                # Create extent mask
-                extent_mask = extent[0] > X_fill
-                extent_mask = numpy.logical_or(extent_mask,extent[1] < X_fill)
-                extent_mask = numpy.logical_or(extent_mask,extent[2] > Y_fill)
-                extent_mask = numpy.logical_or(extent_mask,extent[3] < Y_fill)
-                
-                # Create fill no-data value mask
-                no_data_mask = numpy.logical_or(extent_mask, Z_fill == no_data_value)
+        Uses the even-odd rule, so several polygons and holes can be given at
+        once, see :func:`polygon_mask`.  The 2d coordinate arrays are not 
+        needed.
 
-                all_mask = numpy.logical_or(extent_mask, no_data_mask)
+        :Input:
+        
+         - *polygon* (list) A ring of points (x,y), a list of rings or an 
+           array with two columns in which rings are separated by rows of nan.
+         - *masked* (bool) If True return a new Topography whose *Z* is 
+           masked outside of the polygon instead of the mask.
 
-                # Create proximity mask
-                if proximity_radius > 0.0:
-                
-                    indices = (~all_mask).nonzero()
-                    for n in xrange(indices[0].shape[0]):
-                        i = indices[0][n]
-                        j = indices[1][n]
-                        all_mask[i,j] = numpy.any(numpy.sqrt((self.x - X_fill[i,j])**2 
-                                                           + (self.y - Y_fill[i,j])**2)
-                                                     < proximity_radius_deg)
+        :Returns:
+        
+         - *mask* (numpy.ndarray) Boolean array of the shape of *Z* that is 
+           True inside of the polygon, or a Topography if *masked* is True.
 
-                X_fill_masked = numpy.ma.masked_where(all_mask, X_fill)
-                Y_fill_masked = numpy.ma.masked_where(all_mask, Y_fill)
-                Z_fill_masked = numpy.ma.masked_where(all_mask, Z_fill)    
+        """
 
-                # Add the fill bathymetry to points and values
-                fill_points = numpy.column_stack((X_fill_masked.compressed(),
-                                                  Y_fill_masked.compressed()))
+        if self.unstructured:
+            raise NotImplemented("*** Cannot currently mask unstructured topo")
 
-                points = numpy.concatenate((fill_points, points))
-                values = numpy.concatenate((Z_fill_masked.compressed(), values))
+        mask = polygon_mask(self.x, self.y, polygon)
+        if not masked:
+            return mask
 
-        # Use specified interpolation
-        self._Z = interpolate.griddata(points, values, (self.X, self.Y), 
-                                                                  method=method)
+        newtopo = Topography()
+        newtopo._x = self._x
+        newtopo._y = self._y
+        newtopo._X = None
+        newtopo._Y = None
+        newtopo._extent = None
+        newtopo._Z = numpy.ma.masked_array(self.Z, 
+                                       mask=numpy.ma.getmaskarray(self.Z) | ~mask)
+        newtopo.no_data_value = self.no_data_value
+        newtopo.unstructured = self.unstructured
+        newtopo.topo_type = self.topo_type
 
-        self._extent = extent
-        self._delta = (delta_x, delta_y)
-        self.unstructured = False
+        return newtopo
 
 
-    def in_poly(self, polygon):
-        r"""Mask points (x,y) that are not in the specified polygon.
+    def sample(self, x, y, method='bilinear', cell_size=None):
+        r"""Sample the topography at the points (*x*, *y*).
 
-        Uses simple ray casting algorithm for speed so beware of corner cases!
+        Points are located in the 1d coordinate arrays, so only the values of 
+        *Z* that are needed are read, which also holds for memory-mapped 
+        binary topography.  Points outside of the extent of the topography 
+        and points depending on masked values are set to nan.
 
         :Input:
-        
-         - *polygon* (list) List of points that comprise the polygon.  Note that
-           order of the points will effect if this works (positive versus negative
-           winding order).  Points should be in counter-clockwise arrangement.
-
-        :Returns:
-        
-         - *X_mask* (numpy.ma.MaskedArray) Masked array of X coordinates where those
-           points outside of the polygon have been masked.
-         - *Y* (numpy.ndarray) Coordinates in y direction in a meshgrid type of
-           configuration.
+         - *x*, *y* (ndarray) Coordinates of the points, broadcast together.
+         - *method* (string) One of:
+
+             - *bilinear* - Bilinear interpolation of the surrounding values.
+             - *nearest* - Value of the nearest grid point.
+             - *cell_average* - Average of the bilinear interpolant over the 
+               cells of size *cell_size* centered at the points.  This is the
+               cell value that GeoClaw computes when it integrates the 
+               topography over a grid cell.  The integrals are evaluated 
+               exactly from summed-area tables of the part of *Z* covered by
+               the cells, cells that are not completely covered are nan.
+         - *cell_size* (float or sequence) Size *dx* or *(dx, dy)* of the
+           cells for *cell_average*, *dx* and *dy* may also be arrays
+           broadcast with the points.
 
+        :Output:
+         - *values* (ndarray) Sampled values with the broadcast shape of *x*
+           and *y*.
         """
-        raise NotImplemented("This function is not quite working yet, please "+\
-                             "try again later")
 
-        TOLERANCE = 1e-6
+        if self.unstructured:
+            raise ValueError("Unstructured data cannot be sampled, first "
+                             "interpolate the data with interp_unstructured.")
+
+        x, y = numpy.broadcast_arrays(numpy.asarray(x, dtype=float), 
+                                      numpy.asarray(y, dtype=float))
+        grid_x = numpy.asarray(self.x, dtype=float)
+        grid_y = numpy.asarray(self.y, dtype=float)
+
+        if method in ['bilinear', 'nearest']:
+            i, offset_x, inside_x = _grid_locate(grid_x, x)
+            j, offset_y, inside_y = _grid_locate(grid_y, y)
+            s = offset_x / (grid_x[i + 1] - grid_x[i])
+            t = offset_y / (grid_y[j + 1] - grid_y[j])
+            if method == 'nearest':
+                values = self._gather(j + (t >= 0.5), i + (s >= 0.5))
+            else:
+                values = (1.0 - t) * ((1.0 - s) * self._gather(j, i) 
+                                            + s * self._gather(j, i + 1)) \
+                               + t * ((1.0 - s) * self._gather(j + 1, i) 
+                                            + s * self._gather(j + 1, i + 1))
+            values = numpy.where(inside_x & inside_y, values, numpy.nan)
+
+        elif method == 'cell_average':
+            if cell_size is None:
+                raise ValueError("cell_size is required for cell_average.")
+            try:
+                dx, dy = cell_size
+            except TypeError:
+                dx = dy = cell_size
+            x1 = x - 0.5 * numpy.asarray(dx)
+            x2 = x + 0.5 * numpy.asarray(dx)
+            y1 = y - 0.5 * numpy.asarray(dy)
+            y2 = y + 0.5 * numpy.asarray(dy)
+            values = numpy.empty(x.shape)
+            values.fill(numpy.nan)
+            inside = (grid_x[0] <= x1) & (x2 <= grid_x[-1]) \
+                   & (grid_y[0] <= y1) & (y2 <= grid_y[-1])
+            if inside.any():
+                x1, x2, y1, y2 = [v[inside] for v in 
+                                  numpy.broadcast_arrays(x1, x2, y1, y2)]
+                values[inside] = self._cell_average(grid_x, grid_y, 
+                                                    x1, x2, y1, y2)
+
+        else:
+            raise ValueError("Unknown sampling method %s" % method)
+
+        return values
 
-        # Flatten the input arrays to make this a bit easier
-        x = self.X.flatten()
-        y = self.Y.flatten()
 
-        # Construct edges
-        edges = []
-        for edge in xrange(len(polygon) - 1):
-            edges.append([polygon[edge], polygon[edge+1]])
-        edges.append([polygon[-1], polygon[0]])
+    def resample(self, delta, method='block_mean'):
+        r"""Resample the topography to the spacing *delta*.
 
-        # Check for intersections
-        num_intersections = numpy.zeros(x.shape[0])
+        The data is processed in chunks of rows of about 
+        *resample_block_size* values, so memory-mapped binary topography is
+        never read completely into memory.  Masked values and values equal 
+        to *no_data_value* are missing data, resampled values that cannot be
+        computed are masked in the result.
 
-        for edge in edges:
-            # Check for a vertical line
-            if numpy.abs(edge[0][0] - edge[1][0]) < TOLERANCE:
-                x_intersect = edge[0][0]        
-            else:
-                edge_slope = (edge[0][1] - edge[1][1]) / (edge[0][0] - edge[1][0])
-                x_intersect = (y - edge[0][1]) / edge_slope + edge[0][0]
+        :Input:
+         - *delta* (float or tuple) New spacing *dx* or *(dx, dy)*.
+         - *method* (string) One of:
+
+             - *block_mean* - Mean of the data in blocks of points, *delta* 
+               has to be an integer multiple of the spacing and the new 
+               points are the centers of the blocks.  Missing data is left
+               out of the mean.
+             - *cell_integral* - Average of the bilinear interpolant over 
+               the cells of size *delta* that fit into the extent, as in 
+               GeoClaw, see :meth:`sample`.  The new points are the cell 
+               centers.
+             - *bilinear* - Bilinear interpolation at points spaced by 
+               *delta* starting at the lower left corner.
 
-            num_intersections += (min(edge[0][1], edge[1][1]) <= y) * \
-                                 (max(edge[0][1], edge[1][1]) >= y) * \
-                                 (x_intersect <= x)
-                                 
+        :Output:
+         - *topo* (Topography) The resampled topography.
+        """
 
-        # General intersection of two lines
-        intersect = (numpy.mod(num_intersections, numpy.ones(x.shape) * 2) != 1)
+        if self.unstructured:
+            raise ValueError("Unstructured data cannot be resampled, first "
+                             "interpolate the data with interp_unstructured.")
+
+        try:
+            delta_x, delta_y = delta
+        except TypeError:
+            delta_x = delta_y = delta
+        x = numpy.asarray(self.x, dtype=float)
+        y = numpy.asarray(self.y, dtype=float)
+        rows_per_chunk = max(1, resample_block_size // x.shape[0])
+
+        if method == 'block_mean':
+            factors = []
+            for (d, coordinate) in [(delta_x, x), (delta_y, y)]:
+                spacing = (coordinate[-1] - coordinate[0]) \
+                          / (coordinate.shape[0] - 1)
+                factor = int(round(d / spacing))
+                if factor < 1 or abs(factor * spacing - d) > 1e-6 * d:
+                    raise ValueError("Spacing %s is not a multiple of the "
+                                     "grid spacing %s" % (d, spacing))
+                factors.append(factor)
+            fx, fy = factors
+            nx = x.shape[0] // fx
+            ny = y.shape[0] // fy
+            new_x = x[:nx * fx].reshape(nx, fx).mean(axis=1)
+            new_y = y[:ny * fy].reshape(ny, fy).mean(axis=1)
+            Z = numpy.empty((ny, nx))
+            blocks_per_chunk = max(1, rows_per_chunk // fy)
+            for j0 in xrange(0, ny, blocks_per_chunk):
+                j1 = min(j0 + blocks_per_chunk, ny)
+                values, good = self._chunk(slice(j0 * fy, j1 * fy), 
+                                           slice(0, nx * fx))
+                shape = (j1 - j0, fy, nx, fx)
+                total = numpy.where(good, values, 0.0).reshape(shape)
+                count = good.reshape(shape).sum(axis=3).sum(axis=1)
+                total = total.sum(axis=3).sum(axis=1)
+                with numpy.errstate(invalid='ignore', divide='ignore'):
+                    Z[j0:j1,:] = numpy.where(count > 0, total / count, 
+                                             numpy.nan)
+
+        elif method in ['cell_integral', 'bilinear']:
+            if method == 'cell_integral':
+                num_x = int(numpy.floor((x[-1] - x[0]) / delta_x + 1e-8))
+                num_y = int(numpy.floor((y[-1] - y[0]) / delta_y + 1e-8))
+                new_x = x[0] + (numpy.arange(num_x) + 0.5) * delta_x
+                new_y = y[0] + (numpy.arange(num_y) + 0.5) * delta_y
+                half_y = 0.5 * delta_y
+            else:
+                num_x = int(numpy.floor((x[-1] - x[0]) / delta_x + 1e-8)) + 1
+                num_y = int(numpy.floor((y[-1] - y[0]) / delta_y + 1e-8)) + 1
+                new_x = numpy.minimum(x[0] + numpy.arange(num_x) * delta_x, 
+                                      x[-1])
+                new_y = numpy.minimum(y[0] + numpy.arange(num_y) * delta_y, 
+                                      y[-1])
+                half_y = 0.0
+            Z = numpy.empty((new_y.shape[0], new_x.shape[0]))
+            new_rows_per_chunk = max(1, int(rows_per_chunk 
+                                            * (y[1] - y[0]) / delta_y))
+            for j0 in xrange(0, new_y.shape[0], new_rows_per_chunk):
+                j1 = min(j0 + new_rows_per_chunk, new_y.shape[0])
+                # Rows of the data needed for these points or cells, at
+                # least two so that points on the last row have an interval
+                row_start = numpy.searchsorted(y, new_y[j0] - half_y,
+                                               side='right') - 1
+                row_start = max(min(row_start, y.shape[0] - 2), 0)
+                row_end = numpy.searchsorted(y, new_y[j1 - 1] + half_y,
+                                             side='left') + 1
+                rows = slice(row_start, max(row_end, row_start + 2))
+                values, good = self._chunk(rows, slice(None))
+                chunk = Topography()
+                chunk.x = x
+                chunk.y = y[rows]
+                chunk.Z = numpy.ma.masked_array(values, mask=~good)
+                X, Y = _grid_coordinates(new_x, new_y[j0:j1])
+                if method == 'cell_integral':
+                    Z[j0:j1,:] = chunk.sample(X, Y, method='cell_average', 
+                                              cell_size=(delta_x, delta_y))
+                else:
+                    Z[j0:j1,:] = chunk.sample(X, Y)
 
-        # Return masked arrays that are reshaped back to the input shapes
-        return numpy.ma.masked_where(intersect, x, copy=False).reshape(self.X.shape), \
-               numpy.ma.masked_where(intersect, y, copy=False).reshape(self.Y.shape)
+        else:
+            raise ValueError("Unknown resampling method %s" % method)
+
+        topo = Topography()
+        topo.x = new_x
+        topo.y = new_y
+        if numpy.isnan(Z).any():
+            Z = numpy.ma.masked_invalid(Z)
+        topo.Z = Z
+        topo.no_data_value = self.no_data_value
+        topo.topo_type = self.topo_type
+        return topo
+
+
+    def _chunk(self, rows, cols):
+        r"""Values of *Z[rows, cols]* as floats and where they are not 
+        missing, i.e. finite, not masked and not *no_data_value*."""
+
+        values = self.Z[rows, cols]
+        good = ~numpy.ma.getmaskarray(values)
+        values = numpy.asarray(numpy.ma.getdata(values), dtype=float)
+        good &= numpy.isfinite(values) & (values != self.no_data_value)
+        return values, good
+
+
+    def _gather(self, j, i):
+        r"""Values of *Z* at the index arrays *j*, *i* as floats, nan where
+        *Z* is masked."""
+
+        values = numpy.asarray(numpy.ma.getdata(self.Z)[j, i], dtype=float)
+        mask = numpy.ma.getmask(self.Z)
+        if mask is not numpy.ma.nomask:
+            values = numpy.where(mask[j, i], numpy.nan, values)
+        return values
+
+
+    def _cell_average(self, grid_x, grid_y, x1, x2, y1, y2):
+        r"""Average of the bilinear interpolant of *Z* over the cells 
+        [x1, x2] x [y1, y2], which lie inside of the grid."""
+
+        # Only the part of Z covering the cells is needed
+        cols = slice(numpy.searchsorted(grid_x, x1.min(), side='right') - 1,
+                     numpy.searchsorted(grid_x, x2.max(), side='left') + 1)
+        rows = slice(numpy.searchsorted(grid_y, y1.min(), side='right') - 1,
+                     numpy.searchsorted(grid_y, y2.max(), side='left') + 1)
+        grid_x = grid_x[cols]
+        grid_y = grid_y[rows]
+        Z = self.Z[rows, cols]
+        Z = numpy.ma.filled(numpy.ma.asarray(Z, dtype=float), numpy.nan)
+
+        # Count of bad values, cells using any of them are nan
+        finite = numpy.isfinite(Z)
+        num_bad = numpy.zeros((Z.shape[0] + 1, Z.shape[1] + 1), dtype=int)
+        num_bad[1:,1:] = (~finite).cumsum(0).cumsum(1)
+
+        # Trapezoidal summed-area tables, exact for the bilinear interpolant
+        # at the grid points, offset by the mean for accuracy
+        offset = Z[finite].mean() if finite.any() else 0.0
+        Z = numpy.where(finite, Z - offset, 0.0)
+        hx = numpy.diff(grid_x)
+        hy = numpy.diff(grid_y).reshape(-1, 1)
+        Sx = numpy.zeros(Z.shape)
+        Sx[:,1:] = numpy.cumsum(0.5 * (Z[:,1:] + Z[:,:-1]) * hx, axis=1)
+        Sy = numpy.zeros(Z.shape)
+        Sy[1:,:] = numpy.cumsum(0.5 * (Z[1:,:] + Z[:-1,:]) * hy, axis=0)
+        Sxy = numpy.zeros(Z.shape)
+        Sxy[1:,:] = numpy.cumsum(0.5 * (Sx[1:,:] + Sx[:-1,:]) * hy, axis=0)
+
+        def integral(a, c):
+            # Integral of the interpolant over [grid_x[0], a] x [grid_y[0], c]
+            i, ta = _grid_locate(grid_x, a)[:2]
+            k, tc = _grid_locate(grid_y, c)[:2]
+            w2 = 0.5 * ta**2 / hx[i]
+            w1 = ta - w2
+            v2 = 0.5 * tc**2 / hy[k, 0]
+            v1 = tc - v2
+            return Sxy[k, i] + w1 * Sy[k, i] + w2 * Sy[k, i + 1] \
+                 + v1 * (Sx[k, i] + w1 * Z[k, i] + w2 * Z[k, i + 1]) \
+                 + v2 * (Sx[k + 1, i] + w1 * Z[k + 1, i] 
+                                      + w2 * Z[k + 1, i + 1])
+
+        total = integral(x2, y2) - integral(x1, y2) - integral(x2, y1) \
+              + integral(x1, y1)
+        average = total / ((x2 - x1) * (y2 - y1)) + offset
+
+        # Grid points the cells depend on
+        i1 = numpy.searchsorted(grid_x, x1, side='right') - 1
+        i2 = numpy.searchsorted(grid_x, x2, side='left') + 1
+        k1 = numpy.searchsorted(grid_y, y1, side='right') - 1
+        k2 = numpy.searchsorted(grid_y, y2, side='left') + 1
+        bad = num_bad[k2, i2] - num_bad[k1, i2] - num_bad[k2, i1] \
+            + num_bad[k1, i1]
+        return numpy.where(bad > 0, numpy.nan, average)
 
 
     def replace_values(self, indices, value=numpy.nan, method='fill'):
         r"""Replace the values at *indices* by the specified method
 
+        *indices* is a list of index pairs *(i,j)*, a tuple of index arrays
+        as returned by *nonzero* or a boolean array of the shape of *Z*.
+
         :Methods:
-         - "fill"
-         - "nearest"
+         - "fill" - Average of the good data in the smallest square around
+           each point that contains good data, i.e. data not in *indices*.
+         - "nearest" - Value of the nearest good data point.
+
+        All points are replaced at once, see 
+        :func:`clawpack.geoclaw.datatools.fixdata.fillbadmask`.
         """
 
-        # Average surrounding good data
-        if method == 'fill':
-            for index in indices:
-                r = 0
-                point_replaced = False
-                while not point_replaced and r < max(self.Z.shape):
-                    r = r + 1
-                    i_range = range(max(0, index[0] - r), min(index[0] + r + 1, self.Z.shape[0]))
-                    j_range = range(max(0, index[1] - r), min(index[1] + r + 1, self.Z.shape[1]))
-                    num_points = 0
-                    summation = 0.0
-                    for i in i_range:
-                        for j in j_range:
-                            if (i,j) not in indices:
-                                summation += self.Z[i,j]
-                                num_points += 1
-                    if num_points > 0:
-                        self.Z[index[0], index[1]] = summation / num_points
-                        point_replaced = True
-
-        elif method == "nearest":
-            pass
+        self._replace_mask(self._index_mask(indices), method)
 
 
     def replace_no_data_values(self, method='fill'):
         r"""Replace *no_data_value* with other values as specified by *method*.
 
-        self.no_data_value
+        Points of *Z* equal to *self.no_data_value* or masked are replaced and
+        unmasked.
 
         :Input:
          - *method* can be one of:
 
-             - *fill* - Fill in all *no_data_value* locations with *value*
-             - *nearest* - Fill in *no_data_value* locations with 
-               average of nearest neighbors.
+             - *fill* - Fill in *no_data_value* locations with the average 
+               of the nearest surrounding good data.
+             - *nearest* - Fill in *no_data_value* locations with the 
+               nearest good data value.
 
         """
-        raise NotImplemented("This functionality has not been added yet.")
-        no_data_value_indices = (self.Z == self.no_data_value).nonzero()
-        self.replace_values(no_data_value_indices, method=method)
 
-        # nrows= shape(Z)[0]
-        # ncols= shape(Z)[1]
-        # npts = nrows*ncols
+        mask = numpy.ma.getdata(self.Z) == self.no_data_value
+        mask |= numpy.ma.getmaskarray(self.Z)
+        self._replace_mask(mask, method)
 
-        # xi=X[0,:]
-        # yi=Y[:,0]
 
-        # X.np.reshape(npts)
-        # Y.np.reshape(npts)
-        # Z.np.reshape(npts)
+    def _index_mask(self, indices):
+        r"""Boolean array of the shape of *Z* that is True at *indices*."""
 
-        # ind=np.where(Z!=nodata_value)
-        # X=X[ind]
-        # Y=Y[ind]
-        # Z=Z[ind]
+        if isinstance(indices, numpy.ndarray) and indices.dtype == bool:
+            return indices
+        mask = numpy.zeros(self.Z.shape, dtype=bool)
+        if isinstance(indices, tuple):
+            mask[indices] = True
+        elif len(indices) > 0:
+            indices = numpy.array(indices, dtype=int).reshape(-1, 2)
+            mask[indices[:,0], indices[:,1]] = True
+        return mask
 
-        # ptsremove=npts-len(Z)
-        # if ptsremove>0:
-        #     print("Removing %s nodata_value points" % ptsremove)
 
-        # Z = pylab.griddata(X,Y,Z,xi,yi)
-        # (X,Y)=np.meshgrid(xi,yi)
+    def _replace_mask(self, mask, method):
+        r"""Replace the values of *Z* where *mask* is True by *method*."""
 
-        # griddata2topofile(X,Y,Z,outputfile,topotypeout,nodata_value,nodata_value)
+        Z = numpy.array(numpy.ma.getdata(self.Z), dtype=float)
+        fixdata.fillbadmask(Z, mask, method=method)
+        if isinstance(self.Z, numpy.ma.MaskedArray):
+            Z = numpy.ma.masked_array(Z, mask=numpy.ma.getmaskarray(self.Z)
+                                               & ~mask)
+        self.Z = Z
 
 
     def smooth_data(self, indices, r=1):
         r"""Filter topo data at *indices* by averaging surrounding data.
 
         Surrounding data is considered within the ball of radius *r* in the 
-        inf-norm.  Acts as a low-band pass filter and removes oscillatory data.
+        inf-norm, truncated at the edges of the grid.  Acts as a low-band pass
+        filter and removes oscillatory data.  All points are averaged at once
+        from a summed-area table of the unfiltered data, so the cost does not
+        grow with *r*, see 
+        :func:`clawpack.geoclaw.datatools.fixdata.filtermask`.
 
         :Input:
-         - *indices* (list)
+         - *indices* (list) Index pairs *(i,j)*, a tuple of index arrays as
+           returned by *nonzero* or a boolean array of the shape of *Z*.
          - *r* (int) 
 
         :Output:
          None
         """
 
-        index_range = [None, None]
-        for index in indices:
-            for n in xrange(2):
-                index_range[n] = range(max(0, index[n] - r), 
-                                       min(index[n] + r + 1, self.Z.shape[n]))
-            num_points = 0
-            summation = 0.0
-            for i in index_range[0]:
-                for j in index_range[1]:
-                    summation += self.Z[i,j]
-                    num_points += 1
-            if num_points > 0:
-                self.Z[index[0], index[1]] = summation / num_points
+        Z = numpy.array(numpy.ma.getdata(self.Z), dtype=float)
+        fixdata.filtermask(Z, self._index_mask(indices), r)
+        if isinstance(self.Z, numpy.ma.MaskedArray):
+            Z = numpy.ma.masked_array(Z, mask=numpy.ma.getmaskarray(self.Z))
+        self.Z = Z
 
 
     def crop(self, filter_region):
@@ -1297,15 +2383,11 @@ class Topography(object):
             raise NotImplemented("*** Cannot currently crop unstructured topo")
 
         # Find indices of region
-        region_index = [None, None, None, None]
-        region_index[0] = (self.x >= filter_region[0]).nonzero()[0][0]
-        region_index[1] = (self.x <= filter_region[1]).nonzero()[0][-1] + 1
-        region_index[2] = (self.y >= filter_region[2]).nonzero()[0][0]
-        region_index[3] = (self.y <= filter_region[3]).nonzero()[0][-1] + 1
+        rows, cols = _region_slices(self.x, self.y, filter_region)
         newtopo = Topography()
 
-        newtopo._x = self._x[region_index[0]:region_index[1]]
-        newtopo._y = self._y[region_index[2]:region_index[3]]
+        newtopo._x = self._x[cols]
+        newtopo._y = self._y[rows]
 
         # Force regeneration of 2d coordinate arrays and extent if needed
         newtopo._X = None
@@ -1313,8 +2395,7 @@ class Topography(object):
         newtopo._extent = None
 
         # Modify Z array as well
-        newtopo._Z = self._Z[region_index[2]:region_index[3],
-                          region_index[0]:region_index[1]]
+        newtopo._Z = self.Z[rows, cols]
 
         newtopo.unstructured = self.unstructured
         newtopo.topo_type = self.topo_type
@@ -1322,7 +2403,7 @@ class Topography(object):
         # print "Cropped to %s by %s array"  % (len(newtopo.x),len(newtopo.y))
         return newtopo
 
-    def make_shoreline_xy(self, sea_level=0):
+    def make_shoreline_xy(self, sea_level=0, n_workers=1):
         r"""
         Returns an array *shoreline_xy* with 2 columns containing x and y values
         for all segements of the shoreline (defined to be the contour 
@@ -1339,20 +2420,279 @@ class Topography(object):
         Reload via:
 
             >>> shoreline_xy = numpy.load(filename)
+
+        The contours are found by :func:`contour_lines` without matplotlib.
+        If *sea_level* is a list, a list of arrays, one for each level, is 
+        returned.  *n_workers* processes search tiles of the grid in 
+        parallel.
         """
 
-        import matplotlib.pyplot as plt
+        return contour_lines(self.x, self.y, self.Z, sea_level, 
+                             n_workers=n_workers)
+
+
+class TopoCatalog(object):
+    r"""Index of the headers of many topography files for spatial queries.
+
+    The extent, resolution and no data value of each file are read once,
+    in parallel if requested, and can be cached in a JSON index file.  An
+    entry of the index is reused as long as the modification time and size
+    of its file are unchanged.  Queries for the files intersecting or
+    covering a rectangle go through a packed R-tree of the extents built by
+    sort-tile-recursive bulk loading, so only the files that are needed have
+    to be opened:
+
+        >>> catalog = TopoCatalog(topo_data.topofiles, index_path='topo.json')
+        >>> entries = catalog.query([x1, x2, y1, y2], resolution=1.0 / 3600)
+        >>> topos = catalog.read([x1, x2, y1, y2], resolution=1.0 / 3600)
+
+    Each entry is a dictionary with the keys *path*, *topo_type*, *mtime*,
+    *size*, *num_cells*, *extent*, *delta* and *no_data_value*.
+
+    """
+
+    def __init__(self, topofiles=None, index_path=None, n_workers=1):
+        r"""TopoCatalog initialization routine.
 
-        x = self.x
-        y = self.y
-        Z = self.Z
-        c = plt.contour(x,y,Z,[sea_level])  
-        # c is the level 0 contour as list of arrays, one for each segement
-        # catenate these together separated by array([nan,nan]):
-        shoreline_xy = c.allsegs[0][0]  # first segment
-        for k in range(1,len(c.allsegs[0])):
-            shoreline_xy = numpy.vstack((shoreline_xy, \
-                           numpy.array([numpy.nan,numpy.nan]), c.allsegs[0][k]))
-        return shoreline_xy
+        :Input:
+         - *topofiles* (list) Paths, Topography objects or entries of
+           *TopographyData.topofiles* to scan.
+         - *index_path* (string) JSON file caching the headers.
+         - *n_workers* (int) Number of processes reading headers, *None*
+           uses all cores.
+
+        """
+
+        super(TopoCatalog, self).__init__()
+
+        self.index_path = index_path
+        self.entries = []
+        self._tree = None
+        if topofiles is not None:
+            self.scan(topofiles, n_workers=n_workers)
+
+
+    def scan(self, topofiles, n_workers=1):
+        r"""Read the headers of *topofiles* that are not in the index yet.
+
+        Headers of new or modified files are read by a *multiprocessing.Pool*
+        of *n_workers* processes, *None* uses all cores.  The index file is
+        rewritten if anything changed.
+        """
+
+        import json
+
+        cached = {}
+        if self.index_path is not None and os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as index_file:
+                for entry in json.load(index_file)['entries']:
+                    cached[entry['path']] = entry
+
+        self.entries = []
+        missing = []
+        for topofile in topofiles:
+            topo = _as_topography(topofile)
+            path = os.path.abspath(topo.path)
+            topo_type = topo.topo_type
+            if topo_type is None:
+                topo_type = determine_topo_type(path, default=3)
+            stat = os.stat(path)
+            entry = cached.get(path)
+            if entry is None or entry['mtime'] != stat.st_mtime \
+                             or entry['size'] != stat.st_size \
+                             or entry['topo_type'] != topo_type:
+                entry = {'path': path, 'topo_type': topo_type,
+                         'mtime': stat.st_mtime, 'size': stat.st_size}
+                missing.append(entry)
+            self.entries.append(entry)
+
+        if len(missing) > 0:
+            if n_workers is None:
+                n_workers = multiprocessing.cpu_count()
+            n_workers = min(n_workers, len(missing))
+            if n_workers <= 1:
+                headers = map(_catalog_header, missing)
+            else:
+                pool = multiprocessing.Pool(n_workers)
+                try:
+                    headers = pool.map(_catalog_header, missing)
+                finally:
+                    pool.close()
+                    pool.join()
+            for entry, header in zip(missing, headers):
+                entry.update(header)
+
+            if self.index_path is not None:
+                # Keep the entries of files that were not scanned this time
+                for entry in self.entries:
+                    cached[entry['path']] = entry
+                # Write to a temporary file first so that concurrent runs
+                # never read a partially written index:
+                tmp_path = "%s.%s.tmp" % (self.index_path, os.getpid())
+                with open(tmp_path, 'w') as index_file:
+                    json.dump({'entries': cached.values()}, index_file,
+                              indent=1)
+                os.rename(tmp_path, self.index_path)
+
+        self._build_tree()
+
+
+    def _build_tree(self):
+        r"""Build the packed R-tree of the extents of the entries.
+
+        The leaves are ordered by sort-tile-recursive packing: the extents
+        are sorted by the x coordinate of their centers, cut into vertical
+        slices and each slice is sorted by the y coordinate.  Each level of
+        the tree holds the bounding boxes of consecutive groups of
+        *catalog_node_size* nodes of the level below.
+        """
+
+        boxes = numpy.array([entry['extent'] for entry in self.entries],
+                            dtype=float).reshape(-1, 4)
+        num_boxes = boxes.shape[0]
+        M = catalog_node_size
+
+        num_slices = int(numpy.ceil(numpy.sqrt(numpy.ceil(
+                                                   num_boxes / float(M)))))
+        slice_size = max(1, M * int(numpy.ceil(num_boxes
+                                                / float(M * max(num_slices, 1)))))
+        order = numpy.argsort(boxes[:,0] + boxes[:,1], kind='mergesort')
+        for k in xrange(0, num_boxes, slice_size):
+            part = order[k:k + slice_size]
+            order[k:k + slice_size] = part[numpy.argsort(
+                  boxes[part,2] + boxes[part,3], kind='mergesort')]
+
+        levels = [boxes[order]]
+        while levels[-1].shape[0] > 1:
+            starts = numpy.arange(0, levels[-1].shape[0], M)
+            parent = numpy.empty((starts.shape[0], 4))
+            parent[:,0] = numpy.minimum.reduceat(levels[-1][:,0], starts)
+            parent[:,1] = numpy.maximum.reduceat(levels[-1][:,1], starts)
+            parent[:,2] = numpy.minimum.reduceat(levels[-1][:,2], starts)
+            parent[:,3] = numpy.maximum.reduceat(levels[-1][:,3], starts)
+            levels.append(parent)
+
+        self._tree = (order, levels)
+
+
+    def _intersecting(self, region):
+        r"""Indices of the entries whose extent intersects *region*."""
+
+        order, levels = self._tree
+        M = catalog_node_size
+        nodes = numpy.arange(levels[-1].shape[0])
+        for level in xrange(len(levels) - 1, -1, -1):
+            boxes = levels[level]
+            if level < len(levels) - 1:
+                # Children of the nodes of the level above
+                nodes = (nodes.reshape(-1, 1) * M + numpy.arange(M)).ravel()
+                nodes = nodes[nodes < boxes.shape[0]]
+            box = boxes[nodes]
+            nodes = nodes[(box[:,0] <= region[1]) & (region[0] <= box[:,1]) &
+                          (box[:,2] <= region[3]) & (region[2] <= box[:,3])]
+        return numpy.sort(order[nodes])
+
+
+    def query(self, region, resolution=None, cover=False):
+        r"""Return the entries of the files that intersect *region*.
+
+        :Input:
+         - *region* (list) Rectangle [x1, x2, y1, y2].
+         - *resolution* (float or tuple) Only files whose grid spacing is at
+           most *resolution*, or *(dx, dy)*, are returned.
+         - *cover* (bool) If True only files covering all of *region* are
+           returned.
+
+        :Output:
+         - *entries* (list) Entries ordered finest first and of files with
+           the same resolution the one listed last first, the priority used
+           by GeoClaw and :func:`mosaic`.
+        """
+
+        if len(self.entries) == 0:
+            return []
+
+        if resolution is not None:
+            try:
+                dx, dy = resolution
+            except TypeError:
+                dx = dy = resolution
+
+        entries = []
+        for n in self._intersecting(region):
+            entry = self.entries[n]
+            extent = entry['extent']
+            if cover and not (extent[0] <= region[0] and
+                              region[1] <= extent[1] and
+                              extent[2] <= region[2] and
+                              region[3] <= extent[3]):
+                continue
+            if resolution is not None and (entry['delta'][0] > dx or
+                                           entry['delta'][1] > dy):
+                continue
+            entries.append(entry)
+
+        order = sorted(xrange(len(entries)),
+                       key=lambda k: (entries[k]['delta'][0]
+                                      * entries[k]['delta'][1], -k))
+        return [entries[k] for k in order]
+
+
+    def read(self, region, resolution=None, cover=False, mask=True):
+        r"""Read the part covering *region* of each file that :meth:`query`
+        returns for the same arguments.
 
+        :Output:
+         - *topos* (list) Topography objects cropped to the grid points
+           surrounding *region*, so that they cover the part of *region*
+           inside of each file even if it is smaller than one grid cell.
+        """
 
+        topos = []
+        for entry in self.query(region, resolution=resolution, cover=cover):
+            topo = Topography(path=entry['path'], topo_type=entry['topo_type'])
+            topo.read(mask=mask, filter_region=_catalog_region(entry, region))
+            topos.append(topo)
+        return topos
+
+
+def _catalog_region(entry, region):
+    r"""Expand *region* outward to the grid points of the file of the catalog
+    *entry* surrounding it."""
+
+    x0, y0 = entry['extent'][0], entry['extent'][2]
+    dx, dy = entry['delta']
+    expanded = []
+    for (value, origin, delta, side, sign) in \
+                                   [(region[0], x0, dx, numpy.floor, -1),
+                                    (region[1], x0, dx, numpy.ceil, 1),
+                                    (region[2], y0, dy, numpy.floor, -1),
+                                    (region[3], y0, dy, numpy.ceil, 1)]:
+        if delta > 0.0:
+            # Grid points within rounding of the edge count as on the edge
+            value = origin + delta * side((value - origin) / delta 
+                                          - sign * 1e-6) \
+                           + sign * 1e-6 * delta
+        expanded.append(value)
+    return expanded
+
+
+def _catalog_header(entry):
+    r"""Read the header information of the file of the catalog *entry*."""
+
+    topo = Topography(path=entry['path'], topo_type=entry['topo_type'])
+    if abs(topo.topo_type) == 1:
+        # No header, the coordinates have to be read
+        topo.read()
+        num_cells = [topo.x.shape[0], topo.y.shape[0]]
+        extent = [topo.x[0], topo.x[-1], topo.y[0], topo.y[-1]]
+        delta = [numpy.diff(topo.x).min() if num_cells[0] > 1 else 0.0,
+                 numpy.diff(topo.y).min() if num_cells[1] > 1 else 0.0]
+    else:
+        num_cells = topo.read_header()
+        extent = topo._extent
+        delta = topo._delta
+    return {'num_cells': [int(n) for n in num_cells],
+            'extent': [float(value) for value in extent],
+            'delta': [float(value) for value in delta],
+            'no_data_value': float(topo.no_data_value)}
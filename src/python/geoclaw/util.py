@@ -15,11 +15,15 @@ Module provides provides utility functions.
  - dist_latlong2meters - Convert dx, dy distance in degrees to meters
  - haversine - Calculate the haversine based great circle distance
  - inv_haversine - Inverts the haversine distance
+ - shared_array - Allocate a numpy array in memory shared between processes
+ - shared_array_view - numpy view of an array allocated by shared_array
 """
 
 import os
 import urllib2
 import tarfile
+import ctypes
+import multiprocessing.sharedctypes
 import numpy
 import clawpack.geoclaw.data
 
@@ -230,3 +234,39 @@ def inv_haversine(d,x1,y1,y2,Rsphere=Rearth,units='degrees'):
     if units=='degrees':
         dx = dx * RAD2DEG
     return dx
+
+
+# ======================
+#  Shared memory arrays
+# ======================
+def shared_array(shape, dtype='float64'):
+    r"""Allocate a zero initialized array in memory shared between processes.
+
+    The returned *raw* buffer can be passed to the worker processes of a
+    *multiprocessing.Pool* (e.g. through *initargs*), which recover the array
+    with :func:`shared_array_view` and write their results into it directly
+    rather than sending them back through pickling.
+
+    :Input:
+     - *shape* (tuple) Shape of the array.
+     - *dtype* (str or numpy.dtype) Data type of the array.
+
+    :Output:
+     - (raw, array) The shared buffer and a numpy view of it.
+    """
+
+    dtype = numpy.dtype(dtype)
+    size = int(numpy.prod(shape)) * dtype.itemsize
+    raw = multiprocessing.sharedctypes.RawArray(ctypes.c_byte, max(size, 1))
+    return raw, shared_array_view(raw, shape, dtype)
+
+
+def shared_array_view(raw, shape, dtype='float64'):
+    r"""Return a numpy view with *shape* and *dtype* of a shared buffer *raw*.
+
+    See :func:`shared_array`.
+    """
+
+    dtype = numpy.dtype(dtype)
+    count = int(numpy.prod(shape))
+    return numpy.frombuffer(raw, dtype=dtype, count=count).reshape(shape)
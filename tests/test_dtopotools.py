@@ -206,7 +206,10 @@ def test_dtopo_io():
     temp_path = tempfile.mkdtemp()
     try:
         dtopo_paths = [os.path.join(temp_path, 'alaska1964.tt1'),
-                       os.path.join(temp_path, 'alaska1964.tt3')]
+                       os.path.join(temp_path, 'alaska1964.tt3'),
+                       os.path.join(temp_path, 'alaska1964.tt1.gz'),
+                       os.path.join(temp_path, 'alaska1964.tt3.gz'),
+                       os.path.join(temp_path, 'alaska1964.tt4')]
                        # os.path.join(temp_path, 'alaska1964.tt2'),
 
         for path in dtopo_paths:
@@ -461,6 +464,364 @@ def test_subdivided_plane_fault(verbose=False, plot=False):
         plt.show()
 
 
+def test_batched_okada():
+    r"""Test batched Okada against the sum of single subfault evaluations."""
+
+    subfault_path = os.path.join(testdir, 'data', 'tohoku_ucsb.txt')
+    fault = dtopotools.UCSBFault()
+    fault.read(subfault_path)
+
+    x = numpy.linspace(140., 146., 25)
+    y = numpy.linspace(35., 41., 19)
+
+    dz = numpy.zeros((y.shape[0], x.shape[0]))
+    for subfault in fault.subfaults:
+        dz += subfault.okada(x, y).dZ[0,:,:]
+
+    # Small block_size forces several row tiles and subfault chunks
+    for block_size in [None, 100]:
+        dz_batch = dtopotools.okada_deformation(fault.subfaults, x, y,
+                                                block_size=block_size)
+        assert numpy.allclose(dz, dz_batch, rtol=1e-10, atol=1e-10), \
+            "Batched Okada differs from single subfault Okada"
+
+    dz_stack = dtopotools.okada_deformation(fault.subfaults[:7], x, y,
+                                            stack=True, block_size=100)
+    assert dz_stack.shape == (7, y.shape[0], x.shape[0])
+    for k in xrange(7):
+        assert numpy.allclose(dz_stack[k], fault.subfaults[k].okada(x, y).dZ[0])
+
+    dtopo = fault.create_dtopography(x, y, times=[1.], dtype='float32')
+    assert dtopo.dZ.dtype == numpy.float32
+    assert numpy.allclose(dtopo.dZ[0], dz, rtol=0., atol=1e-3 * abs(dz).max())
+
+
+def test_parallel_okada():
+    r"""Test Okada evaluated by several processes against a single process."""
+
+    subfault_path = os.path.join(testdir, 'data', 'tohoku_ucsb.txt')
+    fault = dtopotools.UCSBFault()
+    fault.read(subfault_path)
+
+    x = numpy.linspace(140., 146., 25)
+    y = numpy.linspace(35., 41., 19)
+
+    dtopo = fault.create_dtopography(x, y, times=[1.])
+    dtopo_parallel = fault.create_dtopography(x, y, times=[1.], n_workers=3,
+                                              block_size=100)
+    assert numpy.allclose(dtopo.dZ, dtopo_parallel.dZ, rtol=1e-12, 
+                          atol=1e-12), "Parallel Okada differs from serial"
+
+    dz_stack = dtopotools.okada_deformation(fault.subfaults[:5], x, y,
+                                            stack=True, dtype='float32')
+    dz_stack_parallel = dtopotools.okada_deformation(fault.subfaults[:5], x,
+                                    y, stack=True, dtype='float32', n_workers=2)
+    assert dz_stack_parallel.dtype == numpy.float32
+    assert numpy.allclose(dz_stack, dz_stack_parallel)
+
+
+def test_sift_cache():
+    r"""Test SIFT dtopo from cached unit source deformations."""
+
+    x = numpy.linspace(162., 168., 25)
+    y = numpy.linspace(53., 59., 25)
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        cache_dir = os.path.join(temp_path, 'sift_cache')
+        for sift_slip in [{'acsza1':2, 'acszb1':3}, {'acsza1':1.5}]:
+            dtopo = dtopotools.SiftFault(sift_slip).create_dtopography(x, y)
+            fault = dtopotools.SiftFault(sift_slip, cache_dir=cache_dir)
+            cached_dtopo = fault.create_dtopography(x, y)
+            assert numpy.allclose(dtopo.dZ, cached_dtopo.dZ), \
+                "Cached SIFT deformation differs for %s" % sift_slip
+
+        # Only one field per unit source and grid should be stored
+        assert len(os.listdir(cache_dir)) == 2, \
+            "Unexpected cache files %s" % os.listdir(cache_dir)
+
+        fault.create_dtopography(x[:-1], y)
+        assert len(os.listdir(cache_dir)) == 3, "Grid not part of cache key"
+    finally:
+        shutil.rmtree(temp_path)
+
+
+def test_kinematic_dtopo():
+    r"""Test kinematic dtopo against time stepping each subfault."""
+
+    subfault_path = os.path.join(testdir, 'data', 'tohoku_ucsb.txt')
+    fault = dtopotools.UCSBFault()
+    fault.read(subfault_path)
+    fault.rupture_type = 'kinematic'
+
+    x = numpy.linspace(140., 146., 13)
+    y = numpy.linspace(35., 41., 13)
+    times = numpy.linspace(0., 150., 7)
+
+    # Accumulate the increase of each subfault's rise fraction in time
+    dZ = numpy.zeros((len(times), len(y), len(x)))
+    dzt = numpy.zeros((len(y), len(x)))
+    t_prev = -1.e99
+    for n,t in enumerate(times):
+        for subfault in fault.subfaults:
+            rf = dtopotools.rise_fraction([t_prev, t], subfault.rupture_time,
+                                          subfault.rise_time,
+                                          subfault.rise_time_ending)
+            if rf[1] > rf[0]:
+                dzt += (rf[1] - rf[0]) * subfault.okada(x, y).dZ[0,:,:]
+        dZ[n,:,:] = dzt
+        t_prev = t
+
+    dtopo = fault.create_dtopography(x, y, times)
+    assert dtopo.dZ.shape == dZ.shape
+    assert numpy.allclose(dtopo.dZ, dZ), "Kinematic dZ is wrong"
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        path = os.path.join(temp_path, 'kinematic.tt3')
+        streamed_dtopo = fault.create_dtopography(x, y, times, path=path)
+        assert streamed_dtopo.dZ is None
+        dtopo.write(os.path.join(temp_path, 'kinematic_all.tt3'))
+        with open(path) as streamed_file:
+            with open(os.path.join(temp_path, 'kinematic_all.tt3')) \
+                                                                as all_file:
+                assert streamed_file.read() == all_file.read(), \
+                    "Streamed dtopo file differs"
+    finally:
+        shutil.rmtree(temp_path)
+
+
+def test_dtopo_time_slices():
+    r"""Test reading selected time slices of each dtopo_type."""
+
+    x = numpy.linspace(-1., 2., 7)
+    y = numpy.linspace(0., 1., 3)
+    dtopo = dtopotools.DTopography()
+    dtopo.X, dtopo.Y = numpy.meshgrid(x, y)
+    dtopo.times = numpy.linspace(0., 10., 6)
+    dtopo.dZ = numpy.random.RandomState(3).randn(6, 3, 7)
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        for extension in ['tt1', 'tt3', 'tt3.gz', 'tt4']:
+            path = os.path.join(temp_path, 'slices.%s' % extension)
+            dtopo.write(path)
+            for time_slices in [None, -1, [4, 1], slice(1, None, 2)]:
+                expected = numpy.arange(6)
+                if time_slices is not None:
+                    expected = numpy.unique(numpy.atleast_1d(
+                                                    expected[time_slices]))
+                read_dtopo = dtopotools.DTopography()
+                read_dtopo.read(path, time_slices=time_slices)
+                assert numpy.allclose(read_dtopo.x, x)
+                assert numpy.allclose(read_dtopo.y, y)
+                assert numpy.allclose(read_dtopo.times, 
+                                      dtopo.times[expected]), \
+                    "Times of %s for %s are wrong" % (time_slices, path)
+                assert numpy.allclose(read_dtopo.dZ, dtopo.dZ[expected]), \
+                    "dZ of %s for %s is wrong" % (time_slices, path)
+                if extension == 'tt4' and not isinstance(time_slices, list):
+                    assert isinstance(read_dtopo.dZ, numpy.memmap)
+    finally:
+        shutil.rmtree(temp_path)
+
+
+def test_dZ_at_times():
+    r"""Test interpolation of dZ in time and at points."""
+
+    x = numpy.linspace(0., 4., 5)
+    y = numpy.linspace(0., 2., 3)
+    dtopo = dtopotools.DTopography()
+    dtopo.X, dtopo.Y = numpy.meshgrid(x, y)
+    dtopo.x, dtopo.y = x, y
+    dtopo.times = numpy.array([0., 10., 10., 30.])
+    # dZ is linear in x, y and t on each interval of time
+    dtopo.dZ = numpy.array([(1. + dtopo.X - 2. * dtopo.Y) * s 
+                            for s in [0., 1., 2., 4.]])
+
+    times = numpy.array([-5., 0., 5., 10., 20., 30., 40.])
+    scales = numpy.array([0., 0., 0.5, 2., 3., 4., 4.])
+    dZ = dtopo.dZ_at_times(times)
+    assert dZ.shape == (7, 3, 5)
+    assert numpy.allclose(dZ, scales.reshape(-1, 1, 1) * dtopo.dZ[1])
+    for (n, dz) in enumerate(dtopo.dZ_at_times(times, lazy=True)):
+        assert numpy.allclose(dz, dZ[n])
+    assert numpy.allclose(dtopo.dZ_at_t(5.), dZ[2])
+
+    # Bilinear in space is exact for this deformation
+    px = numpy.array([0.5, 3.25, 4., -0.1])
+    py = numpy.array([1.5, 0.2, 2., 1.])
+    dz = dtopo.dZ_at_points(px.reshape(-1, 1), py.reshape(-1, 1), times)
+    assert dz.shape == (4, 7)
+    expected = (1. + px - 2. * py).reshape(-1, 1) * scales
+    assert numpy.all(numpy.isnan(dz[3]))
+    assert numpy.allclose(dz[:3], expected[:3])
+    assert numpy.allclose(dtopo.dZ_at_points(px[:3], py[:3]), 
+                          4. * (1. + px[:3] - 2. * py[:3]))
+
+
+def test_subfault_table():
+    r"""Test the columnar subfault table and subfaults viewing its rows."""
+
+    import copy
+    import old_dtopotools
+
+    subfault_path = os.path.join(testdir, 'data', 'alaska1964.csv')
+    input_units = {"length":"km", "width":"km", "depth":"km", "slip":"m", 
+         "mu":"dyne/cm^2"}
+
+    # Geometry of all subfaults at once agrees with the old version
+    for specification in ['top center', 'centroid', 'bottom center', 
+                          'noaa sift']:
+        fault = dtopotools.CSVFault()
+        fault.read(subfault_path, input_units=input_units, 
+                                  coordinate_specification=specification)
+        table = fault.subfault_table
+        assert len(table) == len(fault.subfaults)
+        assert numpy.allclose(table.depth[:2], 
+                              [fault.subfaults[0].depth,
+                               fault.subfaults[1].depth])
+        for (k, subfault) in enumerate(fault.subfaults):
+            geometry = old_dtopotools.set_geometry(subfault)
+            assert numpy.allclose(table.centers[k,2], 
+                                  [geometry['x_bottom'], geometry['y_bottom'],
+                                   geometry['depth_bottom']])
+            assert numpy.allclose(table.corners[k,[2, 3, 0, 1],:2], 
+                                  numpy.column_stack((geometry['x_corners'][:4],
+                                                 geometry['y_corners'][:4])))
+    Mo = numpy.sum([subfault.mu * subfault.length * subfault.width 
+                    * subfault.slip for subfault in fault.subfaults])
+    assert numpy.allclose(fault.Mo(), Mo)
+
+    # Subfaults are views of the rows of the table
+    subfault = fault.subfaults[3]
+    subfault.slip = 2.5
+    assert table.slip[3] == 2.5
+    table.slip = 2. * table.slip
+    assert subfault.slip == 5.
+    corners = subfault.corners
+    subfault.strike += 10.
+    assert not numpy.allclose(subfault.corners, corners), \
+        "Geometry was not recalculated"
+    assert getattr(subfault, 'rise_time', None) is None
+    subfault.rise_time = 3.
+    assert numpy.isnan(table.rise_time[0]) and table.rise_time[3] == 3.
+
+    # Copies have their own parameters
+    copied = copy.copy(subfault)
+    copied.slip = 1.
+    assert subfault.slip == 5. and copied.slip == 1.
+    assert copy.deepcopy(fault.subfaults[:2])[1].slip == table.slip[1]
+
+    # Changing the list rebuilds the table
+    new_subfault = dtopotools.SubFault()
+    for param in ['longitude', 'latitude', 'depth', 'strike', 'dip', 'rake',
+                  'length', 'width', 'slip', 'coordinate_specification']:
+        setattr(new_subfault, param, getattr(fault.subfaults[0], param))
+    fault.subfaults.append(new_subfault)
+    assert len(fault.subfault_table) == len(fault.subfaults)
+    assert fault.subfault_table is not table
+    assert numpy.allclose(fault.Mo(), numpy.sum([subfault.Mo() 
+                                      for subfault in fault.subfaults]))
+    assert numpy.allclose(fault.subfault_table.corners[-1], 
+                          fault.subfault_table.corners[0])
+    assert fault.subfault_table.rise_time[3] == 3.
+    new_subfault.slip = 7.
+    assert fault.subfault_table.slip[-1] == 7.
+
+
+def test_slip_ensemble():
+    r"""Test random slip realizations and their deformation basis."""
+
+    fault_plane = dtopotools.SiftFault({'acsza1':1.}).subfaults[0]
+    fault = dtopotools.SubdividedPlaneFault(fault_plane, nstrike=6, ndip=3)
+    x = numpy.linspace(162., 168., 25)
+    y = numpy.linspace(53., 59., 21)
+
+    ensemble = dtopotools.SlipEnsemble(fault, x, y, mean_slip=2., cv=0.5)
+    slips = ensemble.slips(20000, seed=1)
+    assert slips.shape == (20000, 18)
+    assert numpy.all(slips > 0)
+    assert numpy.allclose(slips.mean(axis=0), 2., rtol=0.05)
+    assert numpy.allclose(slips.std(axis=0), 1., rtol=0.1)
+    # Neighbours along strike are more correlated than distant subfaults
+    correlation = numpy.corrcoef(numpy.log(slips.T))
+    assert correlation[0,1] > correlation[0,5] > 0
+
+    # Deformation from the basis agrees with the Okada deformation
+    dtopo = ensemble.create_dtopography(slips[3])
+    for (k, subfault) in enumerate(fault.subfaults):
+        subfault.slip = slips[3,k]
+    assert numpy.allclose(dtopo.dZ[-1], fault.create_dtopography(x, y).dZ[-1])
+    assert numpy.allclose(ensemble.deformation(slips[:4])[3], dtopo.dZ[-1])
+
+    # Realizations scaled to a magnitude
+    ensemble = dtopotools.SlipEnsemble(fault, x, y, Mw=8.5, 
+                                       correlation='gaussian', num_modes=5)
+    assert ensemble.modes.shape == (18, 5)
+    for slip in ensemble.slips(3, seed=2):
+        fault.subfault_table.slip = slip
+        assert abs(fault.Mw() - 8.5) < 1e-10
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        ensemble.basis_path = os.path.join(temp_path, 'basis.npy')
+        path = os.path.join(temp_path, 'ensemble.npy')
+        slips = ensemble.write(path, 7, seed=3, batch_size=2, n_workers=2)
+        assert isinstance(ensemble.basis, numpy.memmap)
+        assert numpy.allclose(slips, ensemble.slips(7, seed=3))
+        assert numpy.allclose(numpy.load(path), ensemble.deformation(slips))
+    finally:
+        shutil.rmtree(temp_path)
+
+
+def test_adaptive_okada():
+    r"""Test adaptive Okada evaluation against the full grid."""
+
+    fault_plane = dtopotools.SiftFault({'acsza1':1.}).subfaults[0]
+    fault = dtopotools.SubdividedPlaneFault(fault_plane, nstrike=4, ndip=2)
+    x = numpy.linspace(158., 172., 141)
+    y = numpy.linspace(50., 62., 121)
+    dz = dtopotools.okada_deformation(fault.subfaults, x, y)
+
+    # Count the points at which the deformation is evaluated
+    num_points = [0]
+    okada_points = dtopotools._okada_points
+    def counting_okada_points(params, x, y, stack, block_size):
+        num_points[0] += x.shape[0]
+        return okada_points(params, x, y, stack, block_size)
+    dtopotools._okada_points = counting_okada_points
+    try:
+        tolerance = 1e-3 * abs(dz).max()
+        dz_adaptive, error = dtopotools.okada_deformation_adaptive(
+                    fault.subfaults, x, y, tolerance=tolerance, coarsening=8)
+    finally:
+        dtopotools._okada_points = okada_points
+
+    assert num_points[0] < dz.size / 4
+    assert abs(dz_adaptive - dz).max() < 2 * tolerance
+    assert error.max() <= tolerance
+    computed = error == 0
+    assert numpy.allclose(dz_adaptive[computed], dz[computed])
+    assert computed[::8,::8].all()
+
+    # Stacked deformations and kinematic ruptures
+    dz_stack, error = dtopotools.okada_deformation_adaptive(
+                                   fault.subfaults, x, y, stack=True)
+    assert dz_stack.shape == (8,) + dz.shape
+    assert abs(dz_stack.sum(axis=0) - dz).max() < 2 * error.max()
+    for (k, subfault) in enumerate(fault.subfaults):
+        subfault.rupture_time = 10. * k
+        subfault.rise_time = 5.
+    fault.rupture_type = 'kinematic'
+    times = [0., 20., 100.]
+    dtopo = fault.create_dtopography(x, y, times)
+    dtopo_adaptive = fault.create_dtopography(x, y, times, adaptive=True)
+    assert dtopo_adaptive.dZ_error.shape == dz.shape
+    assert abs(dtopo_adaptive.dZ - dtopo.dZ).max() \
+                < 2 * dtopo_adaptive.dZ_error.max()
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1:
         if "plot" in sys.argv[1].lower():
@@ -476,5 +837,14 @@ if __name__ == "__main__":
             test_dtopo_io()
             test_geometry()
             test_vs_old_dtopo()
+            test_batched_okada()
+            test_parallel_okada()
+            test_sift_cache()
+            test_kinematic_dtopo()
+            test_dtopo_time_slices()
+            test_dZ_at_times()
+            test_subfault_table()
+            test_slip_ensemble()
+            test_adaptive_okada()
         except nose.SkipTest as e:
             print e.message
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+import numpy
+import nose
+
+import clawpack.geoclaw.fgmax_tools as fgmax_tools
+
+# Set local test directory to get local files
+testdir = os.path.dirname(__file__)
+if len(testdir) == 0:
+     testdir = "./"
+
+
+def write_fgmax_output(outdir, nx=4, ny=3, mxnest=3, binary=False, h=None):
+    r"""Write fgmax output for a 2d grid as GeoClaw's fgmax_finalize does.
+
+    If *binary* also write the binary files holding the same values.  The
+    depth is random unless given by *h*.
+    Returns the values and aux arrays written, one point per row.
+    """
+
+    npts = nx * ny
+    x = numpy.linspace(-1., 1., nx)
+    y = numpy.linspace(2., 3., ny)
+    X, Y = [A.ravel(order='F') for A in numpy.meshgrid(x, y, indexing='ij')]
+
+    values = numpy.empty((npts, 14))
+    values[:,0] = X
+    values[:,1] = Y
+    values[:,2] = numpy.arange(npts) % mxnest + 1
+    values[:,3:] = numpy.random.rand(npts, 11)
+    if h is not None:
+        values[:,3] = h
+    values[1,2] = 0
+    values[1,3] = -0.99999e99        # point never set
+    values[2,13] = -0.99999e99       # arrival time never set
+
+    aux = numpy.column_stack([X, Y, numpy.random.rand(npts, mxnest) - 0.5])
+
+    with open(os.path.join(outdir, 'fort.FG1.valuemax'), 'w') as data_file:
+        for k in xrange(npts):
+            data_file.write(2 * "%17.8E" % tuple(values[k,:2])
+                            + "%4i" % values[k,2]
+                            + 11 * "%17.8E" % tuple(values[k,3:]) + "\n")
+    with open(os.path.join(outdir, 'fort.FG1.aux1'), 'w') as data_file:
+        for k in xrange(npts):
+            data_file.write((2 + mxnest) * "%17.8E" % tuple(aux[k,:]) + "\n")
+
+    if binary:
+        for name, data in [('valuemax', values), ('aux1', aux)]:
+            data = numpy.array(["%17.8E" % v for v in data.T.ravel()], 
+                               dtype=float)
+            data.tofile(os.path.join(outdir, 'fort.FG1.%s.bin' % name))
+
+    return values, aux
+
+
+def test_read_output():
+    r"""Test reading fgmax output with and without the binary cache."""
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        values, aux = write_fgmax_output(temp_path)
+        values = numpy.array(["%17.8E" % v for v in values.ravel()], 
+                             dtype=float).reshape(values.shape)
+        aux = numpy.array(["%17.8E" % v for v in aux.ravel()], 
+                          dtype=float).reshape(aux.shape)
+        fg_shape = (4, 3)
+        def grid(v):
+            return v.reshape(fg_shape, order='F')
+        mask = grid(values[:,3] < -1e50)
+
+        fg = fgmax_tools.FGmaxGrid()
+        fg.point_style = 2
+        fg.nx, fg.ny = fg_shape
+        for cache in [False, True, True]:
+            fg.read_output(outdir=temp_path, cache=cache)
+            assert numpy.all(fg.X == grid(values[:,0]))
+            assert numpy.all(fg.level == grid(values[:,2]))
+            assert numpy.all(fg.h.mask == mask)
+            assert numpy.all(fg.h.data == grid(values[:,3]))
+            assert numpy.all(fg.hmin_time == grid(values[:,12]))
+            assert fg.arrival_time.mask[2,0] and fg.arrival_time.mask[1,0]
+            assert fg.arrival_time.mask.sum() == 2
+
+            level = values[:,2].astype(int)
+            B = aux[numpy.arange(aux.shape[0]), numpy.maximum(level, 1) + 1]
+            assert numpy.all(fg.B.mask == mask)
+            assert numpy.all(fg.B.data == grid(B))
+
+        cache_path = os.path.join(temp_path, 'fort.FG1.valuemax.npy')
+        assert os.path.isfile(cache_path), "Cache file not written"
+
+        # Only selected quantities, from the cache
+        fg.read_output(outdir=temp_path, quantities=['h', 'arrival_time'])
+        assert fg.B is None and fg.s is None
+        assert numpy.all(fg.h.data == grid(values[:,3]))
+
+        # Changed output is parsed again
+        values, aux = write_fgmax_output(temp_path)
+        os.utime(os.path.join(temp_path, 'fort.FG1.valuemax'), 
+                 (time.time() + 10., time.time() + 10.))
+        fg.read_output(outdir=temp_path, quantities=['h'])
+        assert numpy.allclose(fg.h.data, grid(values[:,3]))
+
+        # A truncated file raises and leaves no temporary cache file
+        path = os.path.join(temp_path, 'fort.FG1.valuemax')
+        with open(path) as data_file:
+            lines = data_file.readlines()
+        with open(path, 'w') as data_file:
+            data_file.writelines(lines[:5])
+        os.utime(path, (time.time() + 20., time.time() + 20.))
+        try:
+            fg.read_output(outdir=temp_path, quantities=['h'])
+        except Exception:
+            pass
+        else:
+            raise AssertionError("Truncated fgmax output did not raise")
+        assert not [name for name in os.listdir(temp_path) 
+                    if name.endswith('.tmp')], "Temporary cache file left"
+
+    finally:
+        shutil.rmtree(temp_path)
+
+
+def test_read_binary_output():
+    r"""Test binary fgmax output gives the same arrays as text output."""
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        write_fgmax_output(temp_path, nx=5, ny=2, binary=True)
+        fgs = {}
+        for output_format in ['ascii', 'binary', None]:
+            fg = fgmax_tools.FGmaxGrid()
+            fg.point_style = 2
+            fg.nx, fg.ny = 5, 2
+            fg.read_output(outdir=temp_path, output_format=output_format, 
+                           cache=False)
+            fgs[output_format] = fg
+
+        assert not os.path.exists(os.path.join(temp_path, 
+                                               'fort.FG1.valuemax.npy'))
+        for name in fgmax_tools.fgmax_quantities + ['X', 'Y', 'level']:
+            for output_format in ['binary', None]:
+                q = getattr(fgs[output_format], name)
+                q_ascii = getattr(fgs['ascii'], name)
+                assert numpy.all(numpy.ma.getdata(q) 
+                                    == numpy.ma.getdata(q_ascii)), \
+                    "%s differs for %s output" % (name, output_format)
+                assert numpy.all(numpy.ma.getmaskarray(q) 
+                                    == numpy.ma.getmaskarray(q_ascii)), \
+                    "Mask of %s differs for %s output" % (name, output_format)
+    finally:
+        shutil.rmtree(temp_path)
+
+
+def test_ensemble():
+    r"""Test ensemble statistics of fgmax results of several runs."""
+
+    temp_path = tempfile.mkdtemp()
+    try:
+        num_runs = 10
+        outdirs = [os.path.join(temp_path, '_output%s' % k) 
+                   for k in xrange(num_runs)]
+        for k,outdir in enumerate(outdirs):
+            os.mkdir(outdir)
+            write_fgmax_output(outdir, h=k + 0.5)
+
+        fg = fgmax_tools.FGmaxGrid()
+        fg.point_style = 2
+        fg.nx, fg.ny = 4, 3
+        arrival_times = []
+        for outdir in outdirs:
+            fg.read_output(outdir=outdir, quantities=['arrival_time'])
+            arrival_times.append(fg.arrival_time.filled(numpy.inf))
+        arrival_times = numpy.array(arrival_times)
+
+        levels = {'h': numpy.arange(11.), 'arrival_time': [0.25, 0.5, 0.75]}
+        for n_workers in [1, 3]:
+            ensemble = fgmax_tools.FGmaxEnsemble()
+            ensemble.point_style = 2
+            ensemble.nx, ensemble.ny = 4, 3
+            ensemble.read_ensemble(outdirs, levels, percentiles=[50., 90.],
+                                   n_workers=n_workers)
+
+            assert ensemble.num_runs == num_runs
+            assert ensemble.h.mask[1,0] and ensemble.h.mask.sum() == 1
+            assert numpy.all(ensemble.h[~ensemble.h.mask] == 9.5)
+            exceedance = ensemble.exceedance['h']
+            assert exceedance.shape == (11, 4, 3)
+            assert numpy.allclose(exceedance[:,0,0], 
+                                  1. - numpy.arange(11.) / 10.)
+            assert numpy.allclose(ensemble.percentile_values['h'][:,0,0], 
+                                  [5., 9.])
+
+            for n,t in enumerate(levels['arrival_time']):
+                assert numpy.allclose(ensemble.exceedance['arrival_time'][n],
+                                      (arrival_times <= t).mean(axis=0))
+            assert numpy.all(ensemble.arrival_time.filled(numpy.inf) 
+                                == arrival_times.min(axis=0))
+
+        # Arrival time percentiles increase and stay within the levels,
+        # masked where fewer runs arrive by the last level
+        percentiles = [10., 50., 90.]
+        ensemble.read_ensemble(outdirs, levels, percentiles=percentiles)
+        L = levels['arrival_time']
+        values = ensemble.percentile_values['arrival_time']
+        arrived = (arrival_times <= L[-1]).mean(axis=0)
+        for n,p in enumerate(percentiles):
+            assert numpy.all(values.mask[n] == (arrived < 0.01 * p))
+        assert numpy.all(values.mask[:-1] <= values.mask[1:])
+        assert numpy.all(values.filled(L[-1]) >= L[0])
+        assert numpy.all(values.filled(L[-1]) <= L[-1])
+        later = values.filled(numpy.inf)
+        assert numpy.all(later[1:] >= later[:-1])
+        assert not numpy.all(values.mask)
+
+        # Weighted: only the last run counts
+        weights = numpy.zeros(num_runs)
+        weights[-1] = 2.
+        ensemble.read_ensemble(outdirs, levels, weights=weights)
+        assert numpy.allclose(ensemble.exceedance['h'][:,0,0],
+                              numpy.arange(11.) < 9.5)
+    finally:
+        shutil.rmtree(temp_path)
+
+
+if __name__ == "__main__":
+    test_read_output()
+    test_read_binary_output()
+    test_ensemble()
@@ -2,6 +2,8 @@
 
 import os
 import sys
+import json
+import itertools
 import tempfile
 import shutil
 
@@ -10,6 +12,7 @@ import numpy
 import nose
 
 import clawpack.geoclaw.topotools as topotools
+import clawpack.geoclaw.datatools.fixdata as fixdata
 import clawpack.geoclaw.util as util
 
 # Set local test directory to get local files
@@ -186,6 +189,116 @@ def test_read_write_topo_bowl_hill():
         shutil.rmtree(temp_path)
 
 
+def test_read_write_compressed_topo():
+    """
+    Test writing and reading gzip compressed topo files with set precision.
+    """
+    temp_path = tempfile.mkdtemp()
+
+    try:
+        topo = topotools.Topography(topo_func=topo_bowl_hill)
+        topo.x = numpy.linspace(-1.5, 2.5, 101)
+        topo.y = numpy.linspace(-1.0, 2.0, 76)
+
+        for topo_type in xrange(1,4):
+            file_path = os.path.join(temp_path, 'bowl_hill.tt%s.gz' % topo_type)
+            topo.write(file_path, precision=8)
+            topo_in = topotools.Topography(path=file_path)
+            assert topo_in.Z.shape == topo.Z.shape, \
+                   "Compressed topo_type=%s has shape %s." % (topo_type,
+                                                               topo_in.Z.shape)
+            assert numpy.allclose(topo.Z, topo_in.Z, rtol=1e-8), \
+                   "Compressed topo_type=%s does not equal read in file." \
+                   % topo_type
+
+    except AssertionError as e:
+        # If the assertion failed then copy the contents of the directory
+        shutil.copytree(temp_path, os.path.join(os.getcwd(), 
+                                           "test_read_write_compressed_topo"))
+        raise e
+    finally:
+        shutil.rmtree(temp_path)
+
+
+def test_read_filter_region():
+    """
+    Test reading only a region of topo files.
+    """
+    temp_path = tempfile.mkdtemp()
+
+    try:
+        topo = topotools.Topography(topo_func=topo_bowl_hill)
+        topo.x = numpy.linspace(-1.5, 2.5, 101)
+        topo.y = numpy.linspace(-1.0, 2.0, 76)
+        filter_region = [0.5, 1.5, 0., 2.]
+        cropped_topo = topo.crop(filter_region)
+
+        for topo_type in xrange(1,5):
+            file_path = os.path.join(temp_path, 'bowl_hill.tt%s' % topo_type)
+            topo.write(file_path, topo_type=topo_type)
+            topo_in = topotools.Topography(path=file_path, topo_type=topo_type)
+            topo_in.read(filter_region=filter_region)
+            assert numpy.allclose(cropped_topo.x, topo_in.x) and \
+                   numpy.allclose(cropped_topo.y, topo_in.y), \
+                   "Filtered coordinates of topo_type=%s do not match." \
+                   % topo_type
+            assert numpy.allclose(cropped_topo.Z, topo_in.Z), \
+                   "Filtered topo_type=%s does not equal cropped topography." \
+                   % topo_type
+
+    except AssertionError as e:
+        # If the assertion failed then copy the contents of the directory
+        shutil.copytree(temp_path, os.path.join(os.getcwd(), 
+                                              "test_read_filter_region"))
+        raise e
+    finally:
+        shutil.rmtree(temp_path)
+
+
+def test_read_write_binary_topo():
+    """
+    Test writing and reading binary, memory mapped topo files.
+    """
+    temp_path = tempfile.mkdtemp()
+
+    try:
+        topo = topotools.Topography(topo_func=topo_bowl_hill)
+        topo.x = numpy.linspace(-1.5, 2.5, 101)
+        topo.y = numpy.linspace(-1.0, 2.0, 76)
+
+        for (dtype, rtol) in [('float64', 1e-14), ('float32', 1e-6)]:
+            file_path = os.path.join(temp_path, 'bowl_hill_%s.tt4' % dtype)
+            topo.write(file_path, dtype=dtype)
+            topo_in = topotools.Topography(path=file_path)
+            assert isinstance(topo_in.Z, numpy.memmap), \
+                   "Binary topography was not memory mapped."
+            assert topo_in.Z.dtype == numpy.dtype(dtype), \
+                   "Binary topography has dtype %s." % topo_in.Z.dtype
+            assert numpy.allclose(topo.x, topo_in.x) and \
+                   numpy.allclose(topo.y, topo_in.y), \
+                   "Binary topography coordinates do not match."
+            topo_in = topotools.Topography(path=file_path, topo_type=4)
+            assert numpy.allclose(topo.X, topo_in.X) and \
+                   numpy.allclose(topo.Y, topo_in.Y), \
+                   "Binary topography 2d coordinates do not match."
+            assert numpy.allclose(topo.Z, topo_in.Z, rtol=rtol), \
+                   "Written binary file of dtype %s does not equal read in" \
+                   " file." % dtype
+
+            cropped_topo = topo_in.crop([0.5, 1.5, 0., 2.])
+            assert numpy.allclose(cropped_topo.Z, 
+                                  topo.crop([0.5, 1.5, 0., 2.]).Z, rtol=rtol), \
+                   "Cropped binary topography does not match."
+
+    except AssertionError as e:
+        # If the assertion failed then copy the contents of the directory
+        shutil.copytree(temp_path, os.path.join(os.getcwd(), 
+                                              "test_read_write_binary_topo"))
+        raise e
+    finally:
+        shutil.rmtree(temp_path)
+
+
 def test_get_remote_file():
     """Test the ability to fetch a remote file from the web."""
     
@@ -269,6 +382,559 @@ def test_unstructured_topo(save=False, plot=False):
         plt.show()
 
 
+def test_unstructured_proximity():
+    r"""Test masking of fill data close to unstructured points."""
+
+    try:
+        import scipy
+    except:
+        raise nose.SkipTest("Skipping test since scipy not found")
+
+    fill_topo = topotools.Topography()
+    fill_topo.x = numpy.linspace(0, 1, 101)
+    fill_topo.y = numpy.linspace(0, 1, 101)
+    fill_topo.Z = numpy.zeros(fill_topo.X.shape)
+
+    topo = topotools.Topography(unstructured=True)
+    topo.x = numpy.array([0.5, 0.25])
+    topo.y = numpy.array([0.5, 0.75])
+    topo.z = numpy.ones(2)
+
+    radius = 5000.0
+    radius_deg = util.dist_meters2latlong(radius, 0.0, 0.625)[0]
+    topo.interp_unstructured(fill_topo, extent=[0, 1, 0, 1], 
+                             delta=(1e-2,1e-2), proximity_radius=radius)
+
+    distance = numpy.min([numpy.sqrt((topo.X - x)**2 + (topo.Y - y)**2)
+                          for (x, y) in zip([0.5, 0.25], [0.5, 0.75])], 
+                         axis=0)
+    assert numpy.all(topo.Z[distance < 0.5 * radius_deg] == 1.), \
+        "Fill data within proximity radius was not masked"
+    assert numpy.all(topo.Z[distance > radius_deg + 0.015] == 0.), \
+        "Fill data outside of proximity radius was masked"
+
+
+def test_unstructured_masked_fill():
+    r"""Test that masked fill data is not used by interp_unstructured."""
+
+    try:
+        import scipy
+    except:
+        raise nose.SkipTest("Skipping test since scipy not found")
+
+    fill_topo = topotools.Topography()
+    fill_topo.x = numpy.linspace(0, 1, 101)
+    fill_topo.y = numpy.linspace(0, 1, 101)
+    Z = numpy.zeros(fill_topo.X.shape)
+    Z[40:61,40:61] = 100.0
+    fill_topo.Z = numpy.ma.masked_greater(Z, 50.0)
+
+    topo = topotools.Topography(unstructured=True)
+    topo.x = numpy.array([0.5, 0.25])
+    topo.y = numpy.array([0.5, 0.75])
+    topo.z = numpy.ones(2)
+
+    topo.interp_unstructured(fill_topo, extent=[0, 1, 0, 1], 
+                             delta=(1e-2,1e-2))
+    assert numpy.all((topo.Z == 0.) | (topo.Z == 1.)), \
+        "Masked fill data was used"
+    assert topo.Z[50,50] == 1.
+
+
+def test_lazy_coordinates():
+    r"""Test that 2d coordinates are views of the 1d coordinates."""
+
+    topo = topotools.Topography(topo_func=topo_bowl)
+    topo.x = numpy.linspace(-1.0, 1.0, 21)
+    topo.y = numpy.linspace(-1.0, 1.0, 16)
+    X, Y = numpy.meshgrid(topo.x, topo.y)
+
+    assert numpy.all(topo.X == X) and numpy.all(topo.Y == Y)
+    assert topo.X.strides[0] == 0 and topo.Y.strides[1] == 0, \
+        "2d coordinates should not be stored"
+    assert not topo.X.flags.writeable and not topo.Y.flags.writeable
+    assert numpy.all(topo.Z == topo_bowl(X, Y))
+
+    # Changing the 1d coordinates regenerates the 2d ones
+    topo.x = numpy.linspace(0.0, 1.0, 11)
+    assert topo.X.shape == (16, 11) and numpy.all(topo.X[-1] == topo.x)
+
+
+def test_sample():
+    r"""Test sampling of topography at points and over cells."""
+
+    # Bilinear functions are reproduced exactly by all methods
+    topo = topotools.Topography(topo_func=lambda x, y: 2.0 + 3.0 * x 
+                                                       - y + 0.5 * x * y)
+    topo.x = numpy.linspace(-1.0, 1.0, 21)
+    topo.y = numpy.linspace(-1.0, 2.0, 13)**3 / 4.0
+    numpy.random.seed(13)
+    x = numpy.random.uniform(-0.8, 0.8, (50, 2))
+    y = numpy.random.uniform(-0.1, 1.5, (50, 2))
+    exact = topo.topo_func(x, y)
+
+    assert numpy.allclose(topo.sample(x, y), exact), "Bilinear values wrong"
+    assert numpy.allclose(topo.sample(x, y, method='cell_average', 
+                                      cell_size=(0.3, 0.05)), exact), \
+        "Cell averages wrong"
+
+    values = topo.sample(topo.x[[3, 7]] + 0.01, topo.y[[5, 2]] - 0.001, 
+                         method='nearest')
+    assert numpy.all(values == topo.Z[[5, 2], [3, 7]]), "Nearest values wrong"
+
+    # Points and cells outside of the topography
+    values = topo.sample([0.0, 1.1, 0.99], [0.0, 0.0, 0.0], 
+                         method='cell_average', cell_size=0.1)
+    assert numpy.all(numpy.isnan(values[1:])) and not numpy.isnan(values[0])
+    assert numpy.isnan(topo.sample(0.0, -1.0))
+
+    # Cell averages of a general function against a fine quadrature of the
+    # bilinear interpolant, cells touching masked values are nan
+    topo = topotools.Topography(topo_func=topo_bowl_hill)
+    topo.x = numpy.linspace(-1.0, 1.0, 41)
+    topo.y = numpy.linspace(-1.0, 1.0, 31)
+    xc, yc, dx, dy = 0.123, -0.31, 0.17, 0.26
+    quad_x = xc + dx * (numpy.arange(400) + 0.5 - 200) / 400
+    quad_y = yc + dy * (numpy.arange(400) + 0.5 - 200) / 400
+    quad_X, quad_Y = numpy.meshgrid(quad_x, quad_y)
+    quad_average = topo.sample(quad_X, quad_Y).mean()
+    average = topo.sample([xc, 0.7], [yc, 0.8], method='cell_average', 
+                          cell_size=(dx, dy))
+    assert numpy.allclose(average[0], quad_average, rtol=1e-6)
+    for cell_size in [[dx, dy], numpy.array([dx, dy]),
+                      (numpy.array([dx, 0.1]), numpy.array([dy, 0.1]))]:
+        assert numpy.allclose(topo.sample([xc, 0.7], [yc, 0.8], 
+                                          method='cell_average', 
+                                          cell_size=cell_size)[0],
+                              quad_average, rtol=1e-6)
+
+    topo.Z = numpy.ma.masked_where(topo.Z > 0.0, topo.Z)
+    average = topo.sample([xc, 0.7], [yc, 0.8], method='cell_average', 
+                          cell_size=(dx, dy))
+    assert numpy.allclose(average[0], quad_average, rtol=1e-6)
+    assert numpy.isnan(average[1]) and numpy.isnan(topo.sample(0.7, 0.8))
+
+
+def test_mosaic():
+    r"""Test merging of overlapping topography with the finest on top."""
+
+    # Bilinear functions so that cell integrals are known exactly
+    coarse_func = lambda x, y: 1.0 + 2.0 * x - 3.0 * y + x * y
+    fine_func = lambda x, y: -2.0 + x + 0.5 * x * y
+    coarse = topotools.Topography(topo_func=coarse_func)
+    coarse.x = numpy.linspace(0.0, 1.0, 11)
+    coarse.y = numpy.linspace(0.0, 1.0, 11)
+    fine = topotools.Topography(topo_func=fine_func)
+    fine.x = numpy.linspace(0.3, 0.6, 13)
+    fine.y = numpy.linspace(0.2, 0.5, 13)
+
+    # Integral of a bilinear function over a rectangle, zero if empty
+    def integral(func, x1, x2, y1, y2):
+        area = numpy.maximum(x2 - x1, 0.0) * numpy.maximum(y2 - y1, 0.0)
+        return area * func(0.5 * (x1 + x2), 0.5 * (y1 + y2))
+
+    extent = [0.0, 1.0, 0.0, 1.2]
+    dx, dy = 0.07, 0.06
+    merged = topotools.mosaic([fine, coarse], extent, (dx, dy))
+    assert merged.Z.shape == (20, 14)
+    X, Y = numpy.meshgrid(merged.x, merged.y)
+    x1, x2, y1, y2 = X - dx / 2, X + dx / 2, Y - dy / 2, Y + dy / 2
+    xf1, xf2 = numpy.maximum(x1, 0.3), numpy.minimum(x2, 0.6)
+    yf1, yf2 = numpy.maximum(y1, 0.2), numpy.minimum(y2, 0.5)
+    average = (integral(coarse_func, x1, x2, y1, y2) 
+               - integral(coarse_func, xf1, xf2, yf1, yf2)
+               + integral(fine_func, xf1, xf2, yf1, yf2)) / (dx * dy)
+    covered = y2 <= 1.0 + 1e-12
+    assert numpy.all(numpy.isnan(merged.Z[~covered])), \
+        "Cells not covered by topography should be nan"
+    assert numpy.allclose(merged.Z[covered], average[covered]), \
+        "Cell averages of merged topography wrong"
+
+    # Finest file wins at points, regardless of the order of the files
+    merged = topotools.mosaic([coarse, fine], extent, (dx, dy), 
+                              method='bilinear')
+    in_fine = (0.3 <= X) & (X <= 0.6) & (0.2 <= Y) & (Y <= 0.5)
+    assert numpy.allclose(merged.Z[in_fine], fine_func(X, Y)[in_fine])
+    assert numpy.allclose(merged.Z[covered & ~in_fine], 
+                          coarse_func(X, Y)[covered & ~in_fine])
+
+    # The later of two files with the same resolution wins, also in parallel
+    coarse = topotools.Topography(topo_func=coarse_func)
+    coarse.x = numpy.linspace(0.0, 1.0, 9)
+    coarse.y = numpy.linspace(0.0, 1.0, 9)
+    other = topotools.Topography(topo_func=lambda x, y: 0.0 * x + 7.0)
+    other.x = numpy.linspace(0.5, 1.0, 5)
+    other.y = numpy.linspace(0.5, 1.0, 5)
+    merged = topotools.mosaic([coarse, other], [0, 1, 0, 1], 0.125)
+    assert numpy.allclose(merged.Z[4:, 4:], 7.0)
+    merged = topotools.mosaic([other, coarse, fine], [0, 1, 0, 1], 0.125)
+    assert numpy.allclose(merged.Z[4:, 4:], coarse_func(*numpy.meshgrid(
+                                        merged.x[4:], merged.y[4:])))
+    parallel = topotools.mosaic([other, coarse, fine], [0, 1, 0, 1], 0.125,
+                                n_workers=2)
+    assert numpy.allclose(parallel.Z, merged.Z, rtol=1e-12, atol=1e-12), \
+        "Parallel mosaic differs"
+
+
+def test_topo_catalog():
+    r"""Test spatial queries of a catalog of topography files."""
+
+    temp_path = tempfile.mkdtemp()
+    node_size = topotools.catalog_node_size
+
+    try:
+        # Tiles of random position and resolution in several formats
+        numpy.random.seed(18)
+        paths = []
+        for n in xrange(40):
+            delta = [0.01, 0.02, 0.05][n % 3]
+            x0, y0 = numpy.round(numpy.random.uniform(0.0, 2.0, 2), 2)
+            topo = topotools.Topography(topo_func=topo_bowl)
+            topo.x = x0 + delta * numpy.arange(numpy.random.randint(2, 30))
+            topo.y = y0 + delta * numpy.arange(numpy.random.randint(2, 30))
+            path = os.path.join(temp_path, 'tile_%s.tt%s' % (n, n % 4 + 1))
+            topo.write(path, topo_type=n % 4 + 1)
+            paths.append(path)
+
+        # A small node size gives a tree with several levels
+        topotools.catalog_node_size = 3
+        index_path = os.path.join(temp_path, 'index.json')
+        catalog = topotools.TopoCatalog(paths, index_path=index_path)
+        assert len(catalog._tree[1]) > 2
+
+        # Compare against reading every file
+        topos = [topotools.Topography(path=path) for path in paths]
+        regions = [[0.7, 1.3, 0.5, 1.1], [1.0, 1.02, 1.0, 1.02]]
+        for (region, resolution, cover) in itertools.product(regions,
+                                                   [None, 0.02], [False, True]):
+            expected = []
+            for topo in topos:
+                x1, x2, y1, y2 = topo.extent
+                if cover:
+                    inside = x1 <= region[0] and region[1] <= x2 and \
+                             y1 <= region[2] and region[3] <= y2
+                else:
+                    inside = x1 <= region[1] and region[0] <= x2 and \
+                             y1 <= region[3] and region[2] <= y2
+                if resolution is not None:
+                    inside = inside and topo.x[1] - topo.x[0] \
+                                                < resolution + 1e-12
+                if inside:
+                    expected.append(os.path.abspath(topo.path))
+            entries = catalog.query(region, resolution=resolution, 
+                                    cover=cover)
+            assert sorted(entry['path'] for entry in entries) == \
+                   sorted(expected), "Catalog query is wrong"
+            deltas = numpy.array([entry['delta'][0] for entry in entries])
+            assert numpy.all(numpy.diff(deltas) > -1e-12), \
+                "Entries not finest first"
+
+        # Read data covers the region, also one smaller than a grid cell,
+        # and extends at most one grid cell beyond it
+        for region in regions + [[1.011, 1.013, 1.012, 1.014]]:
+            for cover in [False, True]:
+                entries = catalog.query(region, cover=cover)
+                topos = catalog.read(region, cover=cover)
+                assert len(topos) == len(entries)
+                assert len(entries) > 0 or (cover and region == regions[0])
+                for (entry, topo) in zip(entries, topos):
+                    dx, dy = entry['delta']
+                    assert region[0] - dx < topo.x[0] and \
+                           topo.x[-1] < region[1] + dx
+                    assert region[2] - dy < topo.y[0] and \
+                           topo.y[-1] < region[3] + dy
+                    if cover:
+                        assert topo.x[0] <= region[0] and \
+                               region[1] <= topo.x[-1]
+                        assert topo.y[0] <= region[2] and \
+                               region[3] <= topo.y[-1]
+
+        # Unchanged files are taken from the index, modified ones are read
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        for entry in index['entries']:
+            entry['no_data_value'] = 123.0
+        with open(index_path, 'w') as index_file:
+            json.dump(index, index_file)
+        stat = os.stat(paths[0])
+        os.utime(paths[0], (stat.st_atime, stat.st_mtime + 10.0))
+        catalog = topotools.TopoCatalog(paths, index_path=index_path, 
+                                        n_workers=2)
+        assert catalog.entries[0]['no_data_value'] != 123.0
+        assert all(entry['no_data_value'] == 123.0 
+                   for entry in catalog.entries[1:])
+
+    finally:
+        topotools.catalog_node_size = node_size
+        shutil.rmtree(temp_path)
+
+
+def test_contour_lines():
+    r"""Test marching squares contours against known level sets."""
+
+    x = numpy.linspace(-1.0, 1.0, 81)
+    y = numpy.linspace(-1.2, 1.2, 97)
+    X, Y = numpy.meshgrid(x, y)
+    Z = X**2 + Y**2
+
+    # A circle is a single closed line
+    xy = topotools.contour_lines(x, y, Z, 0.25)
+    assert not numpy.any(numpy.isnan(xy)), "Circle should be one line"
+    assert numpy.all(xy[0] == xy[-1]), "Closed line should repeat first point"
+    assert numpy.allclose(numpy.sqrt(xy[:,0]**2 + xy[:,1]**2), 0.5, 
+                          atol=1e-3)
+
+    # Higher values are on the left, the circle is clockwise
+    area = 0.5 * numpy.sum(xy[:-1,0] * xy[1:,1] - xy[1:,0] * xy[:-1,1])
+    assert numpy.allclose(area, -numpy.pi * 0.25, rtol=1e-2)
+
+    # Several levels at once, in tiles in parallel and through Topography 
+    topo = topotools.Topography(topo_func=lambda x, y: x**2 + y**2 - 0.8)
+    topo.x = x
+    topo.y = y
+    levels = [0.25, 1.5]
+    lines = topotools.contour_lines(x, y, Z, levels)
+    block_size = topotools.contour_block_size
+    try:
+        topotools.contour_block_size = 200
+        tiled = topo.make_shoreline_xy([level - 0.8 for level in levels], 
+                                       n_workers=2)
+    finally:
+        topotools.contour_block_size = block_size
+    for (n, level) in enumerate(levels):
+        single = topotools.contour_lines(x, y, Z, level)
+        for xy in [lines[n], tiled[n]]:
+            assert xy.shape == single.shape and \
+                   numpy.all(numpy.isnan(xy) == numpy.isnan(single)) and \
+                   numpy.allclose(xy[~numpy.isnan(xy)], 
+                                  single[~numpy.isnan(single)]), \
+                   "Contour lines of several levels or tiles differ"
+
+    # Level 1.5 crosses the boundary in 4 open lines ending on the boundary
+    parts = numpy.split(lines[1], numpy.isnan(lines[1][:,0]).nonzero()[0])
+    parts = [part[~numpy.isnan(part[:,0])] for part in parts]
+    assert len(parts) == 4
+    for part in parts:
+        for point in [part[0], part[-1]]:
+            assert numpy.isclose(abs(point[0]), 1.0) or \
+                   numpy.isclose(abs(point[1]), 1.2)
+        assert numpy.allclose(numpy.sqrt(part[:,0]**2 + part[:,1]**2), 
+                              numpy.sqrt(1.5), atol=1e-3)
+
+    # Masked values cut the line
+    Z = numpy.ma.masked_where((X > 0.3) & (abs(Y) < 0.1), Z)
+    xy = topotools.contour_lines(x, y, Z, 0.25)
+    assert numpy.sum(numpy.isnan(xy[:,0])) == 0
+    assert numpy.hypot(*(xy[0] - xy[-1])) > 0.1, "Line should be opened"
+    assert numpy.allclose(numpy.sqrt(xy[:,0]**2 + xy[:,1]**2), 0.5, 
+                          atol=1e-3)
+
+
+def test_resample():
+    r"""Test coarsening of topography by block means and cell integrals."""
+
+    temp_path = tempfile.mkdtemp()
+    block_size = topotools.resample_block_size
+
+    try:
+        func = lambda x, y: 2.0 + 3.0 * x - y + 0.5 * x * y
+        topo = topotools.Topography(topo_func=func)
+        topo.x = numpy.linspace(0.0, 1.0, 101)
+        topo.y = numpy.linspace(0.0, 0.8, 81)
+        Z = topo.Z.copy()
+        Z[10:13, 20:24] = topo.no_data_value
+        Z[40:43, 50:53] = numpy.nan
+        topo.Z = numpy.ma.masked_where((topo.X > 0.9) & (topo.Y > 0.7), Z)
+        missing = numpy.ma.getmaskarray(topo.Z) | numpy.isnan(Z) \
+                | (Z == topo.no_data_value)
+
+        # Block means skip missing values
+        coarse = topo.resample(0.04, method='block_mean')
+        assert coarse.Z.shape == (20, 25)
+        assert numpy.allclose(coarse.x, topo.x[:100].reshape(25, 4).mean(1))
+        good = numpy.where(missing, 0.0, numpy.ma.getdata(topo.Z))
+        count = (~missing)[:80,:100].reshape(20, 4, 25, 4).sum(3).sum(1)
+        total = good[:80,:100].reshape(20, 4, 25, 4).sum(3).sum(1)
+        assert numpy.all(coarse.Z.mask == (count == 0))
+        assert numpy.allclose(coarse.Z[count > 0],
+                              total[count > 0] / count[count > 0])
+
+        # Cell integrals and bilinear values of a bilinear function are exact
+        # away from missing data
+        for method in ['cell_integral', 'bilinear']:
+            coarse = topo.resample((0.03, 0.05), method=method)
+            X, Y = numpy.meshgrid(coarse.x, coarse.y)
+            if method == 'cell_integral':
+                assert numpy.allclose(X[0,:2], [0.015, 0.045])
+                assert X.max() < 1.0 and Y.max() < 0.8
+            else:
+                assert numpy.allclose(X[0,:2], [0.0, 0.03])
+            assert numpy.allclose(coarse.Z[~coarse.Z.mask], 
+                                  func(X, Y)[~coarse.Z.mask])
+            assert numpy.any(coarse.Z.mask)
+
+        # Without missing data nothing is masked for any chunk size, also
+        # with chunks holding only the last row of the data
+        complete = topotools.Topography()
+        complete.x = numpy.linspace(0.0, 1.0, 11)
+        complete.y = numpy.linspace(0.0, 1.0, 11)
+        complete.Z = func(*numpy.meshgrid(complete.x, complete.y))
+        for chunk_size in [block_size, 22, 11]:
+            topotools.resample_block_size = chunk_size
+            for method in ['cell_integral', 'bilinear']:
+                coarse = complete.resample(0.1, method=method)
+                X, Y = numpy.meshgrid(coarse.x, coarse.y)
+                assert not numpy.any(numpy.ma.getmaskarray(coarse.Z))
+                assert numpy.allclose(coarse.Z, func(X, Y)), \
+                    "Resampling with block size %s differs for %s" \
+                    % (chunk_size, method)
+
+        # Chunks of a memory-mapped file give the same result
+        path = os.path.join(temp_path, 'resample.tt4')
+        topo.write(path, no_data_value=topo.no_data_value)
+        mapped = topotools.Topography(path=path)
+        assert isinstance(mapped.Z, numpy.memmap)
+        topotools.resample_block_size = 300
+        for method in ['block_mean', 'cell_integral', 'bilinear']:
+            expected = topo.resample((0.03, 0.04), method=method) \
+                       if method != 'block_mean' else topo.resample(0.04)
+            result = mapped.resample((0.03, 0.04), method=method) \
+                     if method != 'block_mean' else mapped.resample(0.04)
+            assert numpy.all(result.Z.mask == expected.Z.mask)
+            assert numpy.ma.allclose(result.Z, expected.Z), \
+                "Resampling in chunks differs for %s" % method
+
+    finally:
+        topotools.resample_block_size = block_size
+        shutil.rmtree(temp_path)
+
+
+def test_replace_no_data_values():
+    r"""Test filling of no_data_value holes in topography."""
+
+    try:
+        import scipy
+    except:
+        raise nose.SkipTest("Skipping test since scipy not found")
+
+    topo = topotools.Topography(topo_func=topo_bowl)
+    topo.x = numpy.linspace(-1.0, 1.0, 21)
+    topo.y = numpy.linspace(-1.0, 1.0, 16)
+    Z = topo.Z.copy()
+    mask = numpy.zeros(Z.shape, dtype=bool)
+    mask[3:9, 4:7] = True
+    mask[0, 0] = True
+    mask[-1, 10:] = True
+
+    # Average of good data in smallest square containing any
+    Z_fill = Z.copy()
+    for i, j in zip(*mask.nonzero()):
+        for r in xrange(1, max(Z.shape)):
+            window = (slice(max(i - r, 0), i + r + 1), 
+                      slice(max(j - r, 0), j + r + 1))
+            if numpy.any(~mask[window]):
+                Z_fill[i, j] = Z[window][~mask[window]].mean()
+                break
+
+    for method in ['fill', 'nearest']:
+        topo.Z = Z.copy()
+        topo.Z[mask] = topo.no_data_value
+        topo.replace_no_data_values(method=method)
+        assert numpy.all(topo.Z[~mask] == Z[~mask])
+        if method == 'fill':
+            assert numpy.allclose(topo.Z, Z_fill), "Filled values are wrong"
+        else:
+            assert topo.Z[3, 5] == Z[2, 5], "Nearest value wrong"
+            assert numpy.all(numpy.in1d(topo.Z[mask], Z[~mask]))
+
+    # Masked no data values and a list of indices
+    topo.Z = numpy.ma.masked_where(mask, Z)
+    topo.replace_no_data_values()
+    assert not numpy.any(topo.Z.mask)
+    assert numpy.allclose(topo.Z, Z_fill)
+
+    topo.Z = Z.copy()
+    topo.replace_values(zip(*mask.nonzero()))
+    assert numpy.allclose(topo.Z, Z_fill)
+
+
+def test_smooth_data():
+    r"""Test smoothing of topography by averaging over a square."""
+
+    topo = topotools.Topography(topo_func=topo_bowl_hill)
+    topo.x = numpy.linspace(-1.0, 1.0, 21)
+    topo.y = numpy.linspace(-1.0, 1.0, 16)
+    Z = topo.Z.copy()
+    mask = numpy.zeros(Z.shape, dtype=bool)
+    mask[3:9, 4:7] = True
+    mask[0, 0] = True
+    mask[-1, 10:] = True
+
+    for r in [1, 3]:
+        # Average of the unsmoothed data in the square of radius r
+        Z_smooth = Z.copy()
+        for i, j in zip(*mask.nonzero()):
+            window = (slice(max(i - r, 0), i + r + 1), 
+                      slice(max(j - r, 0), j + r + 1))
+            Z_smooth[i, j] = Z[window].mean()
+
+        topo.Z = Z.copy()
+        topo.smooth_data(zip(*mask.nonzero()), r=r)
+        assert numpy.allclose(topo.Z, Z_smooth), "Smoothed values are wrong"
+
+        topo.Z = Z.copy()
+        topo.smooth_data(mask, r=r)
+        assert numpy.allclose(topo.Z, Z_smooth), "Smoothed values are wrong"
+
+        Z_filter = fixdata.filterdata(Z.copy(), zip(*mask.nonzero()), r)
+        assert numpy.allclose(Z_filter, Z_smooth), "Filtered values are wrong"
+
+
+def test_in_poly():
+    r"""Test masking of topography by polygons with holes."""
+
+    topo = topotools.Topography(topo_func=topo_bowl)
+    topo.x = numpy.linspace(-1.0, 1.0, 41)
+    topo.y = numpy.linspace(-1.0, 1.0, 31)
+
+    # Square with a triangular hole and a separate diamond
+    outer = [(-0.91, -0.93), (0.52, -0.93), (0.52, 0.61), (-0.91, 0.61)]
+    hole = [(-0.53, -0.47), (0.21, -0.47), (-0.13, 0.29)]
+    diamond = [(0.77, -0.21), (0.96, 0.2), (0.77, 0.61), (0.58, 0.2)]
+    polygons = [outer, hole, diamond]
+
+    # Brute force ray casting
+    X, Y = numpy.meshgrid(topo.x, topo.y)
+    inside = numpy.zeros(X.shape, dtype=bool)
+    for ring in polygons:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            crosses = (y0 <= Y) != (y1 <= Y)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x0 + (Y - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= crosses & (x_cross < X)
+    assert inside.any() and not inside.all()
+
+    assert numpy.all(topo.in_poly(polygons) == inside), "Polygon mask wrong"
+
+    # Rings separated by nan and small blocks
+    polygon_xy = numpy.vstack([numpy.vstack((ring, [numpy.nan, numpy.nan]))
+                               for ring in polygons])
+    block_size = topotools.polygon_block_size
+    try:
+        topotools.polygon_block_size = 7
+        mask = topotools.polygon_mask(topo.x, topo.y, polygon_xy)
+    finally:
+        topotools.polygon_block_size = block_size
+    assert numpy.all(mask == inside), "Blocked polygon mask wrong"
+
+    # Single ring and masked topography
+    assert numpy.all(topo.in_poly(diamond) == 
+                     topotools.polygon_mask(topo.x, topo.y, [diamond]))
+    masked_topo = topo.in_poly(polygons, masked=True)
+    assert numpy.all(masked_topo.Z.mask == ~inside)
+    assert numpy.all(masked_topo.Z[inside] == topo.Z[inside])
+
+
 def plot_topo_bowl_hill():
 
     """
@@ -365,7 +1031,21 @@ if __name__ == "__main__":
         test_crop_topo_bowl()
         test_against_old()
         test_read_write_topo_bowl_hill()
+        test_read_write_compressed_topo()
+        test_read_filter_region()
+        test_read_write_binary_topo()
         test_get_remote_file()
         test_unstructured_topo()
+        test_unstructured_proximity()
+        test_unstructured_masked_fill()
+        test_lazy_coordinates()
+        test_sample()
+        test_mosaic()
+        test_topo_catalog()
+        test_contour_lines()
+        test_resample()
+        test_replace_no_data_values()
+        test_smooth_data()
+        test_in_poly()
 
         print "All tests passed."